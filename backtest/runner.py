@@ -0,0 +1,262 @@
+"""
+Бэктест стратегии Дончиана на исторических данных HistoricInstrument.
+Данные строятся по свечам из локального хранилища (CandleStore), параметры фьючерса берутся из сохранённого
+справочника инструментов, так что бэктест не обращается к API. Старые файлы .pkl принимаются с флагом --pkl.
+Цены каждого бара подаются в StrategyContext.on_new_price, заявки исполняет SimulatedBroker.
+Уровни на баре i считаются по барам до i-1 включительно, так что стратегия не видит будущих данных.
+Несколько инструментов и наборов параметров прогоняются параллельно в отдельных процессах.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import copy
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Iterable, Optional
+
+import numpy as np
+
+from backtest.simulated_broker import FillModel, SimulatedBroker, SimulatedConnect, SlippageModel
+from data_create.candle_store import CandleStore, candle_store
+from data_create.historic_future import HistoricInstrument
+from data_create.indicators import to_decimal
+from strategy.docnhian import StrategyContext
+from trad.instrument_index import InstrumentIndex
+
+
+@dataclass
+class BacktestParams:
+    long_window: int = 20
+    short_window: int = 10
+    atr_period: int = 20
+    atr_method: str = 'sma'
+    slippage_ticks: int = 0
+    fill_ratio: float = 1.0
+    commission: float = 0.0
+    initial_capital: float = 1_000_000
+    unit_step: float = 0.5
+    max_units: int = 4
+    trail_at_max_units: bool = False
+
+
+@dataclass
+class BacktestResult:
+    name: str
+    params: BacktestParams
+    pnl: float = 0.0
+    max_drawdown: float = 0.0
+    trades: int = 0
+    bars: int = 0
+    prices: int = 0
+    elapsed: float = 0.0
+    equity: list[float] = field(default_factory=list, repr=False)
+
+    @property
+    def prices_per_second(self) -> float:
+        return self.prices / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def trades_per_second(self) -> float:
+        return self.trades / self.elapsed if self.elapsed else 0.0
+
+
+def bar_prices(open_: Decimal, high: Decimal, low: Decimal, close: Decimal) -> tuple[Decimal, ...]:
+    """
+    Порядок цен внутри бара: открытие, ближний к открытию экстремум, дальний экстремум, закрытие.
+    """
+    if close >= open_:
+        return open_, low, high, close
+    return open_, high, low, close
+
+
+def as_decimal(value) -> Decimal:
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+class LevelCache:
+    """
+    Уровни индикаторов инструмента, посчитанные один раз для всех наборов параметров.
+    Каналы и ATR считаются векторно и сразу переводятся в Decimal, так что прогоны
+    с одинаковыми окнами используют одни и те же значения.
+    """
+
+    def __init__(self, historic: HistoricInstrument) -> None:
+        self.engine = historic.indicator_engine()
+        self.tick = historic.tick_size
+        self._channels: dict[int, tuple[list, list]] = {}
+        self._atr: dict[tuple[int, str], list] = {}
+
+    def _to_decimal(self, values: np.ndarray) -> list[Optional[Decimal]]:
+        return [to_decimal(value, self.tick) for value in values.tolist()]
+
+    def channel(self, window: int) -> tuple[list, list]:
+        """
+        Верхняя и нижняя граница канала Дончиана.
+        """
+        if window not in self._channels:
+            upper, lower = self.engine.donchian(window)[window]
+            self._channels[window] = (self._to_decimal(upper), self._to_decimal(lower))
+        return self._channels[window]
+
+    def atr(self, period: int, method: str = 'sma') -> list:
+        key = (period, method)
+        if key not in self._atr:
+            self._atr[key] = self._to_decimal(self.engine.atr(period, method))
+        return self._atr[key]
+
+
+def max_drawdown(equity: np.ndarray) -> float:
+    if not len(equity):
+        return 0.0
+    return float(np.max(np.maximum.accumulate(equity) - equity))
+
+
+async def replay(historic: HistoricInstrument, params: BacktestParams,
+                 levels: Optional[LevelCache] = None) -> BacktestResult:
+    """
+    Прогоняет стратегию по истории одного инструмента.
+    :param historic: Исторические данные инструмента (не изменяются).
+    :param params: Параметры стратегии и моделей исполнения.
+    :param levels: Общий кэш уровней инструмента (при переборе параметров).
+    :return: Результат бэктеста.
+    """
+    levels = levels or LevelCache(historic)
+    # Стратегия меняет только атрибуты уровней, данные свечей общие.
+    historic = copy.copy(historic)
+    data = historic.data
+    atr = levels.atr(params.atr_period, params.atr_method)
+    long_upper, long_lower = levels.channel(params.long_window)
+    short_upper, short_lower = levels.channel(params.short_window)
+
+    broker = SimulatedBroker(historic.instrument_info,
+                             fill_model=FillModel(params.fill_ratio),
+                             slippage_model=SlippageModel(params.slippage_ticks),
+                             initial_capital=Decimal(str(params.initial_capital)),
+                             commission=Decimal(str(params.commission)))
+    connect = SimulatedConnect(broker)
+    context = StrategyContext(historic)
+    context.unit_step = Decimal(str(params.unit_step))
+    context.max_units = params.max_units
+    context.trail_at_max_units = params.trail_at_max_units
+    result = BacktestResult(name=historic.instrument_info.name, params=params)
+
+    times = data['time'].tolist()
+    opens, highs, lows, closes = (data[column].tolist() for column in ('open', 'high', 'low', 'close'))
+    start = max(params.long_window, params.short_window)
+    started = time.perf_counter()
+    for i in range(start, len(data)):
+        # Уровни по закрытым барам до текущего.
+        historic.atr = atr[i - 1]
+        historic.max_donchian = long_upper[i - 1]
+        historic.min_donchian = long_lower[i - 1]
+        historic.max_short_donchian = short_upper[i - 1]
+        historic.min_short_donchian = short_lower[i - 1]
+        context.update_levels()
+
+        broker.now = times[i]
+        for price in bar_prices(as_decimal(opens[i]), as_decimal(highs[i]), as_decimal(lows[i]),
+                                as_decimal(closes[i])):
+            broker.market_price = price
+            await context.on_new_price(price, connect)
+            result.prices += 1
+        result.equity.append(float(broker.equity()))
+        result.bars += 1
+
+    result.elapsed = time.perf_counter() - started
+    result.trades = broker.trades
+    result.pnl = float(broker.equity() - broker.initial_capital)
+    result.max_drawdown = max_drawdown(np.asarray(result.equity))
+    return result
+
+
+def run_backtest(historic: HistoricInstrument, params: Optional[BacktestParams] = None) -> BacktestResult:
+    return asyncio.run(replay(historic, params or BacktestParams()))
+
+
+async def replay_many(historic: HistoricInstrument, params_list: list[BacktestParams]) -> list[BacktestResult]:
+    """
+    Прогоняет несколько наборов параметров по одному инструменту с общим кэшем уровней.
+    """
+    levels = LevelCache(historic)
+    return [await replay(historic, params, levels) for params in params_list]
+
+
+def _run_job(job: tuple[HistoricInstrument, BacktestParams]) -> BacktestResult:
+    return run_backtest(*job)
+
+
+def run_backtests(jobs: Iterable[tuple[HistoricInstrument, BacktestParams]],
+                  max_workers: Optional[int] = None) -> list[BacktestResult]:
+    """
+    Прогоняет бэктесты параллельно на всех ядрах.
+    :param jobs: Пары (исторические данные, параметры).
+    :param max_workers: Количество процессов (по умолчанию – по числу ядер).
+    :return: Результаты в порядке jobs.
+    """
+    jobs = list(jobs)
+    if max_workers == 1 or len(jobs) == 1:
+        return [_run_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(_run_job, jobs))
+
+
+def load_historics(instruments: Iterable[str], interval: str = '1d', pkl: bool = False,
+                    store: CandleStore = candle_store,
+                    index: Optional[InstrumentIndex] = None) -> list[HistoricInstrument]:
+    """
+    Исторические данные инструментов по сохранённым свечам.
+    :param instruments: uid, figi или тикеры (с pkl – пути к файлам HistoricInstrument без расширения).
+    :param interval: Интервал свечей в хранилище.
+    :param pkl: Загрузить старые файлы .pkl вместо хранилища свечей.
+    :param index: Справочник фьючерсов, по умолчанию читается с диска.
+    """
+    if pkl:
+        return [HistoricInstrument.from_pkl(path) for path in instruments]
+    if index is None:
+        index = InstrumentIndex()
+        index.load()
+    historics = []
+    for instrument_id in instruments:
+        future = index.get(instrument_id)
+        if future is None:
+            raise ValueError(f'Инструмент {instrument_id} не найден в справочнике {index.path}')
+        historics.append(HistoricInstrument.from_store(future, store, interval))
+    return historics
+
+
+def add_input_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('instruments', nargs='+', help='uid, figi или тикеры инструментов с сохранёнными свечами')
+    parser.add_argument('--interval', default='1d', help='Интервал свечей в хранилище')
+    parser.add_argument('--pkl', action='store_true',
+                        help='Вместо инструментов переданы пути к старым файлам HistoricInstrument без .pkl')
+
+
+def format_results(results: list[BacktestResult]) -> str:
+    lines = [f'{"Инструмент":<20} {"PnL":>14} {"Просадка":>14} {"Сделки":>7} {"Бары":>6} {"Цен/сек":>10}']
+    for result in results:
+        lines.append(f'{result.name[:20]:<20} {result.pnl:>14.2f} {result.max_drawdown:>14.2f} '
+                     f'{result.trades:>7} {result.bars:>6} {result.prices_per_second:>10.0f}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бэктест стратегии по сохранённым свечам')
+    add_input_arguments(parser)
+    parser.add_argument('--slippage', type=int, default=0, help='Проскальзывание в шагах цены')
+    parser.add_argument('--fill-ratio', type=float, default=1.0, help='Доля исполнения заявки')
+    parser.add_argument('--commission', type=float, default=0.0, help='Комиссия, доля от оборота')
+    parser.add_argument('--workers', type=int, default=None, help='Количество процессов')
+    args = parser.parse_args()
+
+    backtest_params = BacktestParams(slippage_ticks=args.slippage, fill_ratio=args.fill_ratio,
+                                     commission=args.commission)
+    started_all = time.perf_counter()
+    all_results = run_backtests([(historic, backtest_params)
+                                 for historic in load_historics(args.instruments, args.interval, args.pkl)],
+                                max_workers=args.workers)
+    print(format_results(all_results))
+    print(f'Всего {sum(r.prices for r in all_results)} цен за {time.perf_counter() - started_all:.2f} сек.')
@@ -0,0 +1,292 @@
+"""
+Симуляция брокера для бэктеста стратегии.
+Реализует локально методы API, которые вызывает стратегия (post_order, get_order_state, get_orders, replace_order,
+cancel_order, get_futures_margin, get_portfolio) и кэш портфеля со стоимостью счёта,
+так что StrategyContext работает без изменений.
+Цены заявок и ответов, как и в API, передаются в рублях, цены рынка – в пунктах.
+"""
+from __future__ import annotations
+
+import datetime
+import itertools
+from decimal import Decimal
+from typing import Iterator, Optional
+
+from tinkoff.invest import (
+    CancelOrderResponse, Future, GetFuturesMarginResponse, GetOrdersResponse, MoneyValue, OrderDirection,
+    OrderExecutionReportStatus, OrderState, OrderType, PortfolioResponse, PostOrderResponse, Quotation,
+    ReplaceOrderRequest)
+from tinkoff.invest.utils import decimal_to_quotation, quotation_to_decimal
+
+from trad.connect_tinkoff import ConnectTinkoff
+from trad.order_tracker import OrderTracker
+from trad.portfolio_cache import PortfolioCache
+
+
+def decimal_to_money(value: Decimal, currency: str = 'rub') -> MoneyValue:
+    quotation = decimal_to_quotation(value)
+    return MoneyValue(currency=currency, units=quotation.units, nano=quotation.nano)
+
+
+class SlippageModel:
+    """
+    Цена исполнения заявки.
+    Заявка исполняется по худшей из цен (лимит или рынок): в реальной торговле заявку,
+    от которой ушла цена, бот переставляет вслед за рынком. Сверху добавляется проскальзывание в шагах цены.
+    """
+
+    def __init__(self, ticks: int = 0) -> None:
+        """
+        :param ticks: Проскальзывание в минимальных шагах цены против направления заявки.
+        """
+        self.ticks = ticks
+
+    def price(self, long: bool, limit: Decimal, market: Decimal, tick: Decimal) -> Decimal:
+        slippage = tick * self.ticks
+        if long:
+            return max(limit, market) + slippage
+        return min(limit, market) - slippage
+
+
+class FillModel:
+    """
+    Объём исполнения заявки.
+    Неисполненный остаток сразу снимается (как у IOC заявки), поэтому частичное исполнение
+    проходит через ту же ветку статуса CANCELLED, что и в реальной торговле.
+    """
+
+    def __init__(self, fill_ratio: float = 1.0) -> None:
+        """
+        :param fill_ratio: Доля исполняемых лотов заявки (от 0 до 1).
+        """
+        if not 0 <= fill_ratio <= 1:
+            raise ValueError(f'Доля исполнения должна быть от 0 до 1: {fill_ratio}')
+        self.fill_ratio = fill_ratio
+
+    def lots(self, requested: int) -> int:
+        return int(requested * self.fill_ratio)
+
+
+class SimulatedBroker:
+    """
+    Счёт по одному инструменту: позиция, денежные средства и журнал заявок.
+    Время и цена рынка выставляются бэктестом перед каждой подачей цены в стратегию.
+    """
+
+    def __init__(self, instrument: Future,
+                 fill_model: Optional[FillModel] = None,
+                 slippage_model: Optional[SlippageModel] = None,
+                 initial_capital: Decimal = Decimal(1_000_000),
+                 commission: Decimal = Decimal(0),
+                 ids: Optional[Iterator[int]] = None) -> None:
+        """
+        :param instrument: Торгуемый фьючерс.
+        :param fill_model: Модель объёма исполнения.
+        :param slippage_model: Модель цены исполнения.
+        :param initial_capital: Начальный размер счёта в рублях.
+        :param commission: Комиссия как доля от оборота сделки.
+        :param ids: Счётчик номеров заявок, общий для нескольких брокеров, чтобы id заявок не пересекались.
+        """
+        self.instrument = instrument
+        self.fill_model = fill_model or FillModel()
+        self.slippage_model = slippage_model or SlippageModel()
+        self.initial_capital = Decimal(initial_capital)
+        self.commission = Decimal(commission)
+        self.tick = quotation_to_decimal(instrument.min_price_increment)
+        self.tick_amount = quotation_to_decimal(instrument.min_price_increment_amount)
+        self.lot = instrument.lot or 1
+
+        self.cash = self.initial_capital
+        self.position = 0
+        self.market_price = Decimal(0)
+        self.now = datetime.datetime.now(datetime.timezone.utc)
+        self.orders: dict[str, OrderState] = {}
+        self.trades = 0
+        self._ids = ids if ids is not None else itertools.count(1)
+
+    def to_rub(self, price: Decimal) -> Decimal:
+        """
+        Перевод цены из пунктов в рубли за один контракт.
+        """
+        return price / self.tick * self.tick_amount
+
+    def equity(self) -> Decimal:
+        """
+        Стоимость счёта по текущей цене рынка.
+        """
+        return self.cash + self.position * self.lot * self.to_rub(self.market_price)
+
+    def execute(self, direction: OrderDirection, quantity: int, price: Decimal,
+                order_request_id: str = '') -> OrderState:
+        """
+        Исполняет лимитную заявку по моделям исполнения и проскальзывания.
+        :param price: Цена заявки в пунктах.
+        :return: Итоговое состояние заявки (FILL или CANCELLED с исполненной частью).
+        """
+        long = direction == OrderDirection.ORDER_DIRECTION_BUY
+        lots = self.fill_model.lots(quantity)
+        fill_price = self.slippage_model.price(long, price, self.market_price, self.tick)
+        fill_rub = self.to_rub(fill_price)
+        amount = fill_rub * lots * self.lot
+        commission = amount * self.commission
+        if lots:
+            self.position += lots if long else -lots
+            self.cash += -amount if long else amount
+            self.cash -= commission
+            self.trades += 1
+
+        order_id = f'sim-{next(self._ids)}'
+        status = (OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL if lots == quantity
+                  else OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED)
+        order_state = OrderState(
+            order_id=order_id,
+            execution_report_status=status,
+            lots_requested=quantity,
+            lots_executed=lots,
+            initial_order_price=decimal_to_money(self.to_rub(price) * quantity * self.lot),
+            executed_order_price=decimal_to_money(fill_rub),
+            total_order_amount=decimal_to_money(amount),
+            average_position_price=decimal_to_money(fill_rub),
+            initial_commission=decimal_to_money(commission),
+            executed_commission=decimal_to_money(commission),
+            figi=self.instrument.figi,
+            direction=direction,
+            initial_security_price=decimal_to_money(self.to_rub(price)),
+            stages=[],
+            service_commission=decimal_to_money(Decimal(0)),
+            currency='rub',
+            order_type=OrderType.ORDER_TYPE_LIMIT,
+            order_date=self.now,
+            instrument_uid=self.instrument.uid,
+            order_request_id=order_request_id,
+        )
+        self.orders[order_id] = order_state
+        return order_state
+
+    def portfolio(self) -> PortfolioResponse:
+        return PortfolioResponse(total_amount_portfolio=decimal_to_money(self.equity()))
+
+
+def to_post_order_response(order_state: OrderState) -> PostOrderResponse:
+    return PostOrderResponse(
+        order_id=order_state.order_id,
+        execution_report_status=order_state.execution_report_status,
+        lots_requested=order_state.lots_requested,
+        lots_executed=order_state.lots_executed,
+        initial_order_price=order_state.initial_order_price,
+        executed_order_price=order_state.executed_order_price,
+        total_order_amount=order_state.total_order_amount,
+        initial_commission=order_state.initial_commission,
+        executed_commission=order_state.executed_commission,
+        figi=order_state.figi,
+        direction=order_state.direction,
+        initial_security_price=order_state.initial_security_price,
+        order_type=order_state.order_type,
+        instrument_uid=order_state.instrument_uid,
+        order_request_id=order_state.order_request_id,
+    )
+
+
+class SimulatedOrdersService:
+    def __init__(self, broker: SimulatedBroker) -> None:
+        self.broker = broker
+
+    async def post_order(self, instrument_id: str, quantity: int, price: Quotation, direction: OrderDirection,
+                         account_id: str, order_id: str, order_type: OrderType) -> PostOrderResponse:
+        order_state = self.broker.execute(direction, quantity, quotation_to_decimal(price), order_id)
+        return to_post_order_response(order_state)
+
+    async def get_order_state(self, account_id: str, order_id: str) -> OrderState:
+        return self.broker.orders[order_id]
+
+    async def get_orders(self, account_id: str) -> GetOrdersResponse:
+        # Активных заявок в симуляции не бывает: все исполняются или снимаются при выставлении.
+        return GetOrdersResponse(orders=[])
+
+    async def cancel_order(self, account_id: str, order_id: str) -> CancelOrderResponse:
+        # Все заявки симуляции уже в финальном статусе, снимать нечего.
+        return CancelOrderResponse(time=self.broker.now)
+
+    async def replace_order(self, request: ReplaceOrderRequest) -> PostOrderResponse:
+        old_order = self.broker.orders[request.order_id]
+        order_state = self.broker.execute(old_order.direction, request.quantity,
+                                          quotation_to_decimal(request.price), request.idempotency_key)
+        return to_post_order_response(order_state)
+
+
+class SimulatedInstrumentsService:
+    def __init__(self, broker: SimulatedBroker) -> None:
+        self.broker = broker
+
+    async def get_futures_margin(self, instrument_id: str) -> GetFuturesMarginResponse:
+        instrument = self.broker.instrument
+        return GetFuturesMarginResponse(
+            initial_margin_on_buy=instrument.initial_margin_on_buy,
+            initial_margin_on_sell=instrument.initial_margin_on_sell,
+            min_price_increment=instrument.min_price_increment,
+            min_price_increment_amount=instrument.min_price_increment_amount,
+        )
+
+
+class SimulatedOperationsService:
+    def __init__(self, broker: SimulatedBroker) -> None:
+        self.broker = broker
+
+    async def get_portfolio(self, account_id: str) -> PortfolioResponse:
+        return self.broker.portfolio()
+
+
+class SimulatedServices:
+    """
+    Замена AsyncServices: только сервисы, которые использует стратегия при торговле.
+    """
+
+    def __init__(self, broker: SimulatedBroker) -> None:
+        self.orders = SimulatedOrdersService(broker)
+        self.instruments = SimulatedInstrumentsService(broker)
+        self.operations = SimulatedOperationsService(broker)
+
+
+class SimulatedPortfolioCache(PortfolioCache):
+    """
+    Кэш портфеля, который всегда совпадает со счётом брокера, как будто стрим портфеля приходит мгновенно.
+    """
+
+    def __init__(self, broker: SimulatedBroker) -> None:
+        super().__init__(clock=lambda: broker.now)
+        self.broker = broker
+
+    @property
+    def total_amount(self) -> Decimal:
+        return self.broker.equity()
+
+    @total_amount.setter
+    def total_amount(self, value: Optional[Decimal]) -> None:
+        pass
+
+    @property
+    def total_updated_at(self) -> datetime.datetime:
+        return self.broker.now
+
+    @total_updated_at.setter
+    def total_updated_at(self, value: Optional[datetime.datetime]) -> None:
+        pass
+
+
+class SimulatedConnect(ConnectTinkoff):
+    """
+    Подключение, которое вместо API отправляет заявки в SimulatedBroker.
+    """
+
+    def __init__(self, broker: SimulatedBroker) -> None:
+        super().__init__(token=None)
+        self.broker = broker
+        self.client = SimulatedServices(broker)
+        self.order_tracker = OrderTracker()
+        self.portfolio_cache = SimulatedPortfolioCache(broker)
+
+    async def connection(self):
+        pass
+
+    async def disconnect(self):
+        pass
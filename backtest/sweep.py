@@ -0,0 +1,131 @@
+"""
+Перебор параметров стратегии по сетке: окна каналов Дончиана, период ATR, шаг добавления юнита и максимум юнитов.
+Сетка каждого инструмента делится на части по числу процессов, внутри части каналы и ATR считаются
+один раз на инструмент и переиспользуются всеми наборами параметров.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional
+
+from backtest.runner import BacktestParams, BacktestResult, add_input_arguments, load_historics, replay_many
+from data_create.historic_future import HistoricInstrument
+
+RANK_KEYS = ('pnl', 'pnl_to_drawdown', 'max_drawdown')
+
+
+def make_grid(long_windows: Iterable[int],
+              short_windows: Iterable[int],
+              atr_periods: Iterable[int],
+              unit_steps: Iterable[float],
+              max_units: Iterable[int],
+              base: Optional[BacktestParams] = None) -> list[BacktestParams]:
+    """
+    Все сочетания параметров. Сочетания, где канал выхода не короче канала входа, пропускаются.
+    :param base: Остальные параметры (модели исполнения, капитал).
+    :return: Список наборов параметров.
+    """
+    base = base or BacktestParams()
+    grid = []
+    for long_window, short_window, atr_period, unit_step, units in itertools.product(
+            long_windows, short_windows, atr_periods, unit_steps, max_units):
+        if short_window >= long_window:
+            continue
+        grid.append(dataclasses.replace(base, long_window=long_window, short_window=short_window,
+                                        atr_period=atr_period, unit_step=unit_step, max_units=units))
+    return grid
+
+
+def chunks(items: list, count: int) -> list[list]:
+    count = max(1, min(count, len(items)))
+    return [items[i::count] for i in range(count)]
+
+
+def _run_chunk(job: tuple[HistoricInstrument, list[BacktestParams]]) -> list[BacktestResult]:
+    historic, params_list = job
+    results = asyncio.run(replay_many(historic, params_list))
+    for result in results:
+        # Кривая капитала каждого прогона не нужна для таблицы, не гоняем её между процессами.
+        result.equity = []
+    return results
+
+
+def run_sweep(historics: Iterable[HistoricInstrument], grid: list[BacktestParams],
+              max_workers: Optional[int] = None) -> list[BacktestResult]:
+    """
+    Прогоняет сетку параметров по каждому инструменту в пуле процессов.
+    :param historics: Исторические данные инструментов.
+    :param grid: Наборы параметров.
+    :param max_workers: Количество процессов (по умолчанию – по числу ядер).
+    :return: Результаты всех прогонов (без сортировки).
+    """
+    workers = max_workers or multiprocessing.cpu_count()
+    jobs = [(historic, part) for historic in historics for part in chunks(grid, workers)]
+    if workers == 1:
+        return [result for job in jobs for result in _run_chunk(job)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return [result for part in pool.map(_run_chunk, jobs) for result in part]
+
+
+def rank_value(result: BacktestResult, key: str) -> float:
+    if key == 'pnl_to_drawdown':
+        return result.pnl / result.max_drawdown if result.max_drawdown else result.pnl
+    if key == 'max_drawdown':
+        return -result.max_drawdown
+    return result.pnl
+
+
+def rank(results: list[BacktestResult], key: str = 'pnl') -> list[BacktestResult]:
+    """
+    Сортирует результаты от лучшего к худшему.
+    :param key: 'pnl', 'pnl_to_drawdown' или 'max_drawdown' (меньшая просадка лучше).
+    """
+    if key not in RANK_KEYS:
+        raise ValueError(f'Неизвестный критерий сортировки: {key}')
+    return sorted(results, key=lambda result: rank_value(result, key), reverse=True)
+
+
+def format_table(results: list[BacktestResult], limit: Optional[int] = None) -> str:
+    lines = [f'{"#":>3} {"Инструмент":<20} {"Long":>4} {"Short":>5} {"ATR":>4} {"Шаг":>5} {"Юниты":>5} '
+             f'{"PnL":>14} {"Просадка":>14} {"Сделки":>7}']
+    for place, result in enumerate(results[:limit], start=1):
+        params = result.params
+        lines.append(f'{place:>3} {result.name[:20]:<20} {params.long_window:>4} {params.short_window:>5} '
+                     f'{params.atr_period:>4} {params.unit_step:>5} {params.max_units:>5} '
+                     f'{result.pnl:>14.2f} {result.max_drawdown:>14.2f} {result.trades:>7}')
+    return '\n'.join(lines)
+
+
+def parse_list(value: str, cast=int) -> list:
+    return [cast(item) for item in value.split(',') if item]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Перебор параметров стратегии по сохранённым свечам')
+    add_input_arguments(parser)
+    parser.add_argument('--long', default='20,40,55', help='Окна канала входа через запятую')
+    parser.add_argument('--short', default='10,20', help='Окна канала выхода через запятую')
+    parser.add_argument('--atr', default='14,20', help='Периоды ATR через запятую')
+    parser.add_argument('--step', default='0.5,1', help='Шаг добавления юнита в ATR через запятую')
+    parser.add_argument('--units', default='1,2,4', help='Максимум юнитов через запятую')
+    parser.add_argument('--trail-at-max-units', action='store_true',
+                        help='Переносить стоп на канал выхода только при позиции в максимум юнитов')
+    parser.add_argument('--rank', default='pnl', choices=RANK_KEYS, help='Критерий сортировки')
+    parser.add_argument('--top', type=int, default=30, help='Сколько строк вывести')
+    parser.add_argument('--workers', type=int, default=None, help='Количество процессов')
+    args = parser.parse_args()
+
+    sweep_grid = make_grid(parse_list(args.long), parse_list(args.short), parse_list(args.atr),
+                           parse_list(args.step, float), parse_list(args.units),
+                           BacktestParams(trail_at_max_units=args.trail_at_max_units))
+    started = time.perf_counter()
+    all_results = run_sweep(load_historics(args.instruments, args.interval, args.pkl), sweep_grid,
+                            max_workers=args.workers)
+    print(format_table(rank(all_results, args.rank), args.top))
+    print(f'{len(all_results)} прогонов за {time.perf_counter() - started:.2f} сек.')
@@ -0,0 +1,191 @@
+"""
+Замер скорости и пиковой памяти HistoricInstrument на синтетических свечах разной длины:
+построение из списка HistoricCandle (конструктор и from_candles), create_atr, create_donchian_canal,
+save_to_csv и from_pkl.
+Время – лучший и средний из нескольких прогонов, память – пик выделений по tracemalloc в отдельном прогоне.
+Результаты сохраняются в JSON, отчёт другого коммита можно передать в --compare для сравнения.
+Запуск: python -m benchmarks.bench_historic_instrument --sizes 250 100000 500000 --json results.json
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Callable, Optional
+
+from tinkoff.invest import Future, HistoricCandle, MoneyValue
+from tinkoff.invest.utils import decimal_to_quotation
+
+from data_create.historic_future import HistoricInstrument
+
+SIZES = (250, 100_000, 500_000)
+OPERATIONS = ('__init__', 'from_candles', 'create_atr', 'create_donchian_canal', 'save_to_csv', 'from_pkl')
+START = datetime.datetime(2024, 1, 1, 7, tzinfo=datetime.timezone.utc)
+TICK = Decimal('0.01')
+
+
+def synthetic_instrument() -> Future:
+    return Future(figi='FUTBENCH', uid='uid-bench', name='Bench future', ticker='BENCH', lot=1,
+                  min_price_increment=decimal_to_quotation(TICK),
+                  min_price_increment_amount=decimal_to_quotation(TICK),
+                  initial_margin_on_buy=MoneyValue(currency='rub', units=1000, nano=0),
+                  initial_margin_on_sell=MoneyValue(currency='rub', units=1000, nano=0))
+
+
+def synthetic_candles(rows: int, seed: int = 0,
+                      interval: datetime.timedelta = datetime.timedelta(minutes=1)) -> list[HistoricCandle]:
+    """
+    Минутные свечи случайного блуждания с шагом цены TICK.
+    :param rows: Количество свечей.
+    :param seed: Зерно генератора (одинаковые свечи между прогонами и коммитами).
+    """
+    rng = random.Random(seed)
+    price = 10_000
+    candles = []
+    for i in range(rows):
+        open_ = price
+        price = max(100, price + rng.randint(-20, 20))
+        high = max(open_, price) + rng.randint(0, 10)
+        low = min(open_, price) - rng.randint(0, 10)
+        candles.append(HistoricCandle(open=decimal_to_quotation(Decimal(open_) * TICK),
+                                      high=decimal_to_quotation(Decimal(high) * TICK),
+                                      low=decimal_to_quotation(Decimal(low) * TICK),
+                                      close=decimal_to_quotation(Decimal(price) * TICK),
+                                      volume=rng.randint(1, 1000),
+                                      time=START + i * interval,
+                                      is_complete=True))
+    return candles
+
+
+@dataclass
+class BenchResult:
+    rows: int
+    operation: str
+    times: list[float] = field(default_factory=list)
+    peak_bytes: int = 0
+
+    @property
+    def best(self) -> float:
+        return min(self.times) if self.times else 0.0
+
+    @property
+    def mean(self) -> float:
+        return sum(self.times) / len(self.times) if self.times else 0.0
+
+    def to_dict(self) -> dict:
+        return {'rows': self.rows, 'operation': self.operation, 'times': self.times, 'best': self.best,
+                'mean': self.mean, 'peak_bytes': self.peak_bytes}
+
+
+def measure(rows: int, operation: str, func: Callable[[], object], repeat: int) -> BenchResult:
+    """
+    Время repeat прогонов func и пик памяти в ещё одном прогоне под tracemalloc.
+    """
+    result = BenchResult(rows, operation)
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        result.times.append(time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        result.peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def bench_size(rows: int, repeat: int, directory: str, seed: int = 0) -> list[BenchResult]:
+    instrument = synthetic_instrument()
+    candles = synthetic_candles(rows, seed)
+    historic = HistoricInstrument(instrument, candles)
+    path = os.path.join(directory, f'bench_{rows}')
+    historic.save_to_csv(path)
+    operations = {
+        '__init__': lambda: HistoricInstrument(instrument, candles),
+        'from_candles': lambda: HistoricInstrument.from_candles(instrument, candles),
+        'create_atr': lambda: historic.create_atr(20),
+        'create_donchian_canal': lambda: historic.create_donchian_canal(20, 10),
+        'save_to_csv': lambda: historic.save_to_csv(path),
+        'from_pkl': lambda: HistoricInstrument.from_pkl(path),
+    }
+    return [measure(rows, operation, operations[operation], repeat) for operation in OPERATIONS]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes: tuple[int, ...] = SIZES, repeat: int = 3, seed: int = 0) -> dict:
+    """
+    Прогоняет все операции на всех размерах.
+    :return: Отчёт для сохранения в JSON.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            results.extend(bench_size(rows, repeat, directory, seed))
+    return {'commit': git_commit(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'repeat': repeat,
+            'seed': seed,
+            'results': [result.to_dict() for result in results]}
+
+
+def format_report(report: dict, baseline: Optional[dict] = None) -> str:
+    """
+    Таблица результатов. С baseline добавляется отношение лучшего времени и пика памяти к отчёту baseline.
+    """
+    previous = {(item['rows'], item['operation']): item for item in (baseline or {}).get('results', [])}
+    header = f'{"Строк":>8} {"Операция":<22} {"Лучшее, с":>10} {"Среднее, с":>10} {"Пик, МБ":>9}'
+    if baseline:
+        header += f' {"Время x":>8} {"Память x":>9}'
+    lines = [header]
+    for item in report['results']:
+        line = (f'{item["rows"]:>8} {item["operation"]:<22} {item["best"]:>10.4f} {item["mean"]:>10.4f} '
+                f'{item["peak_bytes"] / 2 ** 20:>9.1f}')
+        if old := previous.get((item['rows'], item['operation'])):
+            time_ratio = item['best'] / old['best'] if old['best'] else 0.0
+            memory_ratio = item['peak_bytes'] / old['peak_bytes'] if old['peak_bytes'] else 0.0
+            line += f' {time_ratio:>8.2f} {memory_ratio:>9.2f}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замер HistoricInstrument на синтетических свечах')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='Количество свечей')
+    parser.add_argument('--repeat', type=int, default=3, help='Прогонов на замер времени')
+    parser.add_argument('--seed', type=int, default=0, help='Зерно синтетических свечей')
+    parser.add_argument('--json', help='Сохранить отчёт в JSON')
+    parser.add_argument('--compare', help='JSON отчёт другого коммита для сравнения')
+    args = parser.parse_args()
+
+    suite_report = run_suite(tuple(args.sizes), args.repeat, args.seed)
+    baseline_report = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as baseline_file:
+            baseline_report = json.load(baseline_file)
+    print(f'Коммит {suite_report["commit"]}, Python {suite_report["python"]}')
+    print(format_report(suite_report, baseline_report))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as json_file:
+            json.dump(suite_report, json_file, ensure_ascii=False, indent=2)
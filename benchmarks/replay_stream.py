@@ -0,0 +1,425 @@
+"""
+Воспроизведение стрима рыночных данных для замера задержек обработки.
+Записанные MarketDataResponse/TradesStreamResponse или синтетические цены с заданной частотой
+кладутся в ConnectTinkoff.queue/queue_order, дальше их обрабатывают processing_stream и
+processing_trades_stream без изменений. Заявки исполняют SimulatedBroker по инструментам.
+Замеряется задержка от поступления цены до вызова post_order, задержка до начала обработки цены актором,
+пропускная способность и задержки цикла событий. Логирование стрима настраивается как в боте (STREAM_LOG_LEVEL).
+Запуск: python -m benchmarks.replay_stream --instruments 20 --messages 50000 --rate 5000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextvars
+import datetime
+import itertools
+import json
+import logging
+import math
+import pickle
+import random
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal
+from typing import Iterable, Optional
+
+import numpy as np
+from tinkoff.invest import (
+    CancelOrderResponse, Future, GetFuturesMarginResponse, GetOrdersResponse, HistoricCandle, LastPrice,
+    MarketDataResponse, MoneyValue, OrderDirection, OrderState, OrderTrade, OrderTrades, OrderType, PortfolioResponse,
+    PostOrderResponse, Quotation, ReplaceOrderRequest, TradesStreamResponse)
+from tinkoff.invest.utils import decimal_to_quotation, money_to_decimal, quotation_to_decimal
+
+import trad.task_all_time as task_all_time
+from backtest.simulated_broker import SimulatedBroker, SimulatedInstrumentsService, SimulatedOrdersService
+from data_create.historic_future import HistoricInstrument
+from strategy.docnhian import StrategyContext
+from trad.connect_tinkoff import ConnectTinkoff
+from trad.context_registry import ContextRegistry
+from trad.executors import LagMonitor
+
+START = datetime.datetime(2024, 1, 1, 7, tzinfo=datetime.timezone.utc)
+TICK = Decimal('0.01')
+# Ширина дневного диапазона синтетической истории как доля базовой цены.
+BAND = Decimal('0.005')
+# Время поступления цены, которую сейчас обрабатывает актор (для замера задержки до post_order).
+ARRIVAL: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('arrival', default=None)
+
+
+def synthetic_instrument(figi: str, uid: Optional[str] = None) -> Future:
+    uid = uid or f'uid-{figi}'
+    return Future(figi=figi, uid=uid, name=f'Replay {figi}', ticker=figi, lot=1,
+                  min_price_increment=decimal_to_quotation(TICK),
+                  min_price_increment_amount=decimal_to_quotation(TICK),
+                  initial_margin_on_buy=MoneyValue(currency='rub', units=1000, nano=0),
+                  initial_margin_on_sell=MoneyValue(currency='rub', units=1000, nano=0))
+
+
+def synthetic_historic(instrument: Future, base: Decimal, days: int = 40) -> HistoricInstrument:
+    """
+    Боковик вокруг base: канал Дончиана ≈ base ± 2·step, ATR ≈ 2·step, где step = base·BAND.
+    """
+    step = max(TICK, (base * BAND).quantize(TICK))
+    candles = []
+    for day in range(days):
+        close = base + (day % 3 - 1) * step
+        candles.append(HistoricCandle(open=decimal_to_quotation(close),
+                                      high=decimal_to_quotation(close + step),
+                                      low=decimal_to_quotation(close - step),
+                                      close=decimal_to_quotation(close),
+                                      volume=100,
+                                      time=START + datetime.timedelta(days=day),
+                                      is_complete=True))
+    return HistoricInstrument(instrument, candles)
+
+
+def synthetic_stream(instruments: list[Future], messages: int, seed: int = 0,
+                     base: Decimal = Decimal(100), period: int = 200) -> list[MarketDataResponse]:
+    """
+    Синтетические последние цены: синусоида с шумом, амплитуда шире канала синтетической истории,
+    поэтому пробои, добавление юнитов и стопы повторяются весь прогон.
+    :param instruments: Инструменты, цены которых чередуются в стриме.
+    :param messages: Общее количество сообщений.
+    :param seed: Зерно генератора шума (прогон детерминирован).
+    :param period: Период синусоиды в сообщениях одного инструмента.
+    """
+    rng = random.Random(seed)
+    amplitude = float(base * BAND) * 5
+    phases = [rng.random() * 2 * math.pi for _ in instruments]
+    stream = []
+    for i in range(messages):
+        index = i % len(instruments)
+        instrument = instruments[index]
+        step = i // len(instruments)
+        value = (float(base) + amplitude * math.sin(2 * math.pi * step / period + phases[index])
+                 + rng.gauss(0, amplitude / 20))
+        price = Decimal(str(round(value, 2)))
+        stream.append(MarketDataResponse(last_price=LastPrice(
+            figi=instrument.figi, price=decimal_to_quotation(price),
+            time=START + datetime.timedelta(milliseconds=i), instrument_uid=instrument.uid)))
+    return stream
+
+
+def load_recording(path: str) -> list[MarketDataResponse | TradesStreamResponse]:
+    """
+    Загружает записанные сообщения стримов (pickle списка MarketDataResponse/TradesStreamResponse).
+    """
+    with open(path, 'rb') as file:
+        return list(pickle.load(file))
+
+
+def save_recording(path: str, messages: list[MarketDataResponse | TradesStreamResponse]) -> None:
+    with open(path, 'wb') as file:
+        pickle.dump(messages, file)
+
+
+class ReplayOrdersService:
+    """
+    Заявки маршрутизируются в SimulatedBroker инструмента. Момент вызова post_order фиксирует задержку
+    от поступления цены, из-за которой выставлена заявка.
+    """
+
+    def __init__(self, brokers: dict[str, SimulatedBroker], stats: 'ReplayStats',
+                 queue_order: Optional[asyncio.Queue] = None) -> None:
+        """
+        :param brokers: Брокеры по uid инструмента.
+        :param stats: Накопитель замеров.
+        :param queue_order: Очередь стрима сделок, в которую кладутся исполнения заявок.
+        """
+        self.brokers = brokers
+        self.stats = stats
+        self.queue_order = queue_order
+        self._services = {uid: SimulatedOrdersService(broker) for uid, broker in brokers.items()}
+        self._owners: dict[str, SimulatedOrdersService] = {}
+
+    async def post_order(self, instrument_id: str, quantity: int, price: Quotation, direction: OrderDirection,
+                         account_id: str, order_id: str, order_type: OrderType) -> PostOrderResponse:
+        arrival = ARRIVAL.get()
+        if arrival is not None:
+            self.stats.order_latency.append(time.perf_counter() - arrival)
+        service = self._services[instrument_id]
+        response = await service.post_order(instrument_id, quantity, price, direction, account_id, order_id,
+                                            order_type)
+        self._owners[response.order_id] = service
+        self.stats.orders += 1
+        if self.queue_order is not None and response.lots_executed:
+            self.queue_order.put_nowait(self._trades(service.broker.orders[response.order_id], account_id))
+        return response
+
+    @staticmethod
+    def _trades(state: OrderState, account_id: str) -> TradesStreamResponse:
+        return TradesStreamResponse(order_trades=OrderTrades(
+            order_id=state.order_id, created_at=state.order_date, direction=state.direction, figi=state.figi,
+            trades=[OrderTrade(date_time=state.order_date,
+                               price=decimal_to_quotation(money_to_decimal(state.executed_order_price)),
+                               quantity=state.lots_executed)],
+            account_id=account_id, instrument_uid=state.instrument_uid))
+
+    async def get_order_state(self, account_id: str, order_id: str) -> OrderState:
+        return await self._owners[order_id].get_order_state(account_id, order_id)
+
+    async def get_orders(self, account_id: str) -> GetOrdersResponse:
+        return GetOrdersResponse(orders=[])
+
+    async def cancel_order(self, account_id: str, order_id: str) -> CancelOrderResponse:
+        return await self._owners[order_id].cancel_order(account_id, order_id)
+
+    async def replace_order(self, request: ReplaceOrderRequest) -> PostOrderResponse:
+        service = self._owners[request.order_id]
+        response = await service.replace_order(request)
+        self._owners[response.order_id] = service
+        return response
+
+
+class ReplayInstrumentsService:
+    def __init__(self, brokers: dict[str, SimulatedBroker]) -> None:
+        self._services = {uid: SimulatedInstrumentsService(broker) for uid, broker in brokers.items()}
+
+    async def get_futures_margin(self, instrument_id: str) -> GetFuturesMarginResponse:
+        return await self._services[instrument_id].get_futures_margin(instrument_id)
+
+
+class ReplayOperationsService:
+    def __init__(self, brokers: dict[str, SimulatedBroker]) -> None:
+        self.brokers = brokers
+
+    async def get_portfolio(self, account_id: str) -> PortfolioResponse:
+        total = sum((broker.equity() for broker in self.brokers.values()), Decimal(0))
+        quotation = decimal_to_quotation(total)
+        return PortfolioResponse(total_amount_portfolio=MoneyValue(currency='rub', units=quotation.units,
+                                                                   nano=quotation.nano))
+
+
+class ReplayServices:
+    """
+    Замена AsyncServices для воспроизведения: сервисы по нескольким инструментам сразу.
+    """
+
+    def __init__(self, brokers: dict[str, SimulatedBroker], stats: 'ReplayStats',
+                 queue_order: Optional[asyncio.Queue] = None) -> None:
+        self.orders = ReplayOrdersService(brokers, stats, queue_order)
+        self.instruments = ReplayInstrumentsService(brokers)
+        self.operations = ReplayOperationsService(brokers)
+
+
+class ReplayBot:
+    """
+    Телеграм бот без сети: сообщения только считаются.
+    """
+
+    def __init__(self) -> None:
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, *args, **kwargs) -> None:
+        self.sent += 1
+
+
+@dataclass
+class ReplayStats:
+    order_latency: list[float] = field(default_factory=list)
+    handler_delay: list[float] = field(default_factory=list)
+    orders: int = 0
+
+
+@dataclass
+class ReplayReport:
+    messages: int = 0
+    prices: int = 0
+    processed: int = 0
+    conflated: int = 0
+    errors: int = 0
+    orders: int = 0
+    bot_messages: int = 0
+    reconcile_calls: int = 0
+    elapsed: float = 0.0
+    order_latency: dict[str, float] = field(default_factory=dict)
+    handler_delay: dict[str, float] = field(default_factory=dict)
+    loop_lag: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        result = asdict(self)
+        result['messages_per_second'] = self.messages_per_second
+        return result
+
+    def format(self) -> str:
+        lines = [f'Сообщений {self.messages} (цен {self.prices}, обработано {self.processed}, '
+                 f'схлопнуто {self.conflated}, ошибок {self.errors}) за {self.elapsed:.3f} сек., '
+                 f'{self.messages_per_second:.0f} сообщ./сек.',
+                 f'Заявок {self.orders}, сообщений бота {self.bot_messages}, сверок get_orders {self.reconcile_calls}',
+                 f'{"мс":<24} {"p50":>9} {"p90":>9} {"p99":>9} {"max":>9} {"n":>7}']
+        for name, values in (('цена -> post_order', self.order_latency),
+                             ('цена -> обработчик', self.handler_delay),
+                             ('задержка цикла', self.loop_lag)):
+            lines.append(f'{name:<24} ' + ' '.join(f'{values.get(key, 0.0) * 1000:>9.3f}'
+                                                   for key in ('p50', 'p90', 'p99', 'max'))
+                         + f' {int(values.get("n", 0)):>7}')
+        return '\n'.join(lines)
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {'n': 0}
+    p50, p90, p99 = np.percentile(np.asarray(values), [50, 90, 99]).tolist()
+    return {'p50': p50, 'p90': p90, 'p99': p99, 'max': max(values), 'n': len(values)}
+
+
+def make_contexts(messages: Iterable[MarketDataResponse | TradesStreamResponse]) -> dict[str, StrategyContext]:
+    """
+    Контексты стратегии для всех инструментов записи: синтетическая история вокруг первой цены инструмента.
+    """
+    contexts = {}
+    for msg in messages:
+        last_price = getattr(msg, 'last_price', None)
+        if last_price and last_price.figi not in contexts:
+            instrument = synthetic_instrument(last_price.figi, last_price.instrument_uid or None)
+            base = quotation_to_decimal(last_price.price)
+            contexts[last_price.figi] = StrategyContext(synthetic_historic(instrument, base))
+    return contexts
+
+
+async def replay_stream(messages: list[MarketDataResponse | TradesStreamResponse], rate: float = 0,
+                        portfolio: Decimal = Decimal(10_000_000), lag_interval: float = 0.01) -> ReplayReport:
+    """
+    Прогоняет сообщения через обработчики стримов бота.
+    :param messages: Сообщения стримов в порядке поступления.
+    :param rate: Частота подачи, сообщений в секунду (0 – без пауз, с передачей управления после каждого сообщения).
+    :param portfolio: Размер счёта для расчёта количества лотов.
+    :param lag_interval: Интервал замера задержки цикла событий.
+    :return: Отчёт прогона.
+    """
+    stats = ReplayStats()
+    bot = ReplayBot()
+    contexts = make_contexts(messages)
+    ids = itertools.count(1)
+    brokers = {context.history_instrument.instrument_info.uid:
+               SimulatedBroker(context.history_instrument.instrument_info, ids=ids) for context in contexts.values()}
+    brokers_by_figi = {broker.instrument.figi: broker for broker in brokers.values()}
+
+    connect = ConnectTinkoff('')
+    connect.queue = asyncio.Queue()
+    connect.queue_order = asyncio.Queue()
+    connect.client = ReplayServices(brokers, stats, connect.queue_order)
+    # processing_stream работает только при открытом стриме рыночных данных.
+    connect.market_data_stream = True
+
+    arrivals: dict[int, float] = {}
+    original_update = task_all_time.update_strategy_by_price
+    original_registry = task_all_time.registry
+
+    async def timed_update(last_price: LastPrice, connect_: ConnectTinkoff, bot_) -> None:
+        arrival = arrivals.pop(id(last_price), None)
+        if arrival is not None:
+            stats.handler_delay.append(time.perf_counter() - arrival)
+        token = ARRIVAL.set(arrival)
+        try:
+            await original_update(last_price, connect_, bot_)
+        finally:
+            ARRIVAL.reset(token)
+
+    with tempfile.TemporaryDirectory() as state_path:
+        registry = ContextRegistry(path=state_path, legacy_path=None)
+        registry.load()
+        for figi, context in contexts.items():
+            registry.set(figi, context)
+        task_all_time.registry = registry
+        task_all_time.update_strategy_by_price = timed_update
+        size = decimal_to_quotation(portfolio)
+        connect.portfolio_cache.apply_portfolio(PortfolioResponse(
+            total_amount_portfolio=MoneyValue(currency='rub', units=size.units, nano=size.nano), positions=[]))
+        lag_monitor = LagMonitor(interval=lag_interval, threshold=math.inf, history=None)
+        tasks = [asyncio.create_task(task_all_time.processing_stream(connect, bot)),
+                 asyncio.create_task(task_all_time.processing_trades_stream(connect, bot)),
+                 lag_monitor.start()]
+        try:
+            started = time.perf_counter()
+            for i, msg in enumerate(messages):
+                if rate:
+                    delay = started + i / rate - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if isinstance(msg, TradesStreamResponse):
+                    connect.queue_order.put_nowait(msg)
+                else:
+                    if last_price := msg.last_price:
+                        if broker := brokers_by_figi.get(last_price.figi):
+                            broker.market_price = quotation_to_decimal(last_price.price)
+                        arrivals[id(last_price)] = time.perf_counter()
+                    connect.queue.put_nowait(msg)
+                if not rate:
+                    await asyncio.sleep(0)
+            while not _drained(connect):
+                await asyncio.sleep(0.001)
+            elapsed = time.perf_counter() - started
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if task_all_time.price_actors is not None:
+                await task_all_time.price_actors.stop()
+            await connect.order_manager.stop()
+            task_all_time.update_strategy_by_price = original_update
+            task_all_time.registry = original_registry
+
+    actors = task_all_time.price_actors.metrics().values() if task_all_time.price_actors else []
+    return ReplayReport(
+        messages=len(messages),
+        prices=sum(1 for msg in messages if getattr(msg, 'last_price', None)),
+        processed=sum(int(actor['processed']) for actor in actors),
+        conflated=sum(int(actor['conflated']) for actor in actors),
+        errors=sum(int(actor['errors']) for actor in actors),
+        orders=stats.orders,
+        bot_messages=bot.sent,
+        reconcile_calls=connect.order_manager.reconcile_calls,
+        elapsed=elapsed,
+        order_latency=percentiles(stats.order_latency),
+        handler_delay=percentiles(stats.handler_delay),
+        loop_lag=percentiles(list(lag_monitor.samples)),
+    )
+
+
+def _drained(connect: ConnectTinkoff) -> bool:
+    """
+    Все сообщения разобраны, акторы простаивают, заявок под управлением нет.
+    """
+    if not connect.queue.empty() or not connect.queue_order.empty() or connect.order_manager.orders:
+        return False
+    actors = task_all_time.price_actors.actors.values() if task_all_time.price_actors else []
+    return all(not actor.busy and not actor.queue_depth for actor in actors)
+
+
+def run_replay(messages: list[MarketDataResponse | TradesStreamResponse], rate: float = 0) -> ReplayReport:
+    return asyncio.run(replay_stream(messages, rate))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замер задержек обработки стрима на воспроизведённых сообщениях')
+    parser.add_argument('--recording', help='pickle со списком MarketDataResponse/TradesStreamResponse '
+                                            '(по умолчанию – синтетический стрим)')
+    parser.add_argument('--instruments', type=int, default=10, help='Инструментов в синтетическом стриме')
+    parser.add_argument('--messages', type=int, default=20_000, help='Сообщений в синтетическом стриме')
+    parser.add_argument('--seed', type=int, default=0, help='Зерно синтетического стрима')
+    parser.add_argument('--rate', type=float, default=0, help='Сообщений в секунду (0 – максимально быстро)')
+    parser.add_argument('--save-recording', help='Сохранить воспроизведённые сообщения в pickle')
+    parser.add_argument('--json', help='Сохранить отчёт в JSON')
+    parser.add_argument('--log-level', default='WARNING', help='Уровень логирования бота во время прогона')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    if args.recording:
+        replay_messages = load_recording(args.recording)
+    else:
+        replay_messages = synthetic_stream([synthetic_instrument(f'FUTREPLAY{i:03}') for i in range(args.instruments)],
+                                           args.messages, seed=args.seed)
+    if args.save_recording:
+        save_recording(args.save_recording, replay_messages)
+    report = run_replay(replay_messages, args.rate)
+    print(report.format())
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as json_file:
+            json.dump(report.to_dict(), json_file, ensure_ascii=False, indent=2)
@@ -1,6 +1,5 @@
 import asyncio
 import os
-import shelve
 from decimal import Decimal
 
 from aiogram import Router, F
@@ -10,15 +9,18 @@ from tinkoff.invest import GetMarginAttributesResponse
 
 import bot.keyboard as kb
 import utils as ut
+from bot.notifier import split_text
 from bot.telegram_bot import bot
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from data_create.historic_future import HistoricInstrument
 from strategy.docnhian import StrategyContext
 from trad.connect_tinkoff import ConnectTinkoff
-from trad.task_all_time import conclusion_in_day, get_context_by_figi
+from trad.context_registry import registry
+from trad.executors import run_cpu
+from trad.metrics import metrics
+from trad.task_all_time import build_historic_instrument, conclusion_in_day, get_context_by_figi
 
 start_router = Router()
 dict_function = {}
@@ -43,31 +45,28 @@ async def subscribe(message: Message):
             try:
                 historic_instrument, instrument_info = await connect.get_candles_from_ticker(ticker=ticker,
                                                                                              interval='1d')
-                new_historic_instrument = HistoricInstrument(instrument=instrument_info,
-                                                             list_candles=historic_instrument)
+                new_historic_instrument = await run_cpu(build_historic_instrument, instrument_info,
+                                                        historic_instrument)
             except Exception as e:
                 await bot.send_message(chat_id=message.chat.id,
                                        text=f'Не удалось получить данные по тикеру {ticker}:\n{e}')
                 continue
             dict_historic[new_historic_instrument.instrument_info.figi] = new_historic_instrument
-        with shelve.open('data_strategy_state/dict_strategy_state') as db:
-            db: dict[str, StrategyContext]
-            for figi in dict_historic:
-                if figi in db.keys():
-                    context = db[figi]
-                    context.update_data(dict_historic[figi])
-                    db[figi] = context
-                else:
-                    context = StrategyContext(dict_historic[figi])
-                    db[figi] = context
+        for figi in dict_historic:
+            if figi in registry:
+                context = registry.get(figi)
+                context.update_data(dict_historic[figi])
+                registry.mark_dirty(figi)
+            else:
+                context = StrategyContext(dict_historic[figi])
+                registry.set(figi, context)
 
         instruments = [instrument.instrument_info.uid for instrument in dict_historic.values()]
         await connect.add_subscribe_last_price(instruments)
         await connect.add_subscribe_status_instrument(instruments)
-        list_task = [connect.figi_to_name(figi) for figi in dict_historic]
-        await asyncio.gather(*list_task)
-        for instrument in dict_historic.values():
-            ut.create_folder_and_save_historic_instruments(instrument)
+        await connect.add_subscribe_candle(instruments, '1m')
+        await connect.figi_names(list(dict_historic))
+        await connect.margin_cache.prefetch(connect.client, instruments)
         await bot.send_message(chat_id=message.chat.id, text='Подписка установлена')
 
     else:
@@ -79,7 +78,8 @@ async def start(message: Message):
     text = (f"<b>Доступные команды:</b>\n"
             f"/portfolio - информация по портфолио\n"
             f"/margin - информация по заблокированной сумме\n"
-            f"/state_info - информация по состоянию стратегии по инструменту\n\n"
+            f"/state_info - информация по состоянию стратегии по инструменту\n"
+            f"/metrics - время обработки, задержка цикла событий и состояние стримов\n\n"
             f"<b>Для оформления подписки на инструмент нужно написать в чате:</b>\n"
             f"Bot_subscribe <b>ИМЯ1 ИМЯ2 ИМЯ3</b>\n"
             f"<b>ИМЯ</b> - ticker инструмента\n"
@@ -122,27 +122,24 @@ async def margin(message: Message):
     await bot.send_message(chat_id=message.chat.id, text=test, parse_mode=None)
 
 
+@start_router.message(Command('metrics'))
+async def metrics_info(message: Message):
+    for part in split_text(metrics.summary()):
+        await bot.send_message(chat_id=message.chat.id, text=part)
+
+
 @start_router.message(Command('update_position'))
 async def update_position(message: Message):
     try:
-        dict_state: dict[str, StrategyContext] = {}
-        with shelve.open('data_strategy_state/dict_strategy_state') as db:
-            for key in db.keys():
-                context = db[key]
-                dict_state[key] = context
-        my_portfolio = await connect.get_portfolio_by_id(ACCOUNT_ID)
-        portfolio_positions = {position.figi: position for position in my_portfolio.positions}
-
+        dict_state: dict[str, StrategyContext] = dict(registry.items())
         for key, value in dict_state.items():
-            if key in portfolio_positions:
-                await value.update_position_info(connect, portfolio_positions[key])
-            else:
-                await value.update_position_info(connect, None)
+            await value.update_position_info(connect, connect.portfolio_cache.position(key))
 
-        with shelve.open('data_strategy_state/dict_strategy_state') as db:
-            for key in db.keys():
-                db[key] = dict_state[key]
-        await bot.send_message(chat_id=message.chat.id, text='Позиции обновлены')
+        for key in dict_state:
+            registry.mark_dirty(key)
+        await bot.send_message(chat_id=message.chat.id,
+                               text=f'Позиции обновлены по данным портфеля '
+                                    f'{connect.portfolio_cache.age() or 0:.0f} сек. назад')
     except Exception as e:
         await bot.send_message(chat_id=message.chat.id, text=f'Ошибка при обновлении позиций: {e}')
 
@@ -157,12 +154,11 @@ async def unsubscribe(message: Message):
 @start_router.callback_query(F.data.endswith('unsubscribe'))
 async def unsubscribe_data(call_back: CallbackQuery):
     key = call_back.data.split('_')[0]
-    with shelve.open('data_strategy_state/dict_strategy_state') as db:
-        context: 'StrategyContext' = db[key]
-        if context.quantity > 0:
-            await bot.send_message(chat_id=call_back.message.chat.id, text=(f'Нельзя отписаться от позиции\n'
-                                                                            f'{context.quantity} лотов держится'))
-        else:
-            del db[key]
-            await connect.delete_subscribe(context.history_instrument.instrument_info.uid, last_price=True)
-            await bot.send_message(chat_id=call_back.message.chat.id, text='Отписка от инструмента успешно выполнена')
+    context: 'StrategyContext' = registry.get(key)
+    if context.quantity > 0:
+        await bot.send_message(chat_id=call_back.message.chat.id, text=(f'Нельзя отписаться от позиции\n'
+                                                                        f'{context.quantity} лотов держится'))
+    else:
+        registry.delete(key)
+        await connect.delete_subscribe(context.history_instrument.instrument_info.uid, last_price=True)
+        await bot.send_message(chat_id=call_back.message.chat.id, text='Отписка от инструмента успешно выполнена')
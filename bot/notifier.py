@@ -0,0 +1,256 @@
+"""
+Очередь исходящих уведомлений в Telegram.
+send_message только кладёт текст в очередь и сразу возвращается, поэтому обработчики стримов
+не ждут ответа Telegram. Фоновая задача склеивает сообщения одного чата за короткое окно
+целыми сообщениями в пределах лимита длины и отправляет с учётом лимитов Telegram (token bucket),
+а при ответе 429 ждёт указанное время и повторяет отправку. Если Telegram не принял склеенную пачку
+(например, из-за ошибки разметки в одном сообщении), сообщения пачки отправляются по одному.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from trad.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """
+    Ограничение частоты: rate токенов в секунду, не больше capacity подряд.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """
+        Сколько секунд ждать до появления токена.
+        """
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while (delay := self.delay()) > 0:
+            await asyncio.sleep(delay)
+        self.tokens -= 1
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Делит текст на части не длиннее limit, по возможности по переводам строк.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    if text:
+        parts.append(text)
+    return parts
+
+
+def batch_texts(texts: list[str], separator: str = '\n\n', limit: int = MAX_MESSAGE_LENGTH) -> list[list[str]]:
+    """
+    Группирует сообщения в пачки, склеенный текст которых не длиннее limit. Сообщения не разрезаются,
+    сообщение длиннее limit идёт отдельной пачкой.
+    """
+    batches: list[list[str]] = []
+    size = 0
+    for text in texts:
+        if batches and size + len(separator) + len(text) <= limit:
+            batches[-1].append(text)
+            size += len(separator) + len(text)
+        else:
+            batches.append([text])
+            size = len(text)
+    return batches
+
+
+class Notifier:
+    """
+    Пакетная отправка уведомлений с соблюдением лимитов Telegram.
+    Совместим с Bot.send_message по вызову, поэтому передаётся в задачи вместо бота.
+    """
+
+    def __init__(self, bot: Bot,
+                 batch_window: float = 1.0,
+                 chat_rate: float = 1.0,
+                 chat_burst: float = 3.0,
+                 global_rate: float = 25.0,
+                 max_pending: int = 1000,
+                 max_retries: int = 5,
+                 separator: str = '\n\n') -> None:
+        """
+        :param bot: Бот aiogram.
+        :param batch_window: Окно (в секундах), за которое сообщения одного чата склеиваются в одно.
+        :param chat_rate: Сообщений в секунду в один чат.
+        :param chat_burst: Сколько сообщений в один чат можно отправить подряд.
+        :param global_rate: Сообщений в секунду на все чаты.
+        :param max_pending: Максимум сообщений в очереди, при переполнении отбрасываются самые старые.
+        :param max_retries: Сколько раз повторять отправку после ответа 429.
+        :param separator: Разделитель склеенных сообщений.
+        """
+        self.bot = bot
+        self.batch_window = batch_window
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.separator = separator
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: dict[Any, TokenBucket] = {}
+        self.dropped = 0
+        self.sent = 0
+        self._pending: dict[tuple, list[str]] = {}
+        self._pending_count = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    @property
+    def pending(self) -> int:
+        return self._pending_count
+
+    async def send_message(self, chat_id: int | str, text: str, **kwargs) -> None:
+        """
+        Ставит сообщение в очередь отправки. Дополнительные параметры передаются в Bot.send_message,
+        склеиваются только сообщения с одинаковыми параметрами.
+        """
+        self.enqueue(chat_id, text, **kwargs)
+
+    def enqueue(self, chat_id: int | str, text: str, **kwargs) -> None:
+        key = (chat_id, tuple(sorted(kwargs.items())))
+        self._pending.setdefault(key, []).append(text)
+        self._pending_count += 1
+        if self._pending_count > self.max_pending:
+            self._drop_oldest()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _drop_oldest(self) -> None:
+        for key, texts in self._pending.items():
+            if texts:
+                texts.pop(0)
+                self._pending_count -= 1
+                self.dropped += 1
+                if not texts:
+                    del self._pending[key]
+                logger.warning(f'Очередь уведомлений переполнена, отброшено сообщений: {self.dropped}')
+                return
+
+    def start(self) -> asyncio.Task:
+        """
+        Запускает фоновую отправку.
+        """
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._closing = False
+            if self._pending:
+                self._wakeup.set()
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновую задачу и отправляет оставшиеся сообщения.
+        Задача не отменяется: пачка, которую она уже забрала из очереди, должна быть отправлена до конца.
+        """
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            await self._wakeup.wait()
+            if not self._closing:
+                # Даём накопиться сообщениям, пришедшим одной пачкой.
+                await asyncio.sleep(self.batch_window)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Отправляет всё, что накопилось в очереди.
+        :return: Количество отправленных сообщений Telegram.
+        """
+        pending, self._pending = self._pending, {}
+        self._pending_count = 0
+        count = 0
+        for (chat_id, options), texts in pending.items():
+            for batch in batch_texts(texts, self.separator):
+                count += await self._send_batch(chat_id, batch, dict(options))
+        self.sent += count
+        return count
+
+    async def _send_batch(self, chat_id: int | str, texts: list[str], options: dict) -> int:
+        """
+        Отправляет пачку сообщений одним сообщением Telegram. Если Telegram её не принял, сообщения отправляются
+        по одному, чтобы ошибка в одном не отбросила остальные.
+        :return: Количество отправленных сообщений Telegram.
+        """
+        if len(texts) == 1:
+            # Режется только одно сообщение длиннее лимита, иначе Telegram его не примет совсем.
+            return sum([await self._send(chat_id, part, options) for part in split_text(texts[0])])
+        try:
+            return int(await self._send(chat_id, self.separator.join(texts), options, raise_bad_request=True))
+        except TelegramBadRequest as e:
+            logger.warning(f'Telegram не принял пачку из {len(texts)} сообщений в чат {chat_id} ({e}), '
+                           f'отправляем по одному')
+        count = 0
+        for text in texts:
+            count += await self._send_batch(chat_id, [text], options)
+        return count
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _send(self, chat_id: int | str, text: str, options: dict, raise_bad_request: bool = False) -> bool:
+        for attempt in range(self.max_retries + 1):
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                with metrics.time('telegram_send'):
+                    await self.bot.send_message(chat_id=chat_id, text=text, **options)
+                return True
+            except TelegramRetryAfter as e:
+                logger.warning(f'Telegram ограничил отправку, ждём {e.retry_after} сек. (попытка {attempt + 1})')
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if raise_bad_request:
+                    raise
+                logger.error(f'Telegram не принял сообщение в чат {chat_id}: {e}')
+                return False
+            except Exception as e:
+                logger.error(f'Не удалось отправить сообщение в чат {chat_id}: {e}')
+                return False
+        logger.error(f'Сообщение в чат {chat_id} не отправлено после {self.max_retries} повторов')
+        return False
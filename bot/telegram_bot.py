@@ -9,6 +9,8 @@ from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from bot.notifier import Notifier
+
 TOKEN_TELEGRAM = os.getenv('TOKEN_TELEGRAM')
 print(TOKEN_TELEGRAM)
 scheduler = AsyncIOScheduler(timezone='Europe/Moscow')
@@ -27,4 +29,6 @@ logging.basicConfig(level=logging.DEBUG, handlers=[stream_handler, file_handler]
 logger = logging.getLogger(__name__)
 
 bot = Bot(token=TOKEN_TELEGRAM, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# Уведомления из стримов и задач по расписанию отправляются через очередь, а не напрямую ботом.
+notifier = Notifier(bot)
 dp = Dispatcher(storage=MemoryStorage())
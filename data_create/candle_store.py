@@ -0,0 +1,201 @@
+"""
+Локальное хранилище исторических свечей.
+Свечи каждого инструмента и интервала лежат в отдельном .npy файле (структурированный массив NumPy),
+цены хранятся целыми числами в нано-единицах, время – в наносекундах UTC.
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+PRICE_SCALE = 1_000_000_000
+CANDLE_DTYPE = np.dtype([
+    ('time', 'i8'),
+    ('open', 'i8'),
+    ('high', 'i8'),
+    ('low', 'i8'),
+    ('close', 'i8'),
+    ('volume', 'i8'),
+])
+# Имена файлов не должны зависеть от регистра: '1m' и '1M' на Windows совпали бы.
+INTERVAL_FILE_KEYS = {
+    '1m': '1min', '2m': '2min', '3m': '3min', '5m': '5min', '10m': '10min', '15m': '15min', '30m': '30min',
+    '1h': '1hour', '2h': '2hour', '4h': '4hour', '1d': '1day', '1w': '1week', '1M': '1month',
+}
+
+
+def datetime_to_ns(time: datetime.datetime) -> int:
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)
+    delta = time - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return (delta.days * 86_400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1_000
+
+
+def ns_to_datetime(value: int) -> datetime.datetime:
+    return (datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+            + datetime.timedelta(microseconds=int(value) // 1_000))
+
+
+def scaled_price(quotation) -> int:
+    """
+    Перевод Quotation (units, nano) в целое число нано-единиц.
+    """
+    return quotation.units * PRICE_SCALE + quotation.nano
+
+
+def records_from_candles(candles: Iterable) -> np.ndarray:
+    """
+    Переводит свечи API (HistoricCandle) в структурированный массив за один проход.
+    """
+    candles = list(candles)
+    records = np.empty(len(candles), dtype=CANDLE_DTYPE)
+    for i, candle in enumerate(candles):
+        records[i] = (datetime_to_ns(candle.time),
+                      scaled_price(candle.open),
+                      scaled_price(candle.high),
+                      scaled_price(candle.low),
+                      scaled_price(candle.close),
+                      candle.volume)
+    return records
+
+
+def price_frame(times: pd.DatetimeIndex, units: np.ndarray, nanos: np.ndarray,
+                volume: np.ndarray) -> pd.DataFrame:
+    """
+    DataFrame вида HistoricInstrument.data: цены open, high, low, close в float64 из units/nano,
+    время свечей – индекс datetime64 (UTC) и столбец time.
+    :param times: Время свечей.
+    :param units: Целые части цен, столбцы open, high, low, close.
+    :param nanos: Дробные части цен в нано-единицах, столбцы в том же порядке.
+    :param volume: Объёмы.
+    """
+    times = pd.DatetimeIndex(times).as_unit('ns')
+    data = {'time': times}
+    for i, column in enumerate(('open', 'high', 'low', 'close')):
+        data[column] = units[:, i].astype(np.float64) + nanos[:, i] / PRICE_SCALE
+    data['volume'] = np.asarray(volume, dtype=np.int64)
+    return pd.DataFrame(data, index=times)
+
+
+def frame_from_candles(candles: Iterable) -> pd.DataFrame:
+    """
+    Переводит свечи API (HistoricCandle) в DataFrame вида HistoricInstrument.data за один проход без словаря на строку:
+    units/nano цен пишутся в массив int64, цены считаются векторно в float64.
+    :param candles: Список или итератор свечей.
+    """
+    times = []
+
+    def rows():
+        for candle in candles:
+            times.append(candle.time)
+            yield (candle.open.units, candle.open.nano, candle.high.units, candle.high.nano,
+                   candle.low.units, candle.low.nano, candle.close.units, candle.close.nano, candle.volume)
+
+    count = len(candles) if hasattr(candles, '__len__') else -1
+    columns = np.fromiter(rows(), dtype=np.dtype((np.int64, 9)), count=count)
+    return price_frame(pd.to_datetime(times, utc=True), columns[:, 0:8:2], columns[:, 1:8:2], columns[:, 8])
+
+
+def records_from_frame(data: pd.DataFrame) -> np.ndarray:
+    """
+    Переводит DataFrame HistoricInstrument.data (time, open, high, low, close, volume) в структурированный массив.
+    """
+    records = np.empty(len(data), dtype=CANDLE_DTYPE)
+    records['time'] = pd.DatetimeIndex(pd.to_datetime(data['time'], utc=True)).asi8
+    for column in ('open', 'high', 'low', 'close'):
+        records[column] = np.rint(data[column].to_numpy(dtype=np.float64) * PRICE_SCALE).astype(np.int64)
+    records['volume'] = data['volume'].to_numpy(dtype=np.int64)
+    return records
+
+
+def frame_from_records(records: np.ndarray) -> pd.DataFrame:
+    """
+    Переводит структурированный массив в DataFrame того же вида, что HistoricInstrument.data
+    и frame_from_candles для тех же свечей.
+    """
+    scaled = np.stack([records[column] for column in ('open', 'high', 'low', 'close')], axis=1)
+    # Целая часть с отбрасыванием дробной, как units в Quotation (и nano того же знака).
+    units = np.sign(scaled) * (np.abs(scaled) // PRICE_SCALE)
+    return price_frame(pd.to_datetime(records['time'], utc=True), units, scaled - units * PRICE_SCALE,
+                       records['volume'])
+
+
+class CandleStore:
+    """
+    Хранилище свечей с дозагрузкой только недостающего диапазона.
+    """
+
+    def __init__(self, root: str = os.path.join('my_data_folder', 'candles')) -> None:
+        """
+        :param root: Папка, в которой лежат файлы свечей.
+        """
+        self.root = root
+
+    def path(self, uid: str, interval: str) -> str:
+        return os.path.join(self.root, f'{uid}_{INTERVAL_FILE_KEYS.get(interval, interval)}.npy')
+
+    def load(self, uid: str, interval: str, mmap: bool = True) -> np.ndarray:
+        """
+        Загружает все сохранённые свечи инструмента.
+        :param mmap: Открыть файл через memory map без чтения в память целиком.
+        :return: Структурированный массив CANDLE_DTYPE (пустой, если свечей нет).
+        """
+        path = self.path(uid, interval)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        return np.load(path, mmap_mode='r' if mmap else None)
+
+    def last_time(self, uid: str, interval: str) -> Optional[datetime.datetime]:
+        """
+        Время последней сохранённой свечи или None, если свечей нет.
+        """
+        records = self.load(uid, interval)
+        if not len(records):
+            return None
+        return ns_to_datetime(records['time'][-1])
+
+    def merge(self, uid: str, interval: str, records: np.ndarray) -> np.ndarray:
+        """
+        Добавляет свечи в хранилище. Сохранённые свечи начиная со времени первой новой свечи заменяются,
+        так что незакрытая на момент прошлой загрузки свеча перезаписывается актуальной.
+        :return: Все свечи инструмента после слияния.
+        """
+        existing = self.load(uid, interval, mmap=False)
+        if not len(records):
+            return existing
+        records = np.sort(records, order='time')
+        keep = existing[existing['time'] < records['time'][0]]
+        merged = np.concatenate([keep, records])
+        self._write(self.path(uid, interval), merged)
+        logger.debug(f'Сохранено {len(records)} свечей {uid} {interval}, всего {len(merged)}')
+        return merged
+
+    @staticmethod
+    def _write(path: str, records: np.ndarray) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.save(file, records)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def window(records: np.ndarray,
+               from_: Optional[datetime.datetime] = None,
+               to: Optional[datetime.datetime] = None) -> np.ndarray:
+        """
+        Свечи в диапазоне [from_, to).
+        """
+        times = records['time']
+        start = np.searchsorted(times, datetime_to_ns(from_), side='left') if from_ else 0
+        stop = np.searchsorted(times, datetime_to_ns(to), side='left') if to else len(records)
+        return records[start:stop]
+
+
+candle_store = CandleStore()
@@ -2,12 +2,16 @@ import datetime
 import json
 import pickle as pkl
 from decimal import Decimal
+from typing import Iterable
 
 import pandas as pd
 from tinkoff.invest import Future, HistoricCandle, Quotation, MoneyValue
 from tinkoff.invest.schemas import BrandData
 from tinkoff.invest.utils import quotation_to_decimal
 
+from data_create.candle_store import CandleStore, candle_store, frame_from_candles, frame_from_records
+from data_create.indicators import IndicatorEngine
+
 
 class HistoricInstrument:
     """
@@ -18,24 +22,15 @@ class HistoricInstrument:
         """Конструктор класса, вызывается либо с параметрами instrument, list_candles либо загружается из from_csv, path
         :param list_candles: список исторических свечей
         :param instrument: объект класса Future - хранение основной информации об инструменте."""
+        self._init_data(instrument, frame_from_candles(list_candles))
 
+    def _init_data(self, instrument: Future, data: pd.DataFrame) -> None:
         self.min_short_donchian: Decimal = None
         self.max_short_donchian: Decimal = None
         self.max_donchian: Decimal = None
         self.min_donchian: Decimal = None
 
-        df = []
-        for candle in list_candles:
-            row = {
-                'time': candle.time,
-                'open': quotation_to_decimal(candle.open),
-                'high': quotation_to_decimal(candle.high),
-                'low': quotation_to_decimal(candle.low),
-                'close': quotation_to_decimal(candle.close),
-                'volume': candle.volume
-            }
-            df.append(row)
-        self.data: pd.DataFrame = pd.DataFrame(df)
+        self.data: pd.DataFrame = data
 
         self.instrument_info: Future = instrument
         self.time_last_candle: HistoricCandle = self.data.iloc[-1]['time']
@@ -44,24 +39,51 @@ class HistoricInstrument:
         self.atr = self.create_atr(20)
         self.create_donchian_canal(20, 10)
 
-    def create_atr(self, n=14) -> Decimal:
-        # Добавляем столбец с предыдущим close
-        self.data['prev_close'] = self.data['close'].shift(1)
-
-        # Вычисляем True Range (TR) для каждой свечи:
-        # Если предыдущего close нет, используем high - low.
-        self.data['tr'] = self.data.apply(
-            lambda row: max(
-                row['high'] - row['low'],
-                abs(row['high'] - row['prev_close']) if pd.notnull(row['prev_close']) else 0,
-                abs(row['low'] - row['prev_close']) if pd.notnull(row['prev_close']) else 0
-            ),
-            axis=1
-        )
-
-        # Вычисляем ATR как скользящее среднее по TR за n периодов (можно задать min_periods=1 для первых строк)
-        atr: Decimal = Decimal(self.data['tr'].rolling(window=n, min_periods=1).mean().iloc[-1])
+    @classmethod
+    def from_candles(cls, instrument: Future, candles: Iterable[HistoricCandle]) -> 'HistoricInstrument':
+        """
+        Строит исторические данные из свечей API без DataFrame из списка словарей и Decimal на каждое значение:
+        цены – столбцы float64, время – индекс datetime64, как у from_store для тех же свечей.
+        :param instrument: Параметры фьючерса.
+        :param candles: Список или итератор свечей.
+        """
+        historic = cls.__new__(cls)
+        historic._init_data(instrument, frame_from_candles(candles))
+        return historic
 
+    @classmethod
+    def from_store(cls, instrument: Future, store: CandleStore = candle_store,
+                   interval: str = '1d') -> 'HistoricInstrument':
+        """
+        Строит исторические данные по свечам из локального хранилища без запросов к API.
+        :param instrument: Параметры фьючерса (нужны uid и шаги цены).
+        :param store: Хранилище свечей.
+        :param interval: Интервал свечей.
+        """
+        records = store.load(instrument.uid, interval)
+        if not len(records):
+            raise ValueError(f'Нет сохранённых свечей {instrument.uid} {interval}')
+        historic = cls.__new__(cls)
+        historic._init_data(instrument, frame_from_records(records))
+        return historic
+
+    def indicator_engine(self) -> IndicatorEngine:
+        """
+        Движок индикаторов по текущим данным, значения на выходе округляются до шага цены инструмента.
+        """
+        return IndicatorEngine.from_frame(self.data, self.tick_size)
+
+    def create_atr(self, n=14, method: str = 'sma') -> Decimal:
+        """
+        Вычисляет ATR за n периодов и сохраняет столбцы prev_close и tr.
+        :param n: Период ATR.
+        :param method: 'sma' – простое скользящее среднее TR, 'wilder' – сглаживание Уайлдера.
+        :return: Последнее значение ATR.
+        """
+        engine = self.indicator_engine()
+        self.data['prev_close'] = engine.prev_close
+        self.data['tr'] = engine.tr
+        atr: Decimal = engine.last(engine.atr(n, method))
         return atr
 
     def save_to_csv(self, path: str, *args, **kwargs):
@@ -87,16 +109,16 @@ class HistoricInstrument:
             json.dump(instrument_dict, file, indent=4)
 
     def create_donchian_canal(self, long_d: int, short_d: int):
-        self.data[f'max_{long_d}_donchian'] = self.data['high'].rolling(long_d).max()
-        self.data[f'min_{long_d}_donchian'] = self.data['low'].rolling(long_d).min()
-        self.data[f'max_{short_d}_donchian'] = self.data['high'].rolling(short_d).max()
-        self.data[f'min_{short_d}_donchian'] = self.data['low'].rolling(short_d).min()
-
-        length_df = len(self.data)
-        self.max_donchian = Decimal(self.data.loc[length_df - 1, f'max_{long_d}_donchian'])
-        self.min_donchian = Decimal(self.data.loc[length_df - 1, f'min_{long_d}_donchian'])
-        self.max_short_donchian = Decimal(self.data.loc[length_df - 1, f'max_{short_d}_donchian'])
-        self.min_short_donchian = Decimal(self.data.loc[length_df - 1, f'min_{short_d}_donchian'])
+        engine = self.indicator_engine()
+        channels = engine.donchian(long_d, short_d)
+        for window, (upper, lower) in channels.items():
+            self.data[f'max_{window}_donchian'] = upper
+            self.data[f'min_{window}_donchian'] = lower
+
+        self.max_donchian = engine.last(channels[long_d][0])
+        self.min_donchian = engine.last(channels[long_d][1])
+        self.max_short_donchian = engine.last(channels[short_d][0])
+        self.min_short_donchian = engine.last(channels[short_d][1])
 
     def __call__(self):
         return self.data, self.instrument_info
@@ -0,0 +1,173 @@
+"""
+Векторизованный расчёт индикаторов (True Range, ATR, каналы Дончиана) на массивах NumPy.
+Все вычисления идут во float64, в Decimal значения переводятся только на выходе
+с округлением до минимального шага цены инструмента.
+"""
+from __future__ import annotations
+
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    """
+    True Range для каждой свечи. Для первой свечи (нет предыдущего close) берётся high - low.
+    """
+    tr = high - low
+    if len(tr) > 1:
+        prev_close = close[:-1]
+        np.maximum(tr[1:], np.abs(high[1:] - prev_close), out=tr[1:])
+        np.maximum(tr[1:], np.abs(low[1:] - prev_close), out=tr[1:])
+    return tr
+
+
+def sma(values: np.ndarray, n: int) -> np.ndarray:
+    """
+    Скользящее среднее за n периодов, для первых n - 1 значений – среднее по доступным (min_periods=1).
+    """
+    if n < 1:
+        raise ValueError('Период должен быть больше 0')
+    sums = np.convolve(values, np.ones(n), mode='full')[:len(values)]
+    counts = np.minimum(np.arange(1, len(values) + 1), n)
+    return sums / counts
+
+
+def wilder(values: np.ndarray, n: int, block: int = 256) -> np.ndarray:
+    """
+    Сглаживание Уайлдера: y[i] = (y[i - 1] * (n - 1) + x[i]) / n, начальное значение – SMA первых n значений.
+    Рекурсия раскрывается блоками через степени коэффициента, чтобы не гонять цикл по каждой строке.
+    """
+    result = sma(values, n)
+    if n == 1 or len(values) <= n:
+        return result
+    alpha = (n - 1) / n
+    powers = alpha ** np.arange(1, block + 1)
+    inverse = alpha ** -np.arange(block, dtype=np.float64)
+    prev = result[n - 1]
+    for start in range(n, len(values), block):
+        chunk = values[start:start + block] / n
+        size = len(chunk)
+        # y[j] = alpha^(j+1) * y0 + sum_{k<=j} alpha^(j-k) * x[k]
+        weighted = np.cumsum(chunk * inverse[:size]) / inverse[:size]
+        result[start:start + size] = powers[:size] * prev + weighted
+        prev = result[start + size - 1]
+    return result
+
+
+def _rolling_extreme(values: np.ndarray, window: int, func: np.ufunc, fill: float) -> np.ndarray:
+    """
+    Скользящий максимум/минимум за O(N) независимо от окна (алгоритм van Herk/Gil-Werman).
+    Первые window - 1 значений – NaN, как у pandas.rolling(window).
+    """
+    length = len(values)
+    result = np.full(length, np.nan)
+    if window < 1:
+        raise ValueError('Окно должно быть больше 0')
+    if length < window:
+        return result
+    blocks = -(-length // window)
+    padded = np.full(blocks * window, fill)
+    padded[:length] = values
+    padded = padded.reshape(blocks, window)
+    prefix = func.accumulate(padded, axis=1).ravel()
+    suffix = func.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    starts = np.arange(length - window + 1)
+    result[window - 1:] = func(suffix[starts], prefix[starts + window - 1])
+    return result
+
+
+def rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    return _rolling_extreme(values, window, np.maximum, -np.inf)
+
+
+def rolling_min(values: np.ndarray, window: int) -> np.ndarray:
+    return _rolling_extreme(values, window, np.minimum, np.inf)
+
+
+def to_decimal(value: float, increment: Optional[Decimal] = None) -> Optional[Decimal]:
+    """
+    Переводит float в Decimal, округляя до ближайшего кратного шагу цены.
+    :param value: Значение индикатора.
+    :param increment: Минимальный шаг цены инструмента.
+    :return: Decimal или None, если значение не определено.
+    """
+    if value is None or np.isnan(value):
+        return None
+    result = Decimal(repr(float(value)))
+    if increment:
+        result = (result / increment).to_integral_value(rounding=ROUND_HALF_EVEN) * increment
+    return result
+
+
+class IndicatorEngine:
+    """
+    Расчёт индикаторов по OHLC, хранящимся в массивах float64.
+    """
+
+    def __init__(self, high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                 price_increment: Optional[Decimal] = None) -> None:
+        """
+        :param high: Максимумы свечей.
+        :param low: Минимумы свечей.
+        :param close: Цены закрытия свечей.
+        :param price_increment: Минимальный шаг цены, до которого округляются значения на выходе.
+        """
+        self.high = np.ascontiguousarray(high, dtype=np.float64)
+        self.low = np.ascontiguousarray(low, dtype=np.float64)
+        self.close = np.ascontiguousarray(close, dtype=np.float64)
+        self.price_increment = price_increment
+        self._tr: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, price_increment: Optional[Decimal] = None) -> 'IndicatorEngine':
+        """
+        Создаёт движок из DataFrame со столбцами high, low, close (в том числе с Decimal внутри).
+        """
+        return cls(data['high'].to_numpy(dtype=np.float64),
+                   data['low'].to_numpy(dtype=np.float64),
+                   data['close'].to_numpy(dtype=np.float64),
+                   price_increment)
+
+    @property
+    def prev_close(self) -> np.ndarray:
+        prev_close = np.empty_like(self.close)
+        prev_close[:1] = np.nan
+        prev_close[1:] = self.close[:-1]
+        return prev_close
+
+    @property
+    def tr(self) -> np.ndarray:
+        if self._tr is None:
+            self._tr = true_range(self.high, self.low, self.close)
+        return self._tr
+
+    def atr(self, n: int = 14, method: str = 'sma') -> np.ndarray:
+        """
+        ATR за n периодов.
+        :param n: Период.
+        :param method: 'sma' – простое среднее, 'wilder' – сглаживание Уайлдера.
+        """
+        if method == 'sma':
+            return sma(self.tr, n)
+        elif method == 'wilder':
+            return wilder(self.tr, n)
+        raise ValueError(f'Неизвестный метод расчёта ATR: {method}')
+
+    def donchian(self, *windows: int) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+        """
+        Каналы Дончиана для любого количества окон.
+        :return: Словарь {окно: (максимумы high, минимумы low)}.
+        """
+        return {window: (rolling_max(self.high, window), rolling_min(self.low, window))
+                for window in dict.fromkeys(windows)}
+
+    def last(self, values: np.ndarray) -> Optional[Decimal]:
+        """
+        Последнее значение ряда в виде Decimal, округлённое до шага цены.
+        """
+        if not len(values):
+            return None
+        return to_decimal(values[-1], self.price_increment)
@@ -0,0 +1,203 @@
+"""
+Инкрементальный расчёт каналов Дончиана и ATR по свечам из стрима.
+Состояние один раз инициализируется историей, после чего каждая свеча обрабатывается за амортизированное O(1).
+"""
+from __future__ import annotations
+
+import datetime
+from collections import deque
+from decimal import Decimal
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from data_create.indicators import IndicatorEngine, to_decimal
+
+if TYPE_CHECKING:
+    from data_create.historic_future import HistoricInstrument
+
+
+class MonotonicWindow:
+    """
+    Максимум (или минимум) последних size значений на монотонной очереди.
+    """
+
+    def __init__(self, size: int, maximum: bool = True) -> None:
+        self.size = size
+        self.maximum = maximum
+        self._items: deque[tuple[int, float]] = deque()
+        self._count = 0
+
+    def push(self, value: float) -> None:
+        items = self._items
+        if self.maximum:
+            while items and items[-1][1] <= value:
+                items.pop()
+        else:
+            while items and items[-1][1] >= value:
+                items.pop()
+        items.append((self._count, value))
+        self._count += 1
+        if items[0][0] <= self._count - 1 - self.size:
+            items.popleft()
+
+    @property
+    def value(self) -> Optional[float]:
+        """
+        Значение экстремума или None, пока окно не заполнено.
+        """
+        if self._count < self.size:
+            return None
+        return self._items[0][1]
+
+
+class StreamingIndicators:
+    """
+    Каналы Дончиана и ATR по закрытым барам заданного периода.
+    Свечи из стрима (например, минутные) агрегируются в текущий бар, при начале нового бара
+    предыдущий считается закрытым и попадает в окна индикаторов.
+    """
+
+    def __init__(self, long_window: int = 20, short_window: int = 10, atr_period: int = 20,
+                 atr_method: str = 'sma', period: datetime.timedelta = datetime.timedelta(days=1),
+                 price_increment: Optional[Decimal] = None) -> None:
+        """
+        :param long_window: Окно канала Дончиана для входа.
+        :param short_window: Окно канала Дончиана для выхода.
+        :param atr_period: Период ATR.
+        :param atr_method: 'sma' или 'wilder'.
+        :param period: Длительность бара, по которому считаются индикаторы (как у исторических свечей).
+        :param price_increment: Минимальный шаг цены для округления значений.
+        """
+        if atr_method not in ('sma', 'wilder'):
+            raise ValueError(f'Неизвестный метод расчёта ATR: {atr_method}')
+        self.long_window = long_window
+        self.short_window = short_window
+        self.atr_period = atr_period
+        self.atr_method = atr_method
+        self.period_seconds = period.total_seconds()
+        self.price_increment = price_increment
+
+        self._long_high = MonotonicWindow(long_window, maximum=True)
+        self._long_low = MonotonicWindow(long_window, maximum=False)
+        self._short_high = MonotonicWindow(short_window, maximum=True)
+        self._short_low = MonotonicWindow(short_window, maximum=False)
+        self._tr_window: deque[float] = deque(maxlen=atr_period)
+        self._tr_sum = 0.0
+        self._atr: Optional[float] = None
+        self._prev_close: Optional[float] = None
+
+        self._last_closed_bucket: Optional[int] = None
+        self._bucket: Optional[int] = None
+        self._bar: Optional[list[float]] = None
+
+    @classmethod
+    def from_historic(cls, historic: 'HistoricInstrument', **kwargs) -> 'StreamingIndicators':
+        """
+        Создаёт состояние по историческим данным инструмента.
+        """
+        kwargs.setdefault('price_increment', historic.tick_size)
+        indicators = cls(**kwargs)
+        data = historic.data
+        indicators.seed(data['high'].to_numpy(dtype=np.float64),
+                        data['low'].to_numpy(dtype=np.float64),
+                        data['close'].to_numpy(dtype=np.float64),
+                        data['time'].iloc[-1])
+        return indicators
+
+    def seed(self, high: np.ndarray, low: np.ndarray, close: np.ndarray, last_time: datetime.datetime) -> None:
+        """
+        Инициализирует окна закрытыми барами истории.
+        :param last_time: Время последнего бара истории, свечи этого и более ранних баров из стрима игнорируются.
+        """
+        tail = max(self.long_window, self.short_window)
+        for h, l in zip(high[-tail:], low[-tail:]):
+            self._push_extremes(h, l)
+
+        engine = IndicatorEngine(high, low, close)
+        tr = engine.tr
+        for value in tr[-self.atr_period:]:
+            self._push_tr(value)
+        if self.atr_method == 'wilder' and len(tr):
+            self._atr = float(engine.atr(self.atr_period, 'wilder')[-1])
+        self._prev_close = float(close[-1]) if len(close) else None
+        self._last_closed_bucket = self._to_bucket(last_time)
+
+    def _to_bucket(self, time: datetime.datetime) -> int:
+        return int(time.timestamp() // self.period_seconds)
+
+    def _push_extremes(self, high: float, low: float) -> None:
+        self._long_high.push(high)
+        self._long_low.push(low)
+        self._short_high.push(high)
+        self._short_low.push(low)
+
+    def _push_tr(self, tr: float) -> None:
+        if len(self._tr_window) == self._tr_window.maxlen:
+            self._tr_sum -= self._tr_window[0]
+        self._tr_window.append(tr)
+        self._tr_sum += tr
+        if self.atr_method == 'sma':
+            self._atr = self._tr_sum / len(self._tr_window)
+        elif self._atr is None or len(self._tr_window) < self.atr_period:
+            self._atr = self._tr_sum / len(self._tr_window)
+        else:
+            self._atr = (self._atr * (self.atr_period - 1) + tr) / self.atr_period
+
+    def _close_bar(self) -> None:
+        high, low, close = self._bar
+        tr = high - low
+        if self._prev_close is not None:
+            tr = max(tr, abs(high - self._prev_close), abs(low - self._prev_close))
+        self._push_extremes(high, low)
+        self._push_tr(tr)
+        self._prev_close = close
+        self._last_closed_bucket = self._bucket
+        self._bar = None
+        self._bucket = None
+
+    def on_candle(self, time: datetime.datetime, high: float, low: float, close: float) -> bool:
+        """
+        Обрабатывает свечу из стрима.
+        :param time: Время начала свечи.
+        :return: True, если закрылся бар и значения индикаторов изменились.
+        """
+        bucket = self._to_bucket(time)
+        if self._last_closed_bucket is not None and bucket <= self._last_closed_bucket:
+            return False
+        closed = False
+        if self._bucket is not None and bucket > self._bucket:
+            self._close_bar()
+            closed = True
+        if self._bar is None:
+            self._bucket = bucket
+            self._bar = [high, low, close]
+        else:
+            bar = self._bar
+            bar[0] = max(bar[0], high)
+            bar[1] = min(bar[1], low)
+            bar[2] = close
+        return closed
+
+    def _decimal(self, value: Optional[float]) -> Optional[Decimal]:
+        return to_decimal(value, self.price_increment) if value is not None else None
+
+    @property
+    def max_donchian(self) -> Optional[Decimal]:
+        return self._decimal(self._long_high.value)
+
+    @property
+    def min_donchian(self) -> Optional[Decimal]:
+        return self._decimal(self._long_low.value)
+
+    @property
+    def max_short_donchian(self) -> Optional[Decimal]:
+        return self._decimal(self._short_high.value)
+
+    @property
+    def min_short_donchian(self) -> Optional[Decimal]:
+        return self._decimal(self._short_low.value)
+
+    @property
+    def atr(self) -> Optional[Decimal]:
+        return self._decimal(self._atr)
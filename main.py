@@ -1,30 +1,47 @@
 import asyncio
 import os
 
-from bot.telegram_bot import bot, dp, scheduler
+from bot.telegram_bot import bot, dp, notifier, scheduler
 from bot.handlers import start_router, connect
 
+from trad import executors
+from trad.context_registry import registry
+from trad.executors import lag_monitor
+from trad.metrics import MetricsServer, metrics
 from trad.task_all_time import update_data, start_bot, processing_stream, conclusion_in_day, \
-    processing_stream_portfolio, processing_trades_stream
+    processing_stream_portfolio, processing_trades_stream, refresh_margins, register_metrics
 
 CHAT_ID = os.getenv('CHAT_ID')
 
 
 async def main():
     dp.include_router(start_router)
+    notifier.start()
+    lag_monitor.start()
+    register_metrics(connect, notifier)
+    metrics_server = MetricsServer(metrics)
+    await metrics_server.start()
     scheduler.start()
     kwargs = {
         'connect': connect,
-        'bot': bot
+        'bot': notifier
     }
     scheduler.add_job(update_data, 'cron', kwargs=kwargs, hour=8, minute=50)
+    scheduler.add_job(refresh_margins, 'cron', kwargs=kwargs, hour='14,19', minute=6)
     scheduler.add_job(conclusion_in_day, 'cron', kwargs=kwargs, hour='14,21', minute=0)
-    await start_bot(connect=connect, bot=bot)
-    task_stream_msg = asyncio.create_task(processing_stream(connect=connect, bot=bot))
-    task_stream_portfolio = asyncio.create_task(processing_stream_portfolio(connect=connect, bot=bot))
-    task_stream_orders = asyncio.create_task(processing_trades_stream(connect=connect, bot=bot))
-    await bot.send_message(chat_id=CHAT_ID, text='Бот запустился')
-    await dp.start_polling(bot)
+    await start_bot(connect=connect, bot=notifier)
+    task_stream_msg = asyncio.create_task(processing_stream(connect=connect, bot=notifier))
+    task_stream_portfolio = asyncio.create_task(processing_stream_portfolio(connect=connect, bot=notifier))
+    task_stream_orders = asyncio.create_task(processing_trades_stream(connect=connect, bot=notifier))
+    await notifier.send_message(chat_id=CHAT_ID, text='Бот запустился')
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await registry.stop()
+        await notifier.stop()
+        await lag_monitor.stop()
+        await metrics_server.stop()
+        executors.shutdown(wait=False)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,205 @@
+"""
+Компактный формат сохранения StrategyContext.
+В снимок попадают только поля, нужные для торговли: уровни, ATR, юниты, точки входа, стопы, количество,
+направление и параметры инструмента. Исторические свечи не сохраняются – на них есть ссылка
+(uid и интервал) в хранилище свечей, откуда они загружаются при восстановлении.
+Снимок версионируется: старые версии при загрузке приводятся к текущей функциями из MIGRATIONS.
+"""
+from __future__ import annotations
+
+import dataclasses
+import datetime
+import json
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable, Optional
+
+from tinkoff.invest import Future, OrderState
+from tinkoff.invest.utils import decimal_to_quotation, quotation_to_decimal
+
+from data_create.candle_store import CandleStore, candle_store, records_from_frame
+from data_create.historic_future import HistoricInstrument
+from strategy.docnhian import IdleState, StrategyContext, TradeOpenState
+
+SCHEMA_VERSION = 1
+CANDLE_INTERVAL = '1d'
+STATES = {'IdleState': IdleState, 'TradeOpenState': TradeOpenState}
+# Функции перехода со старой версии снимка на следующую: {версия: функция(dict) -> dict}.
+MIGRATIONS: dict[int, Callable[[dict], dict]] = {}
+
+
+def decimal_to_str(value: Optional[Decimal]) -> Optional[str]:
+    return str(value) if value is not None else None
+
+
+def str_to_decimal(value: Optional[str]) -> Optional[Decimal]:
+    return Decimal(value) if value is not None else None
+
+
+@dataclass(slots=True)
+class InstrumentSnapshot:
+    uid: str
+    figi: str
+    name: str
+    ticker: str
+    lot: int
+    min_price_increment: str
+    min_price_increment_amount: str
+    candle_interval: str = CANDLE_INTERVAL
+
+    @classmethod
+    def from_future(cls, instrument: Future) -> 'InstrumentSnapshot':
+        return cls(uid=instrument.uid,
+                   figi=instrument.figi,
+                   name=instrument.name,
+                   ticker=instrument.ticker,
+                   lot=instrument.lot,
+                   min_price_increment=str(quotation_to_decimal(instrument.min_price_increment)),
+                   min_price_increment_amount=str(quotation_to_decimal(instrument.min_price_increment_amount)))
+
+    def to_future(self) -> Future:
+        """
+        Future только с сохранёнными полями. Полные параметры подтягиваются при следующем update_data.
+        """
+        return Future(uid=self.uid,
+                      figi=self.figi,
+                      name=self.name,
+                      ticker=self.ticker,
+                      lot=self.lot,
+                      min_price_increment=decimal_to_quotation(Decimal(self.min_price_increment)),
+                      min_price_increment_amount=decimal_to_quotation(Decimal(self.min_price_increment_amount)))
+
+
+@dataclass(slots=True)
+class ContextSnapshot:
+    instrument: InstrumentSnapshot
+    state: str
+    long: Optional[bool]
+    short: Optional[bool]
+    max_units: int
+    unit_step: str
+    position_units: int
+    quantity: int
+    entry_prices: list[str]
+    stop_levels: list[str]
+    start_position_date: Optional[str]
+    no_close: Optional[bool]
+    atr: Optional[str]
+    breakout_level_long: Optional[str]
+    breakout_level_short: Optional[str]
+    exit_long_donchian: Optional[str]
+    exit_short_donchian: Optional[str]
+    # id заявок каждого юнита вместо полных OrderState.
+    order_ids: list[list[str]]
+    version: int = SCHEMA_VERSION
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ContextSnapshot':
+        data = migrate(data)
+        return cls(**{**data, 'instrument': InstrumentSnapshot(**data['instrument'])})
+
+
+def migrate(data: dict) -> dict:
+    """
+    Приводит снимок старой версии к текущей.
+    """
+    version = data.get('version', 1)
+    if version > SCHEMA_VERSION:
+        raise ValueError(f'Снимок контекста версии {version} новее поддерживаемой {SCHEMA_VERSION}')
+    while version < SCHEMA_VERSION:
+        data = MIGRATIONS[version](data)
+        version = data['version']
+    return data
+
+
+def datetime_to_str(value) -> Optional[str]:
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value) if value else None
+
+
+def snapshot_context(context: StrategyContext) -> ContextSnapshot:
+    history = context.history_instrument
+    return ContextSnapshot(
+        instrument=InstrumentSnapshot.from_future(history.instrument_info),
+        state=context.state.__class__.__name__,
+        long=context.long,
+        short=context.short,
+        max_units=context.max_units,
+        unit_step=str(context.unit_step),
+        position_units=context.position_units,
+        quantity=int(context.quantity),
+        entry_prices=[str(price) for price in context.entry_prices],
+        stop_levels=[str(level) for level in context.stop_levels],
+        start_position_date=datetime_to_str(context.start_position_date),
+        no_close=context.no_close,
+        atr=decimal_to_str(history.atr),
+        breakout_level_long=decimal_to_str(context.breakout_level_long),
+        breakout_level_short=decimal_to_str(context.breakout_level_short),
+        exit_long_donchian=decimal_to_str(context.exit_long_donchian),
+        exit_short_donchian=decimal_to_str(context.exit_short_donchian),
+        order_ids=[[order.order_id for order in orders if order] for orders in context.order_state],
+    )
+
+
+def restore_context(snapshot: ContextSnapshot, store: CandleStore = candle_store) -> StrategyContext:
+    """
+    Восстанавливает контекст по снимку, исторические данные загружаются из хранилища свечей.
+    """
+    historic = HistoricInstrument.from_store(snapshot.instrument.to_future(), store,
+                                             snapshot.instrument.candle_interval)
+    context = StrategyContext(historic)
+    # Уровни и ATR – те, по которым торговал контекст на момент сохранения.
+    if snapshot.atr is not None:
+        historic.atr = Decimal(snapshot.atr)
+    context.breakout_level_long = historic.max_donchian = str_to_decimal(snapshot.breakout_level_long)
+    context.breakout_level_short = historic.min_donchian = str_to_decimal(snapshot.breakout_level_short)
+    context.exit_long_donchian = historic.min_short_donchian = str_to_decimal(snapshot.exit_long_donchian)
+    context.exit_short_donchian = historic.max_short_donchian = str_to_decimal(snapshot.exit_short_donchian)
+
+    context.state = STATES[snapshot.state]()
+    context.long = snapshot.long
+    context.short = snapshot.short
+    context.max_units = snapshot.max_units
+    context.unit_step = Decimal(snapshot.unit_step)
+    context.position_units = snapshot.position_units
+    context.quantity = snapshot.quantity
+    context.entry_prices = [Decimal(price) for price in snapshot.entry_prices]
+    context.stop_levels = [Decimal(level) for level in snapshot.stop_levels]
+    context.start_position_date = (datetime.datetime.fromisoformat(snapshot.start_position_date)
+                                   if snapshot.start_position_date else None)
+    context.no_close = snapshot.no_close
+    context.order_state = [[OrderState(order_id=order_id) for order_id in orders] for orders in snapshot.order_ids]
+    return context
+
+
+class SnapshotCodec:
+    """
+    Преобразование контекста в JSON снимок и обратно для ContextRegistry.
+    """
+
+    def __init__(self, store: CandleStore = candle_store) -> None:
+        """
+        :param store: Хранилище свечей, на которые ссылаются снимки.
+        """
+        self.store = store
+
+    def dumps(self, context: StrategyContext) -> str:
+        return json.dumps(snapshot_context(context).to_dict(), ensure_ascii=False, separators=(',', ':'))
+
+    def loads(self, text: str) -> StrategyContext:
+        return restore_context(ContextSnapshot.from_dict(json.loads(text)), self.store)
+
+    def adopt(self, context: StrategyContext) -> None:
+        """
+        Готовит контекст прежнего формата к сохранению снимком: если свечей инструмента нет в хранилище,
+        туда записываются свечи из его HistoricInstrument, чтобы снимок можно было восстановить.
+        """
+        history = context.history_instrument
+        if self.store.last_time(history.instrument_info.uid, CANDLE_INTERVAL) is None:
+            columns = ['time', 'open', 'high', 'low', 'close', 'volume']
+            self.store.merge(history.instrument_info.uid, CANDLE_INTERVAL,
+                             records_from_frame(history.data[columns]))
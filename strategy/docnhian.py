@@ -14,6 +14,7 @@ from tinkoff.invest.utils import money_to_decimal, now, quotation_to_decimal
 
 
 from data_create.historic_future import HistoricInstrument
+from data_create.streaming_indicators import StreamingIndicators
 from trad.connect_tinkoff import ConnectTinkoff
 from trad.task_all_time import place_order_with_status_check, order_for_close_position
 
@@ -56,7 +57,7 @@ def update_strategy_context(my_context: 'StrategyContext',
             f"{'long' if my_context.long else 'short'} точка входа {entry_price:.4f}"
         )
         my_context.start_position_date = min(x.order_date for x in result)
-    elif 1 < my_context.position_units <= 4:
+    elif my_context.position_units > 1:
         logger.info(
             f"[{my_context.history_instrument.instrument_info.name} увеличение позиции {my_context.position_units} "
             f"{'long' if my_context.long else 'short'} точка входа {entry_price:.4f}"
@@ -113,7 +114,6 @@ def close_context(context: 'StrategyContext') -> None:
     context.start_position_date = None
     context.long = None
     context.short = None
-    context.max_units = 4
     context.position_units = 0
     context.entry_prices = []
     context.stop_levels = []
@@ -142,12 +142,12 @@ class TradeOpenState(StrategyState):
 
         # Проверяем условие для увеличения позиции на лонг.
         if (context.position_units < context.max_units
-                and price >= last_entry + (Decimal(0.5) * context.history_instrument.atr)
+                and price >= last_entry + (context.unit_step * context.history_instrument.atr)
                 and context.long):
             logger.info(f"{context.history_instrument.instrument_info.name} "
                         f"переход на этап {context.position_units + 1} - {price:.2f} - long")
             try:
-                entry: Decimal = last_entry + (Decimal(0.5) * context.history_instrument.atr)
+                entry: Decimal = last_entry + (context.unit_step * context.history_instrument.atr)
                 result: list[OrderState] = await place_order_with_status_check(connect=connect, context=context,
                                                                                price=entry, long=True)
                 update_strategy_context(my_context=context, result=result, long=True)
@@ -158,12 +158,12 @@ class TradeOpenState(StrategyState):
 
         # Проверяем условие для увеличения позиции на шорт.
         elif (context.position_units < context.max_units
-              and price <= last_entry - (Decimal(0.5) * context.history_instrument.atr)
+              and price <= last_entry - (context.unit_step * context.history_instrument.atr)
               and context.short):
             logger.info(f"{context.history_instrument.instrument_info.name} "
                         f"переход на этап {context.position_units + 1} - {price:.2f} - short")
             try:
-                entry: Decimal = last_entry - (Decimal(0.5) * context.history_instrument.atr)
+                entry: Decimal = last_entry - (context.unit_step * context.history_instrument.atr)
                 result: list[OrderState] = await place_order_with_status_check(connect=connect, context=context,
                                                                                price=entry, long=False)
                 update_strategy_context(my_context=context, result=result, long=False)
@@ -244,11 +244,15 @@ class TradeOpenState(StrategyState):
 
 # Контекст, хранящий состояние стратегии для конкретного инструмента
 class StrategyContext:
+    # Шаг добавления юнита в ATR. На уровне класса, чтобы его получили и контексты, сохранённые до появления параметра.
+    unit_step: Decimal = Decimal('0.5')
+
     def __init__(self, history_instrument: HistoricInstrument):
         """
         :param history_instrument: Данные по инструменту, который будет торговаться по этой стратегии
         """
         self.history_instrument: HistoricInstrument = None
+        self.indicators: StreamingIndicators = None
         self.breakout_level_long: Decimal = None
         self.breakout_level_short: Decimal = None
         self.exit_long_donchian: Decimal = None
@@ -258,6 +262,8 @@ class StrategyContext:
         self.long: bool = None
         self.short: bool = None
         self.max_units: int = 4
+        # Переносить стоп на канал выхода только при позиции в max_units юнитов (используется в переборе параметров).
+        self.trail_at_max_units: bool = False
         self.position_units: int = 0
         self.entry_prices: list[Decimal] = []
         self.stop_levels: list[Decimal] = []
@@ -272,16 +278,42 @@ class StrategyContext:
 
     def update_data(self, history_instrument: HistoricInstrument):
         self.history_instrument: HistoricInstrument = history_instrument
+        self.indicators = StreamingIndicators.from_historic(history_instrument)
+        self.update_levels()
+
+    def update_levels(self):
+        """
+        Обновляет уровни входа и выхода по значениям индикаторов исторических данных.
+        """
         self.breakout_level_long: Decimal = self.history_instrument.max_donchian
         self.breakout_level_short: Decimal = self.history_instrument.min_donchian
         self.exit_long_donchian: Decimal = self.history_instrument.min_short_donchian
         self.exit_short_donchian: Decimal = self.history_instrument.max_short_donchian
-        # Замена стоп лосса торговой стратегии при позиции в 4 юнита.
-        if self.max_units >= 4 and self.long and self.stop_levels[-1] < self.exit_long_donchian:
+        # Замена стоп лосса торговой стратегии на уровень канала выхода.
+        trail = not self.trail_at_max_units or self.position_units >= self.max_units
+        if trail and self.long and self.stop_levels[-1] < self.exit_long_donchian:
             self.stop_levels.append(self.exit_long_donchian)
-        elif self.max_units >= 4 and self.short and self.stop_levels[-1] > self.exit_short_donchian:
+        elif trail and self.short and self.stop_levels[-1] > self.exit_short_donchian:
             self.stop_levels.append(self.exit_short_donchian)
 
+    def on_candle(self, time: datetime.datetime, high: float, low: float, close: float) -> bool:
+        """
+        Обновляет индикаторы по свече из стрима без повторной загрузки истории.
+        :return: True, если закрылся бар и уровни стратегии изменились.
+        """
+        indicators: StreamingIndicators = getattr(self, 'indicators', None)
+        if indicators is None or not indicators.on_candle(time, high, low, close):
+            return False
+        if indicators.max_donchian is None or indicators.atr is None:
+            return False
+        self.history_instrument.atr = indicators.atr
+        self.history_instrument.max_donchian = indicators.max_donchian
+        self.history_instrument.min_donchian = indicators.min_donchian
+        self.history_instrument.max_short_donchian = indicators.max_short_donchian
+        self.history_instrument.min_short_donchian = indicators.min_short_donchian
+        self.update_levels()
+        return True
+
     @property
     def direction(self) -> OrderDirection:
         if self.long:
@@ -390,7 +422,6 @@ class StrategyContext:
             self.start_position_date: datetime.datetime = None
             self.long: bool = None
             self.short: bool = None
-            self.max_units: int = 4
             self.position_units: int = 0
             self.entry_prices: list[Decimal] = []
             self.stop_levels: list[Decimal] = []
@@ -0,0 +1,132 @@
+import datetime
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+import tinkoff.invest as ti
+
+from backtest.runner import BacktestParams, load_historics, run_backtest, run_backtests
+from backtest.sweep import make_grid, rank, run_sweep
+from data_create.candle_store import CandleStore, records_from_candles
+from data_create.historic_future import HistoricInstrument
+from strategy.docnhian import StrategyContext
+from trad.instrument_index import InstrumentIndex
+
+START = datetime.datetime(2024, 1, 1, 7, tzinfo=datetime.timezone.utc)
+
+
+def make_instrument() -> ti.Future:
+    return ti.Future(figi='FUTTEST', uid='uid-test', name='Test future', ticker='TEST', lot=1,
+                     min_price_increment=ti.Quotation(units=0, nano=10_000_000),
+                     min_price_increment_amount=ti.Quotation(units=0, nano=10_000_000),
+                     initial_margin_on_buy=ti.MoneyValue(currency='rub', units=1000, nano=0),
+                     initial_margin_on_sell=ti.MoneyValue(currency='rub', units=1000, nano=0))
+
+
+def make_candles(prices: list[float]) -> list[ti.HistoricCandle]:
+    candles = []
+    for day, price in enumerate(prices):
+        candles.append(ti.HistoricCandle(open=ti.Quotation(units=int(price), nano=0),
+                                         high=ti.Quotation(units=int(price) + 1, nano=0),
+                                         low=ti.Quotation(units=int(price) - 1, nano=0),
+                                         close=ti.Quotation(units=int(price), nano=0),
+                                         volume=100,
+                                         time=START + datetime.timedelta(days=day),
+                                         is_complete=True))
+    return candles
+
+
+def make_historic(prices: list[float]) -> HistoricInstrument:
+    return HistoricInstrument(make_instrument(), make_candles(prices))
+
+
+def test_backtest_trend_is_profitable():
+    # Боковик, затем устойчивый рост: стратегия входит на пробое и набирает юниты.
+    prices = [100 + (day % 3) for day in range(30)] + [103 + 2 * day for day in range(40)]
+    result = run_backtest(make_historic(prices))
+    assert result.trades >= 2
+    assert result.pnl > 0
+    assert result.bars == len(prices) - 20
+    assert result.prices == result.bars * 4
+
+
+def test_backtest_without_fills_and_in_parallel():
+    prices = [100 + (day % 3) for day in range(30)] + [103 + 2 * day for day in range(40)]
+    historic = make_historic(prices)
+    no_fill, slippage = run_backtests([(historic, BacktestParams(fill_ratio=0)),
+                                       (historic, BacktestParams(slippage_ticks=50))], max_workers=2)
+    assert no_fill.trades == 0
+    assert no_fill.pnl == 0
+    assert slippage.pnl < run_backtest(historic).pnl
+
+
+def test_sweep_matches_single_runs_and_is_ranked():
+    prices = [100 + (day % 3) for day in range(30)] + [103 + 2 * day for day in range(40)]
+    historic = make_historic(prices)
+    grid = make_grid([10, 20], [5, 20], [14], [0.5, 1], [1, 4])
+    # Окно выхода 20 не короче окна входа 10 и 20 – такие сочетания пропускаются.
+    assert len(grid) == 8
+    results = rank(run_sweep([historic], grid, max_workers=2))
+    assert len(results) == len(grid)
+    assert [r.pnl for r in results] == sorted((r.pnl for r in results), reverse=True)
+    best = results[0]
+    assert run_backtest(historic, best.params).pnl == best.pnl
+
+
+def test_sweep_unit_cap_trails_stop():
+    prices = [100 + (day % 3) for day in range(30)] + [103 + 2 * day for day in range(40)]
+    historic = make_historic(prices)
+    historic.min_short_donchian = Decimal(150)
+
+    # Как в боте: стоп переносится на канал выхода при любом количестве юнитов.
+    context = StrategyContext(historic)
+    context.max_units = make_grid([20], [10], [14], [1], [2])[0].max_units
+    context.long = True
+    context.position_units = 1
+    context.stop_levels = [Decimal(140)]
+    context.update_levels()
+    assert context.stop_levels == [Decimal(140), Decimal(150)]
+
+    # Параметр перебора: стоп переносится, только когда позиция набрана до максимума.
+    params = make_grid([20], [10], [14], [1], [2], BacktestParams(trail_at_max_units=True))[0]
+    context = StrategyContext(historic)
+    context.max_units = params.max_units
+    context.trail_at_max_units = params.trail_at_max_units
+    context.long = True
+    context.position_units = 1
+    context.stop_levels = [Decimal(140)]
+    context.update_levels()
+    assert context.stop_levels == [Decimal(140)]
+    context.position_units = 2
+    context.update_levels()
+    assert context.stop_levels == [Decimal(140), Decimal(150)]
+
+
+def test_from_candles_matches_from_store(tmp_path):
+    prices = [100 + (day % 3) for day in range(30)]
+    store = CandleStore(str(tmp_path))
+    store.merge('uid-test', '1d', records_from_candles(make_candles(prices)))
+
+    from_candles = HistoricInstrument.from_candles(make_instrument(), make_candles(prices))
+    from_store = HistoricInstrument.from_store(make_instrument(), store, '1d')
+    pd.testing.assert_frame_equal(from_candles.data, from_store.data)
+    pd.testing.assert_frame_equal(make_historic(prices).data, from_store.data)
+    assert from_candles.atr == from_store.atr
+
+
+def test_load_historics_from_candle_store(tmp_path):
+    prices = [100 + (day % 3) for day in range(30)] + [103 + 2 * day for day in range(40)]
+    store = CandleStore(str(tmp_path))
+    store.merge('uid-test', '1d', records_from_candles(make_candles(prices)))
+    index = InstrumentIndex(path=str(tmp_path / 'futures.pkl'))
+    index.build([make_instrument()])
+
+    historic, = load_historics(['TEST'], store=store, index=index)
+    assert len(historic.data) == len(prices)
+    assert run_backtest(historic).pnl == run_backtest(make_historic(prices)).pnl
+    with pytest.raises(ValueError):
+        load_historics(['UNKNOWN'], store=store, index=index)
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,20 @@
+import pytest
+
+from benchmarks.bench_historic_instrument import OPERATIONS, format_report, run_suite, synthetic_candles
+
+
+def test_synthetic_candles_are_deterministic():
+    first, second = synthetic_candles(50, seed=3), synthetic_candles(50, seed=3)
+    assert [candle.close for candle in first] == [candle.close for candle in second]
+    assert all(candle.low.units <= candle.close.units <= candle.high.units for candle in first)
+
+
+def test_suite_reports_every_operation():
+    report = run_suite((60,), repeat=1)
+    assert [item['operation'] for item in report['results']] == list(OPERATIONS)
+    assert all(item['best'] > 0 and item['peak_bytes'] > 0 for item in report['results'])
+    assert 'Время x' in format_report(report, baseline=report)
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,141 @@
+import datetime
+import gc
+import os
+import threading
+import weakref
+from decimal import Decimal
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_create.candle_store import CandleStore, records_from_candles, records_from_frame, frame_from_records, \
+    frame_from_candles, PRICE_SCALE
+from trad.connect_tinkoff import ConnectTinkoff
+
+START = datetime.datetime(2025, 1, 1, 7, tzinfo=datetime.timezone.utc)
+
+
+def fake_candle(day: int, price: float, volume: int = 10) -> SimpleNamespace:
+    units = int(price)
+    quotation = SimpleNamespace(units=units, nano=int(round((price - units) * PRICE_SCALE)))
+    return SimpleNamespace(time=START + datetime.timedelta(days=day), open=quotation, high=quotation,
+                           low=quotation, close=quotation, volume=volume)
+
+
+def test_merge_replaces_unfinished_candle(tmp_path):
+    store = CandleStore(str(tmp_path))
+    assert store.last_time('uid', '1d') is None
+
+    store.merge('uid', '1d', records_from_candles([fake_candle(day, 100 + day) for day in range(5)]))
+    assert store.last_time('uid', '1d') == START + datetime.timedelta(days=4)
+
+    # Повторная загрузка начинается с последней сохранённой свечи и перезаписывает её.
+    merged = store.merge('uid', '1d', records_from_candles([fake_candle(4, 200.5), fake_candle(5, 201)]))
+    assert len(merged) == 6
+    assert merged['close'][4] == 200.5 * PRICE_SCALE
+    np.testing.assert_array_equal(store.load('uid', '1d'), merged)
+
+    window = store.window(merged, START + datetime.timedelta(days=1), START + datetime.timedelta(days=3))
+    assert len(window) == 2
+    assert store.path('uid', '1m') != store.path('uid', '1M')
+
+
+def test_records_from_frame():
+    data = pd.DataFrame([{'time': START, 'open': Decimal('1.5'), 'high': Decimal('2.25'),
+                          'low': Decimal('1.000000001'), 'close': Decimal('2'), 'volume': 3}])
+    records = records_from_frame(data)
+    assert records['high'][0] == 2_250_000_000
+    assert records['low'][0] == 1_000_000_001
+    assert records['time'][0] == int(START.timestamp()) * 1_000_000_000
+
+    frame = frame_from_records(records)
+    assert frame['low'].iloc[0] == 1.000000001
+    assert frame['high'].iloc[0] == 2.25
+    assert frame['time'].iloc[0] == START
+    np.testing.assert_array_equal(records_from_frame(frame), records)
+
+
+def test_frame_from_candles_is_numeric():
+    candles = [fake_candle(day, 100 + day + 0.25) for day in range(4)]
+    frame = frame_from_candles(iter(candles))
+    assert frame['close'].dtype == np.float64
+    assert isinstance(frame.index, pd.DatetimeIndex)
+    assert frame['close'].tolist() == [100.25, 101.25, 102.25, 103.25]
+    assert frame['time'].iloc[-1] == START + datetime.timedelta(days=3)
+    assert frame['volume'].tolist() == [10] * 4
+    np.testing.assert_array_equal(records_from_frame(frame), records_from_candles(candles))
+
+
+def test_frames_from_candles_and_records_match():
+    candles = [fake_candle(day, price) for day, price in enumerate([100.25, -1.5, 0.000000001, -0.75, 123456.789])]
+    pd.testing.assert_frame_equal(frame_from_records(records_from_candles(candles)), frame_from_candles(candles))
+
+
+class WindowsLikeStore(CandleStore):
+    """
+    Хранилище с поведением Windows: файл, открытый через memory map, нельзя заменить.
+    """
+
+    def __init__(self, root: str) -> None:
+        super().__init__(root)
+        self.maps: list[weakref.ref] = []
+
+    def load(self, uid: str, interval: str, mmap: bool = True) -> np.ndarray:
+        records = super().load(uid, interval, mmap)
+        if isinstance(records, np.memmap):
+            self.maps.append(weakref.ref(records))
+        return records
+
+    def _write(self, path: str, records: np.ndarray) -> None:
+        if any(ref() is not None and ref().filename == os.path.abspath(path) for ref in self.maps):
+            raise PermissionError(f'Файл {path} открыт через memory map')
+        super()._write(path, records)
+
+
+@pytest.mark.asyncio
+async def test_sync_candles_merges_without_live_memory_map(tmp_path):
+    store = WindowsLikeStore(str(tmp_path))
+    store.merge('uid', '1d', records_from_candles([fake_candle(day, 100 + day) for day in range(5)]))
+
+    mapped = store.load('uid', '1d')
+    with pytest.raises(PermissionError):
+        store.merge('uid', '1d', records_from_candles([fake_candle(5, 105)]))
+    del mapped
+
+    async def get_all_candles(**kwargs):
+        for day in range(4, 7):
+            yield fake_candle(day, 200 + day)
+
+    connect = ConnectTinkoff('TOKEN', store=store)
+    connect.client = SimpleNamespace(get_all_candles=get_all_candles)
+    candles = await connect.sync_candles('uid', '1d', START, START + datetime.timedelta(days=10))
+    assert len(candles) == 7
+    assert len(store.load('uid', '1d', mmap=False)) == 7
+
+
+@pytest.mark.asyncio
+async def test_sync_candles_reads_stored_window_off_the_loop(tmp_path):
+    store = WindowsLikeStore(str(tmp_path))
+    store.merge('uid', '1d', records_from_candles([fake_candle(day, 100 + day) for day in range(5)]))
+    threads = []
+    load = store.load
+
+    def tracked_load(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return load(*args, **kwargs)
+
+    store.load = tracked_load
+    connect = ConnectTinkoff('TOKEN', store=store)
+    # Новых свечей нет: запросов к API не будет, свечи читаются из файла.
+    candles = await connect.sync_candles('uid', '1d', START + datetime.timedelta(days=1),
+                                         START + datetime.timedelta(days=4))
+    assert [candle.close.units for candle in candles] == [101, 102, 103]
+    assert threads and threading.get_ident() not in threads
+    gc.collect()
+    assert all(ref() is None for ref in store.maps)
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from trad.client_pool import ClientPool, STREAM, UNARY
+
+
+class FakeClient:
+    opened = []
+
+    def __init__(self):
+        self.closed = False
+        FakeClient.opened.append(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_stream_and_unary_channels_are_separate():
+    FakeClient.opened = []
+    pool = ClientPool(factory=FakeClient, grace=0)
+    await pool.open()
+    assert pool.unary is not pool.stream
+    assert len(FakeClient.opened) == 2
+    await pool.close()
+    assert all(client.closed for client in FakeClient.opened)
+
+
+@pytest.mark.asyncio
+async def test_swap_keeps_leased_channel_open():
+    FakeClient.opened = []
+    pool = ClientPool(factory=FakeClient, grace=0)
+    await pool.open()
+    unary = pool.unary
+    old_stream = pool.stream
+
+    async with pool.lease(STREAM) as leased:
+        assert leased is old_stream
+        new_stream = await pool.swap(STREAM)
+        assert pool.stream is new_stream
+        await asyncio.sleep(0.01)
+        # Пока аренда не снята, старый канал открыт.
+        assert not old_stream.closed
+    await asyncio.sleep(0.01)
+    assert old_stream.closed
+    assert not unary.closed
+    assert pool.metrics()[STREAM]['swaps'] == 1
+    assert pool.metrics()[UNARY]['swaps'] == 0
+    await pool.close()
+
+
+if __name__ == '__main__':
+    pytest.main()
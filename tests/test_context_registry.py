@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import shelve
+import time
+
+import pytest
+
+from trad.context_registry import ContextRegistry
+
+
+class FakeContext:
+    def __init__(self, quantity: int = 0):
+        self.quantity = quantity
+
+
+class FakeCodec:
+    def __init__(self):
+        self.adopted = []
+
+    def dumps(self, context: FakeContext) -> str:
+        return json.dumps({'quantity': context.quantity})
+
+    def loads(self, text: str) -> FakeContext:
+        return FakeContext(json.loads(text)['quantity'])
+
+    def adopt(self, context: FakeContext) -> None:
+        self.adopted.append(context)
+
+
+def read_snapshot(path, figi: str) -> dict:
+    with open(os.path.join(path, figi + '.json'), encoding='utf-8') as file:
+        return json.load(file)
+
+
+def test_registry_load_and_flush(tmp_path):
+    path = str(tmp_path / 'contexts')
+    os.makedirs(path)
+    with open(os.path.join(path, 'FIGI1.json'), 'w') as file:
+        file.write('{"quantity": 1}')
+    with open(os.path.join(path, 'BROKEN.json'), 'w') as file:
+        file.write('{')
+
+    registry = ContextRegistry(path, legacy_path=None, codec=FakeCodec())
+    assert registry.get('FIGI1').quantity == 1
+    assert registry.get('FIGI2') is None
+    # Повреждённый снимок пропускается, но остаётся на диске.
+    assert 'BROKEN' not in registry
+    assert os.path.exists(os.path.join(path, 'BROKEN.json'))
+
+    registry.get('FIGI1').quantity = 5
+    registry.mark_dirty('FIGI1')
+    registry.set('FIGI2', FakeContext(2))
+    assert registry.flush() == 2
+    assert registry.flush() == 0
+
+    assert read_snapshot(path, 'FIGI1')['quantity'] == 5
+    assert read_snapshot(path, 'FIGI2')['quantity'] == 2
+
+    registry.delete('FIGI1')
+    registry.flush()
+    assert not os.path.exists(os.path.join(path, 'FIGI1.json'))
+    assert 'FIGI1' not in registry
+
+
+def test_registry_migrates_legacy_shelve(tmp_path):
+    legacy_path = str(tmp_path / 'state')
+    with shelve.open(legacy_path) as db:
+        db['FIGI1'] = FakeContext(3)
+
+    codec = FakeCodec()
+    path = str(tmp_path / 'contexts')
+    registry = ContextRegistry(path, legacy_path=legacy_path, codec=codec)
+    assert registry.get('FIGI1').quantity == 3
+    assert len(codec.adopted) == 1
+    assert read_snapshot(path, 'FIGI1')['quantity'] == 3
+
+    # При следующем запуске данные читаются уже из снимков.
+    with shelve.open(legacy_path) as db:
+        db['FIGI1'] = FakeContext(100)
+    registry.load()
+    assert registry.get('FIGI1').quantity == 3
+
+
+@pytest.mark.asyncio
+async def test_registry_write_behind_coalesces(tmp_path, monkeypatch):
+    path = str(tmp_path / 'contexts')
+    registry = ContextRegistry(path, flush_interval=0.05, legacy_path=None, codec=FakeCodec())
+    registry.load()
+    calls = []
+    original_flush = registry.flush_async
+
+    async def counted_flush():
+        calls.append(await original_flush())
+
+    monkeypatch.setattr(registry, 'flush_async', counted_flush)
+
+    registry.start()
+    context = FakeContext()
+    registry.set('FIGI1', context)
+    for i in range(10):
+        context.quantity = i
+        registry.mark_dirty('FIGI1')
+    await asyncio.sleep(0.2)
+    await registry.stop()
+
+    assert calls[0] == 1
+    assert read_snapshot(path, 'FIGI1')['quantity'] == 9
+
+
+
+@pytest.mark.asyncio
+async def test_registry_change_during_write_goes_to_next_batch(tmp_path, monkeypatch):
+    path = str(tmp_path / 'contexts')
+    registry = ContextRegistry(path, legacy_path=None, codec=FakeCodec())
+    registry.load()
+    context = FakeContext(1)
+    registry.set('FIGI1', context)
+
+    original_write = ContextRegistry._write
+
+    def slow_write(file_path: str, text: str) -> None:
+        time.sleep(0.1)
+        original_write(file_path, text)
+
+    monkeypatch.setattr(ContextRegistry, '_write', staticmethod(slow_write))
+    flush = asyncio.create_task(registry.flush_async())
+    await asyncio.sleep(0.03)
+    # Изменение во время записи: в файл попадает снимок на момент начала записи, ключ остаётся грязным.
+    context.quantity = 2
+    registry.mark_dirty('FIGI1')
+    assert await flush == 1
+    assert read_snapshot(path, 'FIGI1')['quantity'] == 1
+    assert registry.flush() == 1
+    assert read_snapshot(path, 'FIGI1')['quantity'] == 2
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,69 @@
+import datetime
+import pickle
+from decimal import Decimal
+
+import pytest
+import tinkoff.invest as ti
+
+from data_create.candle_store import CandleStore, records_from_candles
+from data_create.historic_future import HistoricInstrument
+from strategy.context_snapshot import SnapshotCodec
+from strategy.docnhian import StrategyContext, TradeOpenState
+
+START = datetime.datetime(2024, 1, 1, 7, tzinfo=datetime.timezone.utc)
+
+
+def make_candles(count: int = 250) -> list[ti.HistoricCandle]:
+    return [ti.HistoricCandle(open=ti.Quotation(units=100 + day % 7, nano=0),
+                              high=ti.Quotation(units=102 + day % 7, nano=500_000_000),
+                              low=ti.Quotation(units=99 + day % 7, nano=0),
+                              close=ti.Quotation(units=101 + day % 7, nano=0),
+                              volume=100,
+                              time=START + datetime.timedelta(days=day),
+                              is_complete=True)
+            for day in range(count)]
+
+
+def make_future() -> ti.Future:
+    return ti.Future(figi='FUTTEST', uid='uid-test', name='Test future', ticker='TEST', lot=1,
+                     min_price_increment=ti.Quotation(units=0, nano=10_000_000),
+                     min_price_increment_amount=ti.Quotation(units=0, nano=10_000_000))
+
+
+def test_snapshot_round_trip(tmp_path):
+    candles = make_candles()
+    store = CandleStore(str(tmp_path))
+    store.merge('uid-test', '1d', records_from_candles(candles))
+
+    context = StrategyContext(HistoricInstrument(make_future(), candles))
+    context.state = TradeOpenState()
+    context.long, context.short = True, False
+    context.position_units = 2
+    context.quantity = 7
+    context.entry_prices = [Decimal('101.50'), Decimal('102.75')]
+    context.stop_levels = [Decimal('100.25'), Decimal('101.50')]
+    context.start_position_date = START
+    context.order_state = [[ti.OrderState(order_id='1')], [ti.OrderState(order_id='2')]]
+
+    codec = SnapshotCodec(store)
+    text = codec.dumps(context)
+    assert len(text) < 2000
+    assert len(text) * 10 < len(pickle.dumps(context))
+
+    restored = codec.loads(text)
+    assert isinstance(restored.state, TradeOpenState)
+    assert restored.long is True and restored.short is False
+    assert restored.position_units == 2
+    assert restored.quantity == 7
+    assert restored.entry_prices == context.entry_prices
+    assert restored.stop_levels == context.stop_levels
+    assert restored.start_position_date == START
+    assert restored.breakout_level_long == context.breakout_level_long
+    assert restored.exit_short_donchian == context.exit_short_donchian
+    assert restored.history_instrument.atr == context.history_instrument.atr
+    assert restored.history_instrument.tick_size == context.history_instrument.tick_size
+    assert [[order.order_id for order in orders] for orders in restored.order_state] == [['1'], ['2']]
+
+
+if __name__ == '__main__':
+    pytest.main()
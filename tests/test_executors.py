@@ -0,0 +1,33 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from trad.executors import LagMonitor, run_io
+
+
+@pytest.mark.asyncio
+async def test_run_io_runs_in_thread_pool():
+    thread = await run_io(lambda: threading.current_thread().name)
+    assert thread.startswith('io')
+    assert await run_io(sorted, [3, 1, 2], reverse=True) == [3, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_lag_monitor_detects_blocking_callback():
+    monitor = LagMonitor(interval=0.01, threshold=0.05)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    assert monitor.blocked == 0
+    # Синхронная работа в цикле событий задерживает замер на всё время блокировки.
+    time.sleep(0.1)
+    await asyncio.sleep(0.03)
+    await monitor.stop()
+    assert monitor.blocked == 1
+    assert monitor.max_lag >= 0.08
+    assert monitor.metrics()['p99'] == monitor.max_lag
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,87 @@
+import datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_create.indicators import IndicatorEngine, rolling_max, rolling_min, to_decimal
+from data_create.streaming_indicators import StreamingIndicators
+
+
+def make_ohlc(n: int = 500, seed: int = 1) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    close = 1000 + np.cumsum(rng.normal(0, 5, n)).round(1)
+    high = close + rng.uniform(0, 10, n).round(1)
+    low = close - rng.uniform(0, 10, n).round(1)
+    return high, low, close
+
+
+@pytest.mark.parametrize('window', [1, 3, 10, 20, 55])
+def test_rolling_extremes_match_pandas(window):
+    high, low, _ = make_ohlc()
+    expected_max = pd.Series(high).rolling(window).max().to_numpy()
+    expected_min = pd.Series(low).rolling(window).min().to_numpy()
+    np.testing.assert_array_equal(rolling_max(high, window), expected_max)
+    np.testing.assert_array_equal(rolling_min(low, window), expected_min)
+
+
+def test_atr_sma_and_wilder():
+    high, low, close = make_ohlc()
+    engine = IndicatorEngine(high, low, close)
+    prev_close = pd.Series(close).shift(1)
+    expected_tr = np.maximum.reduce([high - low,
+                                     (pd.Series(high) - prev_close).abs().fillna(0).to_numpy(),
+                                     (pd.Series(low) - prev_close).abs().fillna(0).to_numpy()])
+    np.testing.assert_allclose(engine.tr, expected_tr)
+
+    expected_sma = pd.Series(expected_tr).rolling(20, min_periods=1).mean().to_numpy()
+    np.testing.assert_allclose(engine.atr(20), expected_sma)
+
+    expected_wilder = expected_sma.copy()
+    for i in range(20, len(expected_tr)):
+        expected_wilder[i] = (expected_wilder[i - 1] * 19 + expected_tr[i]) / 20
+    np.testing.assert_allclose(engine.atr(20, method='wilder'), expected_wilder)
+
+
+def test_decimal_edges_rounded_to_increment():
+    assert to_decimal(101.23, Decimal('0.05')) == Decimal('101.25')
+    assert to_decimal(float('nan'), Decimal('0.05')) is None
+    engine = IndicatorEngine(np.array([10.0, 12.0]), np.array([9.0, 11.0]), np.array([9.5, 11.5]),
+                             price_increment=Decimal('0.5'))
+    upper, lower = engine.donchian(2)[2]
+    assert engine.last(upper) == Decimal('12.0')
+    assert engine.last(lower) == Decimal('9.0')
+
+
+@pytest.mark.parametrize('method', ['sma', 'wilder'])
+def test_streaming_indicators_match_batch(method):
+    high, low, close = make_ohlc(120)
+    start = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    history = 100
+    indicators = StreamingIndicators(20, 10, 20, atr_method=method)
+    indicators.seed(high[:history], low[:history], close[:history], start + datetime.timedelta(days=history - 1))
+
+    for day in range(history, len(close)):
+        day_start = start + datetime.timedelta(days=day)
+        # Дневной бар приходит в виде трёх минутных свечей, последняя – повтор незакрытой свечи.
+        indicators.on_candle(day_start, high[day] - 1, low[day], close[day] + 0.5)
+        indicators.on_candle(day_start + datetime.timedelta(minutes=1), high[day], low[day] + 1, close[day])
+        indicators.on_candle(day_start + datetime.timedelta(minutes=1), high[day], low[day] + 1, close[day])
+    # Свеча следующего дня закрывает последний бар.
+    assert indicators.on_candle(start + datetime.timedelta(days=len(close)), 0, 0, 0)
+    # Свечи уже закрытых баров игнорируются.
+    assert not indicators.on_candle(start, 10 ** 6, 0, 0)
+
+    engine = IndicatorEngine(high, low, close)
+    upper, lower = engine.donchian(20)[20]
+    short_upper, short_lower = engine.donchian(10)[10]
+    assert float(indicators.max_donchian) == upper[-1]
+    assert float(indicators.min_donchian) == lower[-1]
+    assert float(indicators.max_short_donchian) == short_upper[-1]
+    assert float(indicators.min_short_donchian) == short_lower[-1]
+    assert float(indicators.atr) == pytest.approx(engine.atr(20, method)[-1])
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from trad.instrument_index import InstrumentIndex
+
+
+def make_future(ticker, basic_asset='Si'):
+    return SimpleNamespace(ticker=ticker, figi=f'FIGI{ticker}', uid=f'uid-{ticker}', basic_asset=basic_asset,
+                           name=f'Фьючерс {ticker}', min_price_increment=1, min_price_increment_amount=1,
+                           initial_margin_on_buy=1000, initial_margin_on_sell=1100)
+
+
+class FakeInstruments:
+    def __init__(self, futures):
+        self.futures_list = futures
+        self.calls = 0
+
+    async def futures(self):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return SimpleNamespace(instruments=list(self.futures_list))
+
+
+@pytest.mark.asyncio
+async def test_index_loads_once_and_serves_lookups(tmp_path):
+    instruments = FakeInstruments([make_future('SiH5'), make_future('SiM5'), make_future('BRH5', 'BR')])
+    client = SimpleNamespace(instruments=instruments)
+    index = InstrumentIndex(path=str(tmp_path / 'futures.pkl'))
+
+    found = await asyncio.gather(*(index.find_by_ticker(client, ticker) for ticker in ['SiH5', 'SiM5', 'BRH5']))
+    assert [future.ticker for future in found] == ['SiH5', 'SiM5', 'BRH5']
+    assert instruments.calls == 1
+
+    assert index.get('FIGISiH5').ticker == 'SiH5'
+    assert index.get('uid-BRH5').ticker == 'BRH5'
+    assert [future.ticker for future in index.by_basic_asset['Si']] == ['SiH5', 'SiM5']
+    assert index.name('FIGIBRH5') == 'Фьючерс BRH5'
+    assert index.margin('SiH5') == (1000, 1100)
+
+    # Новый процесс читает справочник с диска, не обращаясь к API.
+    restored = InstrumentIndex(path=str(tmp_path / 'futures.pkl'))
+    assert (await restored.find_by_ticker(client, 'SiM5')).uid == 'uid-SiM5'
+    assert instruments.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_index_refreshes_in_background(tmp_path):
+    instruments = FakeInstruments([make_future('SiH5')])
+    client = SimpleNamespace(instruments=instruments)
+    index = InstrumentIndex(path=str(tmp_path / 'futures.pkl'))
+    await index.ensure(client)
+
+    instruments.futures_list.append(make_future('SiM5'))
+    index.loaded_at -= datetime.timedelta(days=1)
+    # Устаревший справочник отвечает сразу, обновление идёт в фоне.
+    assert (await index.find_by_ticker(client, 'SiH5')).ticker == 'SiH5'
+    assert 'SiM5' not in index.by_ticker
+    await asyncio.sleep(0.01)
+    assert 'SiM5' in index.by_ticker
+    assert instruments.calls == 2
+
+    with pytest.raises(ValueError):
+        await index.find_by_ticker(client, 'UNKNOWN')
+
+
+@pytest.mark.asyncio
+async def test_new_ticker_found_while_index_is_expired(tmp_path):
+    instruments = FakeInstruments([make_future('SiH5')])
+    client = SimpleNamespace(instruments=instruments)
+    index = InstrumentIndex(path=str(tmp_path / 'futures.pkl'))
+    await index.ensure(client)
+
+    # Новая серия контрактов появилась, пока справочник устарел: поиск ждёт обновления, а не падает.
+    instruments.futures_list.append(make_future('SiM5'))
+    index.loaded_at -= datetime.timedelta(days=1)
+    assert (await index.find_by_ticker(client, 'SiM5')).ticker == 'SiM5'
+    assert instruments.calls == 2
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,55 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from trad.instrument_names import InstrumentNames
+
+
+class FakeInstruments:
+    def __init__(self, names):
+        self.names = names
+        self.calls = []
+
+    async def get_instrument_by(self, id_type, id):
+        self.calls.append(id)
+        await asyncio.sleep(0.01)
+        if id not in self.names:
+            raise ValueError('not found')
+        return SimpleNamespace(instrument=SimpleNamespace(name=self.names[id]))
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_share_requests_and_append(tmp_path):
+    legacy = tmp_path / 'figi_to_name.json'
+    legacy.write_text(json.dumps({'FIGI1': 'Старый'}), encoding='utf-8')
+    instruments = FakeInstruments({'FIGI2': 'Сишка', 'FIGI3': 'Брент'})
+    client = SimpleNamespace(instruments=instruments)
+    names = InstrumentNames(path=str(tmp_path / 'names.jsonl'), legacy_path=str(legacy))
+
+    results = await asyncio.gather(names.resolve(client, ['FIGI1', 'FIGI2', 'FIGI3']),
+                                   names.name(client, 'FIGI2'),
+                                   names.name(client, 'FIGI3'),
+                                   names.name(client, 'UNKNOWN'))
+    assert results[0] == {'FIGI1': 'Старый', 'FIGI2': 'Сишка', 'FIGI3': 'Брент'}
+    assert results[1:] == ['Сишка', 'Брент', 'UNKNOWN']
+    assert sorted(instruments.calls) == ['FIGI2', 'FIGI3', 'UNKNOWN']
+
+    # Легаси-файл не перезаписывается, новые названия дописаны в jsonl.
+    assert json.loads(legacy.read_text(encoding='utf-8')) == {'FIGI1': 'Старый'}
+    restored = InstrumentNames(path=str(tmp_path / 'names.jsonl'), legacy_path=str(legacy))
+    assert restored.get('FIGI2') == 'Сишка'
+    assert restored.get('FIGI1') == 'Старый'
+    assert restored.get('UNKNOWN') == 'UNKNOWN'
+
+
+def test_load_skips_truncated_line(tmp_path):
+    path = tmp_path / 'names.jsonl'
+    path.write_text('{"figi": "FIGI1", "name": "Сишка"}\n{"figi": "FIG', encoding='utf-8')
+    names = InstrumentNames(path=str(path), legacy_path=None)
+    assert names.get('FIGI1') == 'Сишка'
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,51 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from trad.margin_cache import MOSCOW, MarginCache, last_clearing
+
+
+class FakeInstruments:
+    def __init__(self):
+        self.calls = []
+
+    async def get_futures_margin(self, instrument_id):
+        self.calls.append(instrument_id)
+        await asyncio.sleep(0.01)
+        return SimpleNamespace(min_price_increment=1, min_price_increment_amount=len(self.calls))
+
+
+def test_last_clearing():
+    assert last_clearing(datetime.datetime(2024, 3, 5, 15, 0, tzinfo=MOSCOW)) == \
+           datetime.datetime(2024, 3, 5, 14, 5, tzinfo=MOSCOW)
+    assert last_clearing(datetime.datetime(2024, 3, 5, 10, 0, tzinfo=MOSCOW)) == \
+           datetime.datetime(2024, 3, 4, 19, 5, tzinfo=MOSCOW)
+
+
+@pytest.mark.asyncio
+async def test_cache_dedups_and_invalidates():
+    instruments = FakeInstruments()
+    client = SimpleNamespace(instruments=instruments)
+    cache = MarginCache()
+
+    first, second = await asyncio.gather(cache.get(client, 'uid'), cache.get(client, 'uid'))
+    assert first is second
+    assert instruments.calls == ['uid']
+    assert (await cache.get(client, 'uid')) is first
+    assert cache.hits == 1
+
+    # Запись, полученная до клиринга, недействительна.
+    fetched_at, response = cache.entries['uid']
+    cache.entries['uid'] = (fetched_at - datetime.timedelta(days=1), response)
+    assert cache.cached('uid') is None
+
+    assert await cache.prefetch(client, ['uid', 'uid2']) == 2
+    cache.invalidate('uid2')
+    assert cache.cached('uid2') is None
+    assert cache.cached('uid') is not None
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from trad.market_actors import ActorDispatcher
+
+
+@pytest.mark.asyncio
+async def test_actor_conflates_prices_while_busy():
+    processed = []
+    release = asyncio.Event()
+
+    async def handler(value):
+        processed.append(value)
+        if value[0] == 'slow':
+            await release.wait()
+
+    dispatcher = ActorDispatcher(handler)
+    dispatcher.dispatch('slow', ('slow', 0))
+    await asyncio.sleep(0)
+    assert dispatcher.actor('slow').busy
+
+    # Пока медленный инструмент занят, его цены заменяют друг друга, а другой инструмент обрабатывается сразу.
+    for i in range(1, 6):
+        dispatcher.dispatch('slow', ('slow', i))
+        dispatcher.dispatch('fast', ('fast', i))
+        await asyncio.sleep(0)
+    assert [value for value in processed if value[0] == 'fast'] == [('fast', i) for i in range(1, 6)]
+    assert dispatcher.actor('slow').queue_depth == 1
+
+    release.set()
+    await asyncio.sleep(0.01)
+    assert [value for value in processed if value[0] == 'slow'] == [('slow', 0), ('slow', 5)]
+
+    metrics = dispatcher.metrics()
+    assert metrics['slow']['received'] == 6
+    assert metrics['slow']['processed'] == 2
+    assert metrics['slow']['conflated'] == 4
+    assert metrics['fast']['conflated'] == 0
+    await dispatcher.stop()
+
+
+@pytest.mark.asyncio
+async def test_actor_survives_handler_error():
+    processed = []
+
+    async def handler(value):
+        if value == 1:
+            raise ValueError('ошибка')
+        processed.append(value)
+
+    dispatcher = ActorDispatcher(handler)
+    dispatcher.dispatch('figi', 1)
+    await asyncio.sleep(0)
+    dispatcher.dispatch('figi', 2)
+    await asyncio.sleep(0.01)
+    assert processed == [2]
+    assert dispatcher.metrics()['figi']['errors'] == 1
+    await dispatcher.stop()
+
+
+@pytest.mark.asyncio
+async def test_replay_is_processed_in_order_before_live_price():
+    processed = []
+    release = asyncio.Event()
+
+    async def handler(value):
+        processed.append(value)
+        if value == 'live-0':
+            await release.wait()
+
+    dispatcher = ActorDispatcher(handler)
+    dispatcher.dispatch('figi', 'live-0')
+    await asyncio.sleep(0)
+    # Пока актор занят, приходят живая цена и догрузка разрыва: догрузка не схлопывается и идёт первой.
+    dispatcher.dispatch('figi', 'live-1')
+    dispatcher.replay('figi', ['high', 'low', 'last'])
+    assert dispatcher.actor('figi').queue_depth == 4
+    release.set()
+    await asyncio.sleep(0.01)
+    assert processed == ['live-0', 'high', 'low', 'last', 'live-1']
+    await dispatcher.stop()
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import socket
+
+import pytest
+
+from trad.metrics import Metrics, MetricsServer
+
+
+@pytest.mark.asyncio
+async def test_timed_coroutine_and_counters():
+    registry = Metrics()
+
+    @registry.timed()
+    async def handler(delay):
+        await asyncio.sleep(delay)
+        return delay
+
+    assert await handler(0.01) == 0.01
+    assert await handler(0) == 0
+    registry.inc('stream_messages', 'last_price')
+    registry.inc('stream_messages', 'last_price')
+    registry.inc('stream_messages', 'candle')
+
+    timer = registry.timers['handler']
+    assert timer.count == 2
+    assert timer.percentile(0.99) >= 0.01
+    assert registry.counters['stream_messages'] == {'last_price': 2, 'candle': 1}
+
+
+def test_render_prometheus_text():
+    registry = Metrics()
+    registry.observe('post_order', 0.002)
+    registry.inc('stream_messages', 'candle')
+    registry.add_source('actors', lambda: {'FUT1': {'queue_depth': 3, 'busy': 1}})
+    registry.add_source('loop_lag', lambda: {'p99': 0.004, 'label': 'skip'})
+    registry.add_source('broken', lambda: 1 / 0)
+
+    text = registry.render()
+    assert '# TYPE gas_post_order_seconds summary' in text
+    assert 'gas_post_order_seconds{quantile="0.99"} 0.002000000' in text
+    assert 'gas_post_order_seconds_count 1' in text
+    assert 'gas_stream_messages_total{type="candle"} 1' in text
+    assert 'gas_actors_queue_depth{name="FUT1"} 3' in text
+    assert 'gas_loop_lag_p99 0.004' in text
+    assert 'label' not in text
+    assert 'post_order' in registry.summary()
+
+
+@pytest.mark.asyncio
+async def test_metrics_server():
+    registry = Metrics()
+    registry.inc('stream_messages', 'candle')
+    assert await MetricsServer(registry, port=0).start() is None
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = MetricsServer(registry, host='127.0.0.1', port=port)
+    await server.start()
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    assert 'gas_stream_messages_total{type="candle"} 1' in await get('/metrics')
+    assert (await get('/other')).startswith('HTTP/1.1 404')
+    await server.stop()
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from bot.notifier import Notifier, TokenBucket, batch_texts, split_text
+
+
+class FakeBot:
+    def __init__(self, retry_after: int = 0):
+        self.sent = []
+        self.retry_after = retry_after
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            raise TelegramRetryAfter(method=None, message='Flood control', retry_after=retry_after)
+        self.sent.append((chat_id, text, kwargs))
+
+
+def test_split_text_by_lines():
+    text = '\n'.join('строка %d' % i for i in range(2000))
+    parts = split_text(text)
+    assert all(len(part) <= 4096 for part in parts)
+    assert '\n'.join(parts) == text
+    assert split_text('x' * 5000) == ['x' * 4096, 'x' * 904]
+
+
+def test_token_bucket_delay():
+    now = [0.0]
+    bucket = TokenBucket(rate=1, capacity=2, clock=lambda: now[0])
+    bucket.tokens -= 2
+    assert bucket.delay() == pytest.approx(1)
+    now[0] = 0.5
+    assert bucket.delay() == pytest.approx(0.5)
+
+
+@pytest.mark.asyncio
+async def test_notifier_batches_per_chat_and_retries():
+    bot = FakeBot(retry_after=0)
+    notifier = Notifier(bot, batch_window=0.01)
+    notifier.start()
+    for i in range(5):
+        await notifier.send_message(chat_id=1, text=f'статус {i}')
+    await notifier.send_message(chat_id=2, text='другой чат')
+    await notifier.send_message(chat_id=1, text='<b>html</b>', parse_mode='HTML')
+    await asyncio.sleep(0.1)
+    await notifier.stop()
+
+    assert (1, '\n\n'.join(f'статус {i}' for i in range(5)), {}) in bot.sent
+    assert (2, 'другой чат', {}) in bot.sent
+    assert (1, '<b>html</b>', {'parse_mode': 'HTML'}) in bot.sent
+    assert len(bot.sent) == 3
+
+    bot = FakeBot(retry_after=1)
+    notifier = Notifier(bot, batch_window=0)
+    await notifier.send_message(chat_id=1, text='после 429')
+    assert await notifier.flush() == 1
+    assert bot.sent == [(1, 'после 429', {})]
+
+
+def test_batches_keep_whole_messages():
+    texts = ['a' * 3500, '<b>' + 'b' * 1000 + '</b>', 'c' * 90, 'd' * 5000]
+    batches = batch_texts(texts)
+    assert batches == [['a' * 3500], ['<b>' + 'b' * 1000 + '</b>', 'c' * 90], ['d' * 5000]]
+    assert all(len('\n\n'.join(batch)) <= 4096 for batch in batches[:-1])
+
+
+class BadMarkupBot(FakeBot):
+    async def send_message(self, chat_id, text, **kwargs):
+        if '<b>битое' in text:
+            raise TelegramBadRequest(method=None, message="Bad Request: can't parse entities")
+        await super().send_message(chat_id, text, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_bad_markup_does_not_drop_batch():
+    bot = BadMarkupBot()
+    notifier = Notifier(bot, batch_window=0, chat_rate=100, chat_burst=100, global_rate=100)
+    for text in ['<b>первое</b>', '<b>битое', '<i>третье</i>']:
+        await notifier.send_message(chat_id=1, text=text, parse_mode='HTML')
+    assert await notifier.flush() == 2
+    assert [text for _, text, _ in bot.sent] == ['<b>первое</b>', '<i>третье</i>']
+
+
+class BlockingBot(FakeBot):
+    def __init__(self):
+        super().__init__()
+        self.blocked = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if not self.sent and not self.release.is_set():
+            self.blocked.set()
+            await self.release.wait()
+        await super().send_message(chat_id, text, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_stop_during_send_keeps_batch():
+    bot = BlockingBot()
+    notifier = Notifier(bot, batch_window=0, chat_rate=100, chat_burst=100, global_rate=100)
+    notifier.start()
+    await notifier.send_message(chat_id=1, text='первый')
+    await notifier.send_message(chat_id=2, text='второй')
+    await asyncio.wait_for(bot.blocked.wait(), 1)
+
+    stop = asyncio.create_task(notifier.stop())
+    await asyncio.sleep(0.01)
+    bot.release.set()
+    await asyncio.wait_for(stop, 1)
+    assert sorted(chat_id for chat_id, _, _ in bot.sent) == [1, 2]
+
+
+if __name__ == '__main__':
+    pytest.main()
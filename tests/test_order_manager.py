@@ -0,0 +1,120 @@
+import asyncio
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+import tinkoff.invest as ti
+
+from trad.order_manager import OrderManager, OrderStatus
+from trad.order_tracker import OrderTracker
+from trad import task_all_time
+
+PARTIAL = ti.OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL
+NEW = ti.OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW
+FILL = ti.OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL
+CANCELLED = ti.OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED
+
+
+def make_connect(states):
+    orders = SimpleNamespace(
+        get_orders=AsyncMock(side_effect=lambda account_id: ti.GetOrdersResponse(
+            orders=[state for state in states.values() if state.execution_report_status == NEW])),
+        get_order_state=AsyncMock(side_effect=lambda account_id, order_id: states[order_id]),
+        cancel_order=AsyncMock(side_effect=lambda account_id, order_id: states.__setitem__(
+            order_id, ti.OrderState(order_id=order_id, execution_report_status=CANCELLED))),
+    )
+    return SimpleNamespace(client=SimpleNamespace(orders=orders), order_tracker=OrderTracker())
+
+
+@pytest.mark.asyncio
+async def test_one_reconcile_call_for_many_orders():
+    states = {str(i): ti.OrderState(order_id=str(i), execution_report_status=NEW, lots_requested=1)
+              for i in range(15)}
+    connect = make_connect(states)
+    manager = OrderManager(connect, 'account', tick=0.01, reconcile_interval=0.05)
+    orders = [await manager.submit(order_id, ti.PostOrderResponse(order_id=order_id, execution_report_status=NEW),
+                                   timeout=10)
+              for order_id in states]
+
+    for order_id in states:
+        states[order_id] = ti.OrderState(order_id=order_id, execution_report_status=FILL, lots_executed=1)
+    done = await asyncio.wait_for(asyncio.gather(*(order.done for order in orders)), 1)
+    assert all(order.status == OrderStatus.FILLED for order in done)
+    assert connect.client.orders.get_orders.await_count == 1
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_unfilled_order_expires_by_timer():
+    states = {'1': ti.OrderState(order_id='1', execution_report_status=NEW)}
+    connect = make_connect(states)
+    manager = OrderManager(connect, 'account', tick=0.01, reconcile_interval=100)
+    order = await manager.submit('1', ti.PostOrderResponse(order_id='1', execution_report_status=NEW), timeout=0.03)
+    await asyncio.wait_for(order.done, 1)
+    assert order.status == OrderStatus.EXPIRED
+    connect.client.orders.cancel_order.assert_awaited_once()
+    await manager.stop()
+
+
+
+@pytest.mark.asyncio
+async def test_expired_order_filled_while_cancelling():
+    states = {'1': ti.OrderState(order_id='1', execution_report_status=NEW, lots_requested=2)}
+    connect = make_connect(states)
+    connect.client.orders.cancel_order = AsyncMock(side_effect=Exception('order is filled'))
+    manager = OrderManager(connect, 'account', tick=0.01, reconcile_interval=100)
+    order = await manager.submit('1', ti.PostOrderResponse(order_id='1', execution_report_status=NEW), timeout=0.03)
+    states['1'] = ti.OrderState(order_id='1', execution_report_status=FILL, lots_requested=2, lots_executed=2)
+    await asyncio.wait_for(order.done, 1)
+    assert order.status == OrderStatus.FILLED
+    assert order.lots_executed == 2
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_reprice_sizes_replacement_from_fresh_state(monkeypatch):
+    tick = ti.Quotation(units=0, nano=10_000_000)
+    price = ti.MoneyValue(currency='rub', units=100, nano=0)
+    states = {'1': ti.OrderState(order_id='1', execution_report_status=PARTIAL, lots_requested=3, lots_executed=2,
+                                 initial_security_price=price, direction=ti.OrderDirection.ORDER_DIRECTION_BUY)}
+    connect = make_connect(states)
+    connect.client.orders.replace_order = AsyncMock(return_value=ti.PostOrderResponse(
+        order_id='2', execution_report_status=NEW))
+    manager = connect.order_manager = OrderManager(connect, 'account', tick=0.01, reconcile_interval=100)
+    context = SimpleNamespace(history_instrument=SimpleNamespace(
+        atr=Decimal(2), instrument_info=SimpleNamespace(figi='FUT', lot=1, min_price_increment=tick,
+                                                        min_price_increment_amount=tick)))
+    # Снимок на момент выставления: исполнений ещё нет.
+    order = await manager.submit('1', ti.PostOrderResponse(
+        order_id='1', execution_report_status=NEW, lots_requested=3, lots_executed=0,
+        initial_security_price=price, direction=ti.OrderDirection.ORDER_DIRECTION_BUY), timeout=10)
+    monkeypatch.setitem(task_all_time.dict_last_price, 'FUT', ti.Quotation(units=105, nano=0))
+
+    new_order = await task_all_time.reprice_order(connect, context, order, Decimal(100), Decimal('0.01'))
+    assert new_order.order_id == '2'
+    request = connect.client.orders.replace_order.await_args.args[0]
+    assert request.quantity == 1
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_order_after_idle_gap_is_not_expired_at_once():
+    now = [0.0]
+    states = {'1': ti.OrderState(order_id='1', execution_report_status=NEW)}
+    connect = make_connect(states)
+    manager = OrderManager(connect, 'account', tick=1.0, reconcile_interval=100, clock=lambda: now[0])
+    # Пять часов без открытых заявок: цикл ждал пробуждения и колесо не продвигалось.
+    now[0] = 5 * 3600.0
+    order = await manager.submit('1', ti.PostOrderResponse(order_id='1', execution_report_status=NEW), timeout=30)
+    await manager.stop()
+    await manager.step()
+    assert order.status == OrderStatus.NEW
+    connect.client.orders.cancel_order.assert_not_awaited()
+    now[0] += 30
+    await manager.step()
+    assert order.status == OrderStatus.EXPIRED
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,90 @@
+import pytest
+import tinkoff.invest as ti
+
+from trad.order_tracker import OrderTracker
+
+NEW = ti.OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW
+FILL = ti.OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL
+CANCELLED = ti.OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED
+
+
+def trades(order_id: str, *fills: tuple[str, int]) -> ti.OrderTrades:
+    return ti.OrderTrades(order_id=order_id,
+                          trades=[ti.OrderTrade(trade_id=trade_id, quantity=quantity) for trade_id, quantity in fills])
+
+
+def test_register_before_and_after_fills():
+    tracker = OrderTracker()
+    events = []
+    tracker.listener = events.append
+
+    order = tracker.register('1', quantity=2)
+    tracker.on_order_trades(trades('1', ('t1', 1)))
+    assert not order.filled
+    tracker.on_order_trades(trades('1', ('t2', 1)))
+    assert order.filled and order.done
+
+    # Исполнение пришло раньше ответа на post_order: слушатель узнаёт о нём при регистрации.
+    tracker.on_order_trades(trades('2', ('t3', 3)))
+    assert events == ['1', '1']
+    early = tracker.register('2', quantity=3)
+    assert early.executed == 3 and early.filled
+    assert events == ['1', '1', '2']
+
+
+def test_duplicate_trades_are_counted_once():
+    tracker = OrderTracker()
+    order = tracker.register('1', quantity=5)
+    tracker.on_order_trades(trades('1', ('t1', 2), ('t2', 1)))
+    tracker.on_order_trades(trades('1', ('t1', 2), ('t3', 1)))
+    assert order.executed == 4
+    assert order.trade_ids == {'t1', 't2', 't3'}
+
+
+def test_order_state_sets_final_status():
+    tracker = OrderTracker()
+    events = []
+    tracker.listener = events.append
+    order = tracker.register('1', quantity=2)
+
+    tracker.on_order_state(ti.OrderState(order_id='1', execution_report_status=NEW, lots_executed=0))
+    tracker.on_order_state(ti.OrderState(order_id='1', execution_report_status=NEW, lots_executed=0))
+    assert events == ['1']
+    tracker.on_order_state(ti.OrderState(order_id='1', execution_report_status=CANCELLED, lots_executed=0),
+                           notify=False)
+    assert events == ['1']
+    assert order.done and not order.filled
+    # Состояние незарегистрированной заявки не сохраняется.
+    tracker.on_order_state(ti.OrderState(order_id='9', execution_report_status=FILL))
+    assert tracker.get('9') is None
+
+
+def test_trim_keeps_registered_orders():
+    tracker = OrderTracker(max_unknown=2)
+    tracker.register('registered', quantity=1)
+    for i in range(5):
+        tracker.on_order_trades(trades(f'unknown-{i}', (f't{i}', 1)))
+    assert tracker.get('registered') is not None
+    assert [order_id for order_id in ('unknown-0', 'unknown-1', 'unknown-2', 'unknown-3', 'unknown-4')
+            if tracker.get(order_id) is not None] == ['unknown-3', 'unknown-4']
+
+    tracker.discard('registered')
+    assert tracker.get('registered') is None
+
+
+def test_listener_only_hears_registered_orders():
+    tracker = OrderTracker()
+    events = []
+    tracker.listener = events.append
+    tracker.on_order_trades(trades('unknown', ('t1', 1)))
+    tracker.register('1', quantity=1)
+    tracker.on_order_trades(trades('1', ('t2', 1)))
+    assert events == ['1']
+
+    tracker.discard('1')
+    tracker.on_order_trades(trades('1', ('t3', 1)))
+    assert events == ['1']
+
+
+if __name__ == '__main__':
+    pytest.main()
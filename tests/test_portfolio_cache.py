@@ -0,0 +1,66 @@
+import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+import tinkoff.invest as ti
+
+from trad.portfolio_cache import PortfolioCache
+
+START = datetime.datetime(2024, 1, 1, 10, tzinfo=datetime.timezone.utc)
+
+
+def rub(units):
+    return ti.MoneyValue(currency='rub', units=units, nano=0)
+
+
+def portfolio(total, **quantities):
+    return ti.PortfolioResponse(total_amount_portfolio=rub(total),
+                                positions=[ti.PortfolioPosition(figi=figi, quantity=ti.Quotation(units=units, nano=0))
+                                           for figi, units in quantities.items()])
+
+
+def test_stream_events_update_cache():
+    now = [START]
+    cache = PortfolioCache(clock=lambda: now[0])
+    assert cache.total_amount is None and cache.age() is None
+
+    cache.on_stream(ti.PortfolioStreamResponse(portfolio=portfolio(100_000, FUT1=2, FUT2=1)))
+    assert cache.total_amount == Decimal(100_000)
+    assert cache.quantity('FUT1') == 2
+    assert cache.position('FUT2').figi == 'FUT2'
+
+    now[0] = START + datetime.timedelta(seconds=30)
+    cache.on_stream(ti.PositionsStreamResponse(position=ti.PositionData(
+        futures=[ti.PositionsFutures(figi='FUT1', blocked=1, balance=1)],
+        money=[ti.PositionsMoney(available_value=rub(60_000), blocked_value=rub(40_000))])))
+    assert cache.blocked('FUT1') == 1
+    assert cache.blocked_margin == Decimal(40_000)
+    assert cache.age() == 30
+
+    cache.on_stream(ti.PortfolioStreamResponse(portfolio=portfolio(99_000, FUT1=2)))
+    assert cache.quantity('FUT2') == 0
+    assert cache.position('FUT2') is None
+    assert cache.age() == 0
+    cache.on_stream(ti.PortfolioStreamResponse(ping=ti.Ping(time=START)))
+    assert cache.total_amount == Decimal(99_000)
+
+
+@pytest.mark.asyncio
+async def test_refresh_seeds_from_api():
+    cache = PortfolioCache()
+    operations = SimpleNamespace(
+        get_portfolio=AsyncMock(return_value=portfolio(50_000, FUT1=1)),
+        get_positions=AsyncMock(return_value=ti.PositionsResponse(
+            money=[rub(30_000)], blocked=[rub(20_000)],
+            futures=[ti.PositionsFutures(figi='FUT1', blocked=0, balance=1)])))
+    await cache.refresh(SimpleNamespace(operations=operations), 'account')
+    assert cache.total_amount == Decimal(50_000)
+    assert cache.available_money == Decimal(30_000)
+    assert cache.blocked_margin == Decimal(20_000)
+    assert cache.positions['FUT1'].balance == 1
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,27 @@
+import pytest
+
+from benchmarks.replay_stream import replay_stream, synthetic_instrument, synthetic_stream
+
+
+def test_synthetic_stream_is_deterministic():
+    instruments = [synthetic_instrument('FUTA'), synthetic_instrument('FUTB')]
+    first = synthetic_stream(instruments, 100, seed=1)
+    second = synthetic_stream(instruments, 100, seed=1)
+    assert [msg.last_price.price for msg in first] == [msg.last_price.price for msg in second]
+    assert {msg.last_price.figi for msg in first} == {'FUTA', 'FUTB'}
+
+
+@pytest.mark.asyncio
+async def test_replay_measures_order_latency():
+    instruments = [synthetic_instrument(f'FUT{i}') for i in range(3)]
+    report = await replay_stream(synthetic_stream(instruments, 3000))
+    assert report.errors == 0
+    assert report.processed + report.conflated == report.prices == 3000
+    # Цена колеблется шире канала: стратегия входит и выходит из позиции много раз.
+    assert report.orders > 10
+    assert report.order_latency['n'] == report.orders
+    assert report.messages_per_second > 0
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,43 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from trad.stream_logging import LazyMessage, StreamLogSampler, log_stream_message, message_type, parse_sampling
+
+
+def test_sampling_per_message_type(caplog):
+    logger = logging.getLogger('test.stream')
+    sampler = StreamLogSampler({'last_price': 10})
+    price = SimpleNamespace(last_price=SimpleNamespace(figi='FIGI'), candle=None)
+    candle = SimpleNamespace(last_price=None, candle=SimpleNamespace(figi='FIGI'))
+    assert message_type(price) == 'last_price'
+    assert message_type(candle) == 'candle'
+
+    with caplog.at_level(logging.INFO, logger='test.stream'):
+        logged = [log_stream_message(price, logger=logger, stream_sampler=sampler) for _ in range(25)]
+        logged_candles = [log_stream_message(candle, logger=logger, stream_sampler=sampler) for _ in range(3)]
+    assert sum(logged) == 3
+    assert all(logged_candles)
+    assert parse_sampling('last_price=5, candle=0')['candle'] == 1
+
+
+def test_formatting_is_lazy(caplog):
+    logger = logging.getLogger('test.stream.lazy')
+    calls = []
+
+    def render(msg):
+        calls.append(msg)
+        return 'сообщение'
+
+    logger.setLevel(logging.WARNING)
+    assert not log_stream_message(SimpleNamespace(ping=True), logger=logger, stream_sampler=StreamLogSampler({}))
+    logger.setLevel(logging.INFO)
+    with caplog.at_level(logging.INFO, logger='test.stream.lazy'):
+        logger.info('%s', LazyMessage(SimpleNamespace(), render))
+    assert len(calls) == 1
+    assert 'сообщение' in caplog.text
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from trad.stream_supervisor import Backoff, StreamSupervisor
+
+
+def test_backoff_grows_to_cap():
+    backoff = Backoff(base=1, factor=2, cap=10, rng=lambda low, high: high)
+    assert [backoff.delay(attempt) for attempt in range(6)] == [1, 2, 4, 8, 10, 10]
+
+
+@pytest.mark.asyncio
+async def test_supervisor_reopens_stream_and_counts_metrics():
+    opened = []
+    received = []
+    reconnected = []
+
+    async def stream(number):
+        yield f'msg-{number}'
+        if number < 2:
+            raise ConnectionError('stream reset')
+        await asyncio.Event().wait()
+
+    def factory():
+        opened.append(len(opened))
+        return stream(opened[-1])
+
+    async def on_reconnect():
+        reconnected.append(len(opened))
+
+    supervisor = StreamSupervisor(Backoff(rng=lambda low, high: 0))
+    task = asyncio.create_task(supervisor.run('market_data', factory, received.append, on_reconnect))
+    await asyncio.sleep(0.01)
+
+    assert received == ['msg-0', 'msg-1', 'msg-2']
+    assert reconnected == [2, 3]
+    metrics = supervisor.metrics()['market_data']
+    assert metrics['connected'] == 1
+    assert metrics['reconnects'] == 2
+    assert metrics['messages'] == 3
+    assert 'stream reset' in metrics['last_error']
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert supervisor.metrics()['market_data']['connected'] == 0
+
+
+if __name__ == '__main__':
+    pytest.main()
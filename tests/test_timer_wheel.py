@@ -0,0 +1,64 @@
+import pytest
+
+from trad.timer_wheel import TimerWheel
+
+
+def test_timers_fire_in_order_and_can_be_cancelled():
+    wheel = TimerWheel(tick=1.0, slots=8, clock=lambda: 0.0)
+    wheel.schedule('a', 3)
+    wheel.schedule('b', 1)
+    wheel.schedule('c', 2)
+    wheel.cancel('c')
+    assert wheel.advance(0.5) == []
+    assert wheel.advance(1.0) == ['b']
+    assert wheel.advance(5.0) == ['a']
+    assert len(wheel) == 0
+
+
+def test_timer_longer_than_one_turn():
+    wheel = TimerWheel(tick=1.0, slots=4, clock=lambda: 0.0)
+    wheel.schedule('long', 10)
+    wheel.schedule('short', 2)
+    assert wheel.advance(9.0) == ['short']
+    assert 'long' in wheel
+    assert wheel.advance(10.0) == ['long']
+
+
+def test_reschedule_replaces_timer():
+    wheel = TimerWheel(tick=1.0, slots=8, clock=lambda: 0.0)
+    wheel.schedule('a', 1)
+    wheel.schedule('a', 5)
+    assert wheel.advance(4.0) == []
+    assert wheel.advance(5.0) == ['a']
+
+
+def test_schedule_after_idle_gap():
+    now = [0.0]
+    wheel = TimerWheel(tick=1.0, slots=8, clock=lambda: now[0])
+    # Пять часов колесо никто не продвигал: новые таймеры отсчитываются от текущего времени.
+    now[0] = 5 * 3600.0
+    wheel.schedule('timeout', 15)
+    wheel.schedule('price', 3)
+    assert wheel.advance() == []
+    now[0] += 3
+    assert wheel.advance() == ['price']
+    now[0] += 11
+    assert wheel.advance() == []
+    now[0] += 1
+    assert wheel.advance() == ['timeout']
+
+
+def test_schedule_on_lagging_wheel_counts_from_now():
+    now = [0.0]
+    wheel = TimerWheel(tick=1.0, slots=8, clock=lambda: now[0])
+    wheel.schedule('old', 100)
+    now[0] = 20.0
+    wheel.schedule('new', 5)
+    now[0] = 24.0
+    assert wheel.advance() == []
+    now[0] = 25.0
+    assert wheel.advance() == ['new']
+
+
+if __name__ == '__main__':
+    pytest.main()
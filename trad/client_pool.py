@@ -0,0 +1,172 @@
+"""
+Пул клиентов API с отдельными каналами для стримов и для унарных запросов.
+Долгие стримы не делят канал с запросами заявок, а замена канала (например, после разрыва стрима)
+не обрывает запросы, которые уже идут: старый канал закрывается только когда с него сняты все аренды
+и прошло время grace для запросов, взятых без аренды.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from typing import TYPE_CHECKING, Any, AsyncContextManager, AsyncIterator, Callable, Optional
+
+if TYPE_CHECKING:
+    from tinkoff.invest.async_services import AsyncServices
+
+logger = logging.getLogger(__name__)
+
+UNARY = 'unary'
+STREAM = 'stream'
+KINDS = (UNARY, STREAM)
+
+
+class PooledChannel:
+    """
+    Открытый клиент API и счётчик его аренд.
+    """
+
+    def __init__(self, kind: str, services: 'AsyncServices', manager: Optional[AsyncContextManager] = None) -> None:
+        """
+        :param kind: Назначение канала: unary или stream.
+        :param services: Сервисы открытого клиента.
+        :param manager: Контекстный менеджер клиента, через который канал закрывается.
+        """
+        self.kind = kind
+        self.services = services
+        self.manager = manager
+        self.leases = 0
+        self.retired = False
+        self.closed = False
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def acquire(self) -> None:
+        self.leases += 1
+        self.idle.clear()
+
+    def release(self) -> None:
+        self.leases -= 1
+        if self.leases == 0:
+            self.idle.set()
+
+    async def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.manager is not None:
+            try:
+                await self.manager.__aexit__(None, None, None)
+            except Exception as e:
+                logger.error(f'Ошибка закрытия канала {self.kind}: {e}')
+
+
+class ClientPool:
+    """
+    Текущие каналы по назначению, аренда канала на время запроса и безопасная замена канала.
+    """
+
+    def __init__(self, token: Optional[str] = None,
+                 factory: Optional[Callable[[], AsyncContextManager]] = None,
+                 grace: float = 30.0) -> None:
+        """
+        :param token: Токен API.
+        :param factory: Создание клиента (по умолчанию AsyncClient(token)).
+        :param grace: Сколько секунд старый канал остаётся открытым после замены для запросов без аренды.
+        """
+        self.token = token
+        self.factory = factory
+        self.grace = grace
+        self.channels: dict[str, PooledChannel] = {}
+        self.retired: set[PooledChannel] = set()
+        self.swaps = {kind: 0 for kind in KINDS}
+        self._closers: set[asyncio.Task] = set()
+
+    @classmethod
+    def from_services(cls, services: 'AsyncServices') -> 'ClientPool':
+        """
+        Пул поверх готовых сервисов (тесты, симуляция): оба назначения используют один клиент.
+        """
+        pool = cls()
+        channel = PooledChannel(UNARY, services)
+        pool.channels = {kind: channel for kind in KINDS}
+        return pool
+
+    async def _open_channel(self, kind: str) -> PooledChannel:
+        if self.factory is not None:
+            manager = self.factory()
+        else:
+            from tinkoff.invest import AsyncClient
+            manager = AsyncClient(self.token)
+        services = await manager.__aenter__()
+        logger.info(f'Открыт канал API {kind}')
+        return PooledChannel(kind, services, manager)
+
+    async def open(self) -> None:
+        for kind in KINDS:
+            if kind not in self.channels:
+                self.channels[kind] = await self._open_channel(kind)
+
+    def services(self, kind: str = UNARY) -> Optional['AsyncServices']:
+        channel = self.channels.get(kind)
+        return channel.services if channel is not None else None
+
+    @property
+    def unary(self) -> Optional['AsyncServices']:
+        return self.services(UNARY)
+
+    @property
+    def stream(self) -> Optional['AsyncServices']:
+        return self.services(STREAM)
+
+    @contextlib.asynccontextmanager
+    async def lease(self, kind: str = UNARY) -> AsyncIterator['AsyncServices']:
+        """
+        Арендует текущий канал: пока аренда не снята, канал не закроется даже после замены.
+        """
+        channel = self.channels[kind]
+        channel.acquire()
+        try:
+            yield channel.services
+        finally:
+            channel.release()
+
+    async def swap(self, kind: str) -> 'AsyncServices':
+        """
+        Открывает новый канал вместо текущего. Новые запросы сразу идут в новый канал,
+        старый закрывается после снятия аренд.
+        :return: Сервисы нового канала.
+        """
+        channel = await self._open_channel(kind)
+        old = self.channels.get(kind)
+        self.channels[kind] = channel
+        self.swaps[kind] += 1
+        if old is not None and old not in self.channels.values():
+            self._retire(old)
+        return channel.services
+
+    def _retire(self, channel: PooledChannel) -> None:
+        channel.retired = True
+        self.retired.add(channel)
+        task = asyncio.create_task(self._close_when_idle(channel))
+        self._closers.add(task)
+        task.add_done_callback(self._closers.discard)
+
+    async def _close_when_idle(self, channel: PooledChannel) -> None:
+        await asyncio.sleep(self.grace)
+        await channel.idle.wait()
+        await channel.close()
+        self.retired.discard(channel)
+
+    async def close(self) -> None:
+        for task in list(self._closers):
+            task.cancel()
+        channels = set(self.channels.values()) | self.retired
+        for channel in channels:
+            await channel.close()
+        self.channels.clear()
+        self.retired.clear()
+
+    def metrics(self) -> dict[str, Any]:
+        return {kind: {'leases': channel.leases, 'swaps': self.swaps[kind]}
+                for kind, channel in self.channels.items()} | {'retired': len(self.retired)}
@@ -1,20 +1,32 @@
 import asyncio
+import contextlib
 import datetime
-import json
 import logging
 import os
+import time
+from typing import AsyncContextManager, AsyncIterable, AsyncIterator, Awaitable, Callable
 
-from async_lru import alru_cache
 from tinkoff.invest import (
-    AsyncClient,
     CandleInterval,
-    FuturesResponse,
     Future, HistoricCandle, CandleInstrument,
     SubscriptionInterval, LastPriceInstrument, GetAccountsResponse,
-    PortfolioResponse, FutureResponse, InfoInstrument, InstrumentIdType, InstrumentResponse, Quotation, OrderDirection,
+    PortfolioResponse, FutureResponse, InfoInstrument, Quotation, OrderDirection,
     OrderType, PostOrderResponse)
 from tinkoff.invest.async_services import AsyncServices
 from tinkoff.invest.market_data_stream.async_market_data_stream_manager import AsyncMarketDataStreamManager
+
+from data_create.candle_store import CandleStore, candle_store, records_from_candles, ns_to_datetime, PRICE_SCALE
+from trad.client_pool import ClientPool, STREAM, UNARY
+from trad.executors import run_io
+from trad.instrument_index import InstrumentIndex
+from trad.instrument_names import instrument_names
+from trad.margin_cache import MarginCache
+from trad.metrics import metrics
+from trad.order_manager import OrderManager
+from trad.order_tracker import OrderTracker
+from trad.portfolio_cache import PortfolioCache
+from trad.stream_supervisor import StreamSupervisor
+
 ACCOUNT_ID = os.getenv('ACCOUNT_ID')
 
 logger = logging.getLogger(__name__)
@@ -42,8 +54,42 @@ def string_to_interval(interval: str):
         raise ValueError(f'Введите интервал в формате 1m, 2m, 3m, 5m, 10m, 15m, 30m, 1h, 2h, 4h, 1d, 1w, 1M')
 
 
+def scaled_to_quotation(value: int) -> Quotation:
+    value = int(value)
+    units = abs(value) // PRICE_SCALE * (1 if value >= 0 else -1)
+    return Quotation(units=units, nano=value - units * PRICE_SCALE)
+
+
+def records_to_candles(records) -> list[HistoricCandle]:
+    """
+    Переводит свечи из локального хранилища обратно в HistoricCandle.
+    """
+    return [HistoricCandle(open=scaled_to_quotation(record['open']),
+                           high=scaled_to_quotation(record['high']),
+                           low=scaled_to_quotation(record['low']),
+                           close=scaled_to_quotation(record['close']),
+                           volume=int(record['volume']),
+                           time=ns_to_datetime(record['time']),
+                           is_complete=True)
+            for record in records]
+
+
+def candle_instruments(instruments: list[str], interval: str | None) -> list[CandleInstrument]:
+    """
+    Параметры подписки на свечи. Возможные интервалы стрима - "1m", "5m", иначе SUBSCRIPTION_INTERVAL_UNSPECIFIED.
+    """
+    dict_subscription_interval = {
+        '1m': SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
+        '5m': SubscriptionInterval.SUBSCRIPTION_INTERVAL_FIVE_MINUTES
+    }
+    return [CandleInstrument(
+        instrument_id=instrument_id,
+        interval=dict_subscription_interval.get(interval, SubscriptionInterval.SUBSCRIPTION_INTERVAL_UNSPECIFIED)
+    ) for instrument_id in instruments]
+
+
 class ConnectTinkoff:
-    def __init__(self, token):
+    def __init__(self, token, store: CandleStore = candle_store):
         self.task_orders_stream = None
         self.task_portfolio_stream = None
         self.task_operations_stream = None
@@ -54,49 +100,128 @@ class ConnectTinkoff:
         self.queue_operations: asyncio.Queue | None = None
         self.market_data_stream: AsyncMarketDataStreamManager | None = None
         self.listen: asyncio.Task | None = None
-        self.client: AsyncServices | None = None
-        self._client: AsyncClient | None = None
+        # Отдельные каналы для стримов и унарных запросов, self.client – текущий унарный.
+        self.pool: ClientPool | None = None
+        # Подписки стрима рыночных данных, восстанавливаемые при переподключении.
         self.instruments_stream: list[str] = []
+        self.info_stream: list[str] = []
+        self.candles_stream: dict[str, str | None] = {}
+        self.supervisor: StreamSupervisor = StreamSupervisor()
+        self._market_data_opened = False
+        # Время последнего сообщения стрима рыночных данных и обработчик догрузки пропущенного после разрыва.
+        self.last_market_data_at: float | None = None
+        self.on_market_data_reconnect: Callable[[datetime.datetime], Awaitable[None]] | None = None
+        self.candle_store: CandleStore = store
+        self.order_tracker: OrderTracker = OrderTracker()
+        self.order_manager: OrderManager = OrderManager(self, ACCOUNT_ID)
+        self.instrument_index: InstrumentIndex = InstrumentIndex()
+        self.margin_cache: MarginCache = MarginCache()
+        self.portfolio_cache: PortfolioCache = PortfolioCache()
 
     async def connection(self):
         """
         Создаёт асинхронное соединение и инициализирует менеджер стриминга.
         """
-        self._client = AsyncClient(self.token)
-        self.client = await self._client.__aenter__()
-        self.market_data_stream: AsyncMarketDataStreamManager = self.client.create_market_data_stream()
+        self.pool = ClientPool(self.token)
+        await self.pool.open()
+        self.market_data_stream: AsyncMarketDataStreamManager = self.stream_client.create_market_data_stream()
+        self._market_data_opened = False
         self.queue: asyncio.Queue = asyncio.Queue()
         self.listen: asyncio.Task = asyncio.create_task(self._listen_stream())
         self.task_portfolio_stream: asyncio.Task = asyncio.create_task(self.listening_portfolio_by_id(ACCOUNT_ID))
         self.task_operations_stream: asyncio.Task = asyncio.create_task(self.listening_operations_by_id(ACCOUNT_ID))
         self.task_orders_stream: asyncio.Task = asyncio.create_task(self.listening_orders(ACCOUNT_ID))
+        self.instrument_index.start(lambda: self.client)
+
+    @property
+    def client(self) -> AsyncServices | None:
+        """
+        Клиент для унарных запросов. После замены канала возвращает новый клиент.
+        """
+        return self.pool.unary if self.pool is not None else None
+
+    @client.setter
+    def client(self, services: AsyncServices | None) -> None:
+        # Готовые сервисы (тесты, симуляция) используются для всех каналов.
+        self.pool = ClientPool.from_services(services) if services is not None else None
+
+    def lease(self) -> AsyncContextManager[AsyncServices | None]:
+        """
+        Аренда унарного канала на время долгой работы с заявкой: замена канала не оборвёт её запросы.
+        """
+        if self.pool is None:
+            return contextlib.nullcontext(self.client)
+        return self.pool.lease(UNARY)
+
+    @property
+    def stream_client(self) -> AsyncServices | None:
+        return self.pool.stream if self.pool is not None else None
+
+    async def _leased(self, open_stream: Callable[[AsyncServices], AsyncIterable]) -> AsyncIterator:
+        """
+        Читает стрим, удерживая аренду стримового канала, чтобы замена канала не закрыла его под стримом.
+        """
+        async with self.pool.lease(STREAM) as client:
+            async for msg in open_stream(client):
+                yield msg
 
     async def _listen_stream(self) -> None:
         """
-        Слушает сообщения из стриминга.
+        Слушает сообщения из стриминга. Переподключение выполняет StreamSupervisor.
         """
 
         if self.market_data_stream is None:
             return
-        while True:
-            try:
-                async for msg in self.market_data_stream:
-                    logger.info('Получение сообщений основного стрима.')
-                    await self.queue.put(msg)
-            except Exception as e:
-                logger.error(f'Ошибка при получении сообщения: {e}')
-                self.market_data_stream.stop()
-                await self._client.__aexit__(None, None, None)
-                logger.info('Ждем 5 секунд')
-                await asyncio.sleep(5)
-                logger.info(f'Создание нового AsyncClient')
-                self._client = AsyncClient(self.token)
-                self.client = await self._client.__aenter__()
-                logger.info(f'Создание нового стрима после ошибки')
-                self.market_data_stream = self.client.create_market_data_stream()
-                logger.info(f'Возобновляем подписки')
-                if self.instruments_stream:
-                    await self.add_subscribe_last_price(self.instruments_stream)
+        await self.supervisor.run('market_data', self._open_market_data_stream, self._put_market_data,
+                                  on_reconnect=self._catch_up_market_data)
+
+    def _put_market_data(self, msg) -> Awaitable[None]:
+        self.last_market_data_at = time.time()
+        return self.queue.put(msg)
+
+    async def _catch_up_market_data(self) -> None:
+        """
+        После переподключения передаёт обработчику начало разрыва, чтобы догрузить пропущенные цены.
+        """
+        if self.on_market_data_reconnect is None or self.last_market_data_at is None:
+            return
+        since = datetime.datetime.fromtimestamp(self.last_market_data_at, datetime.timezone.utc)
+        try:
+            await self.on_market_data_reconnect(since)
+        except Exception as e:
+            logger.exception(f'Ошибка догрузки цен после переподключения: {e}')
+
+    async def _open_market_data_stream(self) -> AsyncIterator:
+        """
+        Первый раз возвращает созданный в connection стрим. При переподключении заменяет стримовый канал,
+        создаёт на нём новый стрим и восстанавливает все подписки. Унарный канал, через который идут заявки,
+        при этом не меняется.
+        """
+        if self._market_data_opened:
+            self.market_data_stream.stop()
+            await self.pool.swap(STREAM)
+            self.market_data_stream = self.stream_client.create_market_data_stream()
+            self.restore_subscriptions()
+        self._market_data_opened = True
+        return self._leased(lambda client: self.market_data_stream)
+
+    def restore_subscriptions(self) -> None:
+        """
+        Повторяет на текущем стриме все подписки: последние цены, статусы и свечи.
+        """
+        logger.info(f'Возобновляем подписки: цены {len(self.instruments_stream)}, статусы {len(self.info_stream)}, '
+                    f'свечи {len(self.candles_stream)}')
+        if self.instruments_stream:
+            self.market_data_stream.last_price.subscribe(
+                instruments=[LastPriceInstrument(instrument_id=uid) for uid in self.instruments_stream])
+        if self.info_stream:
+            self.market_data_stream.info.subscribe(
+                instruments=[InfoInstrument(instrument_id=uid) for uid in self.info_stream])
+        intervals: dict[str | None, list[str]] = {}
+        for uid, interval in self.candles_stream.items():
+            intervals.setdefault(interval, []).append(uid)
+        for interval, uids in intervals.items():
+            self.market_data_stream.candles.subscribe(instruments=candle_instruments(uids, interval))
 
     async def get_candles_from_ticker(self, ticker: str, interval: str) -> tuple[list[HistoricCandle], Future]:
         """
@@ -106,49 +231,72 @@ class ConnectTinkoff:
         :return: list[HistoricCandle], Future - Список свечей и параметры фьючерса.
         """
 
-        all_futures: FuturesResponse = await self.client.instruments.futures()
-        instrument: Future = [x for x in all_futures.instruments if x.ticker == ticker][0]
-        response: list[HistoricCandle] = []
+        instrument: Future = await self.instrument_index.find_by_ticker(self.client, ticker)
         now = datetime.datetime.now(datetime.timezone.utc)
-        async for candle in self.client.get_all_candles(
-                instrument_id=instrument.uid,
-                to=now + datetime.timedelta(days=1),
-                from_=now - datetime.timedelta(days=365),
-                interval=string_to_interval(interval)
-        ):
-            response.append(candle)
+        response = await self.sync_candles(uid=instrument.uid,
+                                           interval=interval,
+                                           from_=now - datetime.timedelta(days=365),
+                                           to=now + datetime.timedelta(days=1))
         return response, instrument
 
     async def get_candles_from_uid(self, uid: str, interval: str | None = None) -> tuple[list[HistoricCandle], Future]:
-        instrument: FutureResponse = await self.client.instruments.future_by(id=uid, id_type=3)
+        # Параметры (в том числе ГО) запрашиваются заново: они меняются после клиринга.
+        response: FutureResponse = await self.client.instruments.future_by(id=uid, id_type=3)
+        instrument: Future = response.instrument
+        self.instrument_index.put(instrument)
         now = datetime.datetime.now(datetime.timezone.utc)
-        response: list[HistoricCandle] = []
         if interval is None:
             interval = '1m'
-        async for candle in self.client.get_all_candles(
-                instrument_id=instrument.instrument.uid,
-                to=now - datetime.timedelta(days=1),
-                from_=now - datetime.timedelta(days=365),
-                interval=string_to_interval(interval)
-        ):
-            response.append(candle)
-        return response, instrument.instrument
-
-    @alru_cache
+        response = await self.sync_candles(uid=instrument.uid,
+                                           interval=interval,
+                                           from_=now - datetime.timedelta(days=365),
+                                           to=now - datetime.timedelta(days=1))
+        return response, instrument
+
+    async def sync_candles(self, uid: str, interval: str,
+                           from_: datetime.datetime, to: datetime.datetime) -> list[HistoricCandle]:
+        """
+        Дозагружает в локальное хранилище свечи, которых в нём нет, и возвращает свечи за период.
+        С API запрашивается только диапазон от последней сохранённой свечи (она могла быть незакрытой).
+        :param uid: uid инструмента.
+        :param interval: Интервал свечи в формате ('1m', '5m', '15m', '30m', '1h', '2h', '4h', '1d', '1w', '1M').
+        :param from_: Начало периода.
+        :param to: Конец периода.
+        :return: Список свечей за период.
+        """
+        store = self.candle_store
+        last_time = await run_io(store.last_time, uid, interval)
+        start = max(from_, last_time) if last_time else from_
+        # Файл загружается через memory map только когда слияния не будет: на Windows файл,
+        # открытый через memory map, нельзя заменить при записи.
+        if start < to:
+            fetched: list[HistoricCandle] = []
+            async for candle in self.client.get_all_candles(
+                    instrument_id=uid,
+                    to=to,
+                    from_=start,
+                    interval=string_to_interval(interval)
+            ):
+                fetched.append(candle)
+            logger.info(f'Загружено {len(fetched)} свечей {uid} {interval} с {start:%Y-%m-%d %H:%M}')
+            records = await run_io(lambda: store.window(store.merge(uid, interval, records_from_candles(fetched)),
+                                                        from_, to))
+        else:
+            # Окно копируется в пуле: страницы файла читаются не в цикле событий, и memory map не удерживается.
+            records = await run_io(lambda: store.window(store.load(uid, interval), from_, to).copy())
+        return records_to_candles(records)
+
     async def figi_to_name(self, figi: str) -> str:
-        if self.client:
-            instrument: InstrumentResponse = await self.client.instruments.get_instrument_by(
-                id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI,
-                id=figi
-            )
-            if instrument:
-                with open('figi_to_name.json', 'r') as f:
-                    figi_to_name = json.load(f)
-                if instrument.instrument.figi not in figi_to_name:
-                    figi_to_name[instrument.instrument.figi] = instrument.instrument.name
-                    with open('figi_to_name.json', 'w') as f:
-                        json.dump(figi_to_name, f, indent=4)
-                return instrument.instrument.name
+        return await instrument_names.name(self.client, figi, self.instrument_index)
+
+    async def figi_names(self, figis: list[str]) -> dict[str, str]:
+        """
+        Названия инструментов пачкой: неизвестные figi запрашиваются параллельно, каждый один раз.
+        :param figis: Список figi.
+        :return: Словарь figi -> название.
+        """
+        await self.instrument_index.ensure(self.client)
+        return await instrument_names.resolve(self.client, figis, self.instrument_index)
 
     async def add_subscribe_candle(self, instruments: list[str], interval: str | None = None) -> None:
         """
@@ -158,21 +306,12 @@ class ConnectTinkoff:
         :return: None
         """
 
-        dict_subscription_interval = {
-            '1m': SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
-            '5m': SubscriptionInterval.SUBSCRIPTION_INTERVAL_FIVE_MINUTES
-        }
-        if interval is None:
-            interval = 'SUBSCRIPTION_INTERVAL_UNSPECIFIED'
         if not self.market_data_stream:
             raise Exception("Не создан стриминг. Вызовите connect() сначала.")
 
-        instruments: list[CandleInstrument] = [CandleInstrument(
-            instrument_id=instrument_id,
-            interval=dict_subscription_interval.get(interval,
-                                                    SubscriptionInterval.SUBSCRIPTION_INTERVAL_UNSPECIFIED)
-        ) for instrument_id in instruments]
-        self.market_data_stream.candles.subscribe(instruments=instruments)
+        for instrument_id in instruments:
+            self.candles_stream[instrument_id] = interval
+        self.market_data_stream.candles.subscribe(instruments=candle_instruments(instruments, interval))
 
     async def add_subscribe_last_price(self, instruments: list[str]) -> None:
         """
@@ -187,7 +326,7 @@ class ConnectTinkoff:
                                                   in
                                                   instruments]
         for ins_id in instruments:
-            if ins_id not in self.instruments_stream:
+            if ins_id.instrument_id not in self.instruments_stream:
                 self.instruments_stream.append(ins_id.instrument_id)
 
         logger.info('Оформляем подписки на последние цены')
@@ -203,6 +342,9 @@ class ConnectTinkoff:
         if not self.market_data_stream:
             raise Exception("Не создан стриминг. Вызовите connect() сначала.")
 
+        for instrument_id in instruments_id:
+            if instrument_id not in self.info_stream:
+                self.info_stream.append(instrument_id)
         instruments = [InfoInstrument(instrument_id=instrument_id) for instrument_id in instruments_id]
         self.market_data_stream.info.subscribe(instruments=instruments)
 
@@ -219,6 +361,9 @@ class ConnectTinkoff:
 
         instrument_info = InfoInstrument(instrument_id=instrument_id)
         self.market_data_stream.info.unsubscribe(instruments=[instrument_info])
+        if instrument_id in self.info_stream:
+            self.info_stream.remove(instrument_id)
+        self.candles_stream.pop(instrument_id, None)
 
         logger.info(f'Подписка на стрим статуса инструмента отменена {instrument_id}')
 
@@ -232,6 +377,11 @@ class ConnectTinkoff:
             instrument = LastPriceInstrument(instrument_id=instrument_id)
             self.market_data_stream.last_price.unsubscribe(instruments=[instrument])
             logger.info(f'Подписка на стрим сделок отменена {instrument_id}')
+            candle_instrument = CandleInstrument(
+                instrument_id=instrument_id,
+                interval=SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
+            )
+            self.market_data_stream.candles.unsubscribe(instruments=[candle_instrument])
         self.instruments_stream.remove(instrument_id)
 
     async def info_accounts(self) -> list[PortfolioResponse]:
@@ -266,11 +416,16 @@ class ConnectTinkoff:
         """
         if not self.queue_portfolio:
             self.queue_portfolio = asyncio.Queue()
-        async for portfolio_response in self.client.operations_stream.portfolio_stream(
-                accounts=[account_id]):
+
+        def put(portfolio_response) -> None:
             self.queue_portfolio.put_nowait(portfolio_response)
             logger.info(f'Получено сообщение о портфеле: {portfolio_response}')
 
+        await self.supervisor.run('portfolio',
+                                  lambda: self._leased(lambda client: client.operations_stream.portfolio_stream(
+                                      accounts=[account_id])),
+                                  put)
+
     async def listening_operations_by_id(self, account_id: str):
         """
         Подписка и прослушивание стрима операций(сделок) портфеля.
@@ -279,15 +434,12 @@ class ConnectTinkoff:
         """
         if not self.queue_portfolio:
             self.queue_portfolio = asyncio.Queue()
-        while True:
-            try:
-                async for operations_response in self.client.operations_stream.positions_stream(
-                        accounts=[account_id]):
-                    self.queue_portfolio.put_nowait(operations_response)
-            except Exception as e:
-                logger.error(f'Ошибка при получении сообщения operations: {e}')
-                await asyncio.sleep(10)
+        await self.supervisor.run('positions',
+                                  lambda: self._leased(lambda client: client.operations_stream.positions_stream(
+                                      accounts=[account_id])),
+                                  self.queue_portfolio.put_nowait)
 
+    @metrics.timed()
     async def post_order(self, instrument_id: str, quantity: int, price: Quotation, direction: OrderDirection,
                          account_id: str, order_id: str, order_type: OrderType) -> PostOrderResponse:
         if client := self.client:
@@ -306,23 +458,28 @@ class ConnectTinkoff:
     async def listening_orders(self, account_id: str):
         if not self.queue_order:
             self.queue_order = asyncio.Queue()
-        while True:
-            try:
-                async for order_response in self.client.orders_stream.trades_stream(
-                        accounts=[account_id]
-                ):
-                    logger.debug(f'Выполнена заявка {order_response}')
-                    self.queue_order.put_nowait(order_response)
-            except Exception as e:
-                logger.error(f'Ошибка при получении сообщения orders: {e}')
-                await asyncio.sleep(10)
+
+        def put(order_response) -> None:
+            logger.debug(f'Выполнена заявка {order_response}')
+            self.queue_order.put_nowait(order_response)
+
+        await self.supervisor.run('orders',
+                                  lambda: self._leased(lambda client: client.orders_stream.trades_stream(
+                                      accounts=[account_id])),
+                                  put)
 
     async def disconnect(self):
+        await self.instrument_index.stop()
+        await self.order_manager.stop()
+        for task in (self.listen, self.task_portfolio_stream, self.task_operations_stream, self.task_orders_stream):
+            if task is not None:
+                task.cancel()
         if self.market_data_stream:
             self.market_data_stream.stop()
             self.market_data_stream = None
-            self.client = None
-            await self._client.__aexit__(None, None, None)
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,268 @@
+"""
+Реестр контекстов стратегий.
+Все StrategyContext загружаются с диска один раз и дальше живут в памяти процесса,
+а изменённые контексты сбрасываются на диск фоновой задачей (write-behind).
+Каждый контекст хранится отдельным компактным снимком (см. strategy.context_snapshot),
+так что запись одного изменённого контекста не переписывает остальные.
+"""
+from __future__ import annotations
+
+import asyncio
+import glob
+import logging
+import os
+import shelve
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from trad.executors import run_io
+from trad.metrics import metrics
+
+if TYPE_CHECKING:
+    from strategy.context_snapshot import SnapshotCodec
+    from strategy.docnhian import StrategyContext
+
+logger = logging.getLogger(__name__)
+
+STATE_PATH = os.path.join('data_strategy_state', 'contexts')
+# Прежний формат: все контексты целиком в одном shelve. Читается один раз для миграции.
+LEGACY_STATE_PATH = os.path.join('data_strategy_state', 'dict_strategy_state')
+SNAPSHOT_SUFFIX = '.json'
+
+
+class ContextRegistry:
+    """
+    Хранилище контекстов стратегий по figi.
+    Изменения помечаются как «грязные» и записываются на диск пачкой,
+    поэтому несколько изменений одного контекста за интервал дают одну запись.
+    """
+
+    def __init__(self, path: str = STATE_PATH, flush_interval: float = 1.0,
+                 legacy_path: Optional[str] = LEGACY_STATE_PATH, codec: Optional['SnapshotCodec'] = None) -> None:
+        """
+        :param path: Папка со снимками контекстов.
+        :param flush_interval: Окно (в секундах), за которое изменения накапливаются перед записью на диск.
+        :param legacy_path: Путь к shelve прежнего формата для миграции (None – без миграции).
+        :param codec: Преобразование контекста в снимок и обратно (по умолчанию SnapshotCodec).
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.legacy_path = legacy_path
+        self._codec = codec
+        self._contexts: dict[str, 'StrategyContext'] = {}
+        self._dirty: set[str] = set()
+        self._deleted: set[str] = set()
+        self._loaded = False
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def codec(self) -> 'SnapshotCodec':
+        if self._codec is None:
+            # Импорт здесь: модуль стратегии сам импортирует реестр.
+            from strategy.context_snapshot import SnapshotCodec
+            self._codec = SnapshotCodec()
+        return self._codec
+
+    def snapshot_path(self, figi: str) -> str:
+        return os.path.join(self.path, figi + SNAPSHOT_SUFFIX)
+
+    def load(self) -> None:
+        """
+        Загружает все контексты с диска в память. Несохранённые изменения при этом теряются.
+        Если снимков ещё нет, контексты переносятся из shelve прежнего формата.
+        """
+        self._contexts = {}
+        self._dirty.clear()
+        self._deleted.clear()
+        paths = glob.glob(os.path.join(self.path, '*' + SNAPSHOT_SUFFIX))
+        for path in paths:
+            figi = os.path.basename(path)[:-len(SNAPSHOT_SUFFIX)]
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    self._contexts[figi] = self.codec.loads(file.read())
+            except Exception as e:
+                # Файл не трогаем: его можно восстановить вручную, а запись других контекстов его не затронет.
+                logger.exception(f'Не удалось загрузить контекст {figi} из {path}: {e}')
+        if not paths and self.legacy_path and glob.glob(self.legacy_path + '*'):
+            self._migrate_legacy()
+        self._loaded = True
+        logger.info(f'Загружено контекстов стратегий: {len(self._contexts)}')
+
+    def _migrate_legacy(self) -> None:
+        """
+        Переносит контексты из shelve прежнего формата. Сам shelve не удаляется.
+        """
+        with shelve.open(self.legacy_path, flag='r') as db:
+            for figi in db.keys():
+                context = db[figi]
+                self.codec.adopt(context)
+                self._contexts[figi] = context
+                self._dirty.add(figi)
+        logger.info(f'Перенесено контекстов из {self.legacy_path}: {len(self._dirty)}')
+        self.flush()
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.load()
+
+    def get(self, figi: str) -> Optional['StrategyContext']:
+        self._ensure_loaded()
+        return self._contexts.get(figi)
+
+    def set(self, figi: str, context: 'StrategyContext') -> None:
+        """
+        Добавляет или заменяет контекст и помечает его для записи на диск.
+        """
+        self._ensure_loaded()
+        self._contexts[figi] = context
+        self.mark_dirty(figi)
+
+    def mark_dirty(self, figi: str) -> None:
+        """
+        Помечает контекст как изменённый. Сама запись произойдёт в фоне.
+        """
+        self._deleted.discard(figi)
+        self._dirty.add(figi)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def delete(self, figi: str) -> None:
+        self._ensure_loaded()
+        self._contexts.pop(figi, None)
+        self._dirty.discard(figi)
+        self._deleted.add(figi)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def __contains__(self, figi: str) -> bool:
+        self._ensure_loaded()
+        return figi in self._contexts
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._contexts)
+
+    def keys(self) -> list[str]:
+        self._ensure_loaded()
+        return list(self._contexts.keys())
+
+    def values(self) -> list['StrategyContext']:
+        self._ensure_loaded()
+        return list(self._contexts.values())
+
+    def items(self) -> Iterator[tuple[str, 'StrategyContext']]:
+        self._ensure_loaded()
+        return iter(list(self._contexts.items()))
+
+    def _take_batch(self) -> tuple[set[str], set[str], list[tuple[str, str]], list[str]]:
+        """
+        Забирает изменённые и удалённые ключи и снимает снимки контекстов.
+        Вызывается в цикле событий, чтобы снимок не разошёлся с контекстом, который меняют обработчики цен.
+        :return: Ключи пачки, пары (путь, текст снимка) для записи и пути снимков для удаления.
+        """
+        dirty, self._dirty = self._dirty, set()
+        deleted, self._deleted = self._deleted, set()
+        try:
+            writes = [(self.snapshot_path(figi), self.codec.dumps(self._contexts[figi]))
+                      for figi in dirty if figi in self._contexts]
+        except Exception:
+            self._requeue(dirty, deleted)
+            raise
+        return dirty, deleted, writes, [self.snapshot_path(figi) for figi in deleted]
+
+    def _requeue(self, dirty: set[str], deleted: set[str]) -> None:
+        # Возвращаем ключи незаписанной пачки, чтобы не потерять изменения до следующей попытки.
+        self._dirty |= dirty - self._deleted
+        self._deleted |= deleted - self._dirty
+
+    def _write_batch(self, writes: list[tuple[str, str]], removes: list[str]) -> None:
+        """
+        Только файловые операции, без обращения к контекстам: может выполняться в пуле потоков.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for path, text in writes:
+            self._write(path, text)
+        for path in removes:
+            if os.path.exists(path):
+                os.remove(path)
+
+    @metrics.timed('registry_flush')
+    def flush(self) -> int:
+        """
+        Записывает на диск снимки всех изменённых контекстов и удаляет снимки удалённых.
+        :return: Количество записанных и удалённых ключей.
+        """
+        if not self._dirty and not self._deleted:
+            return 0
+        dirty, deleted, writes, removes = self._take_batch()
+        try:
+            self._write_batch(writes, removes)
+        except Exception:
+            self._requeue(dirty, deleted)
+            raise
+        logger.debug(f'Сохранено и удалено контекстов: {len(dirty) + len(deleted)}')
+        return len(dirty) + len(deleted)
+
+    async def flush_async(self) -> int:
+        """
+        То же, что flush, но файлы пишутся в пуле потоков. Снимки снимаются в цикле событий до записи,
+        контекст, изменённый во время записи, снова помечен и попадёт в следующую пачку.
+        :return: Количество записанных и удалённых ключей.
+        """
+        if not self._dirty and not self._deleted:
+            return 0
+        with metrics.time('registry_flush'):
+            dirty, deleted, writes, removes = self._take_batch()
+            try:
+                await run_io(self._write_batch, writes, removes)
+            except Exception:
+                self._requeue(dirty, deleted)
+                raise
+        logger.debug(f'Сохранено и удалено контекстов: {len(dirty) + len(deleted)}')
+        return len(dirty) + len(deleted)
+
+    @staticmethod
+    def _write(path: str, text: str) -> None:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+
+    def start(self) -> asyncio.Task:
+        """
+        Запускает фоновую задачу записи изменённых контекстов.
+        """
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            if self._dirty or self._deleted:
+                self._wakeup.set()
+            self._task = asyncio.create_task(self._persist_loop())
+        return self._task
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновую запись и сбрасывает на диск оставшиеся изменения.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+    async def _persist_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Даём изменениям накопиться, чтобы записать их одной пачкой.
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush_async()
+            except Exception as e:
+                logger.exception(f'Ошибка при сохранении контекстов стратегий: {e}')
+                self._wakeup.set()
+
+
+registry = ContextRegistry()
@@ -0,0 +1,150 @@
+"""
+Выполнение блокирующей работы вне цикла событий.
+Файловый ввод-вывод (сохранение свечей, снимков контекстов, справочников) идёт в пул потоков,
+построение исторических данных и индикаторов – в пул процессов. Корутины ждут результат через run_io/run_cpu,
+поэтому стримы продолжают разбираться, пока идёт тяжёлая работа.
+LagMonitor замеряет задержку цикла событий и предупреждает, если цикл был заблокирован дольше порога.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+IO_WORKERS = int(os.getenv('IO_WORKERS', 4))
+CPU_WORKERS = int(os.getenv('CPU_WORKERS', 0)) or None
+# Порог предупреждения о блокировке цикла событий в миллисекундах.
+LOOP_LAG_WARN_MS = float(os.getenv('LOOP_LAG_WARN_MS', 100))
+
+_thread_pool: ThreadPoolExecutor | None = None
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """
+    Пул потоков для файлового ввода-вывода.
+    """
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='io')
+    return _thread_pool
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Пул процессов для построения индикаторов. Процессы запускаются через spawn,
+    чтобы не копировать в дочерние процессы открытые gRPC соединения.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+async def run_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Выполняет блокирующую функцию ввода-вывода в пуле потоков.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_thread_pool(), functools.partial(func, *args, **kwargs))
+
+
+async def run_cpu(func: Callable[..., T], *args: Any) -> T:
+    """
+    Выполняет вычисление в пуле процессов. Функция и аргументы должны сериализоваться pickle
+    (функция – уровня модуля).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), func, *args)
+
+
+def shutdown(wait: bool = True) -> None:
+    """
+    Останавливает пулы. При следующем обращении они создаются заново.
+    """
+    global _thread_pool, _process_pool
+    for pool in (_thread_pool, _process_pool):
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+    _thread_pool = None
+    _process_pool = None
+
+
+class LagMonitor:
+    """
+    Замер задержки цикла событий: насколько позже заказанного просыпается asyncio.sleep.
+    Задержка больше порога означает, что какой-то обработчик выполнялся синхронно всё это время.
+    """
+
+    def __init__(self, interval: float = 0.05, threshold: float = LOOP_LAG_WARN_MS / 1000,
+                 history: Optional[int] = 1000, clock: Callable[[], float] = time.perf_counter) -> None:
+        """
+        :param interval: Интервал замера в секундах.
+        :param threshold: Задержка в секундах, начиная с которой пишется предупреждение.
+        :param history: Сколько последних замеров хранить для перцентилей (None – все).
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.clock = clock
+        self.samples: deque[float] = deque(maxlen=history)
+        self.max_lag = 0.0
+        self.blocked = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name='loop-lag-monitor')
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = self.clock()
+            await asyncio.sleep(self.interval)
+            self.observe(max(0.0, self.clock() - started - self.interval))
+
+    def observe(self, lag: float) -> None:
+        self.samples.append(lag)
+        self.max_lag = max(self.max_lag, lag)
+        if lag >= self.threshold:
+            self.blocked += 1
+            logger.warning(f'Цикл событий был заблокирован на {lag * 1000:.0f} мс')
+
+    def percentile(self, q: float) -> float:
+        """
+        Перцентиль задержки по последним замерам.
+        :param q: Доля от 0 до 1.
+        """
+        if not self.samples:
+            return 0.0
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def metrics(self) -> dict[str, float]:
+        return {'samples': len(self.samples),
+                'last': self.samples[-1] if self.samples else 0.0,
+                'p50': self.percentile(0.5),
+                'p99': self.percentile(0.99),
+                'max': self.max_lag,
+                'blocked': self.blocked}
+
+
+lag_monitor = LagMonitor()
@@ -0,0 +1,219 @@
+"""
+Справочник фьючерсов с поиском по тикеру, figi, uid и базовому активу.
+Список фьючерсов загружается с API один раз, сохраняется на диск и считается актуальным ttl,
+после чего обновляется в фоне. Пока справочник свежий, поиск инструмента не обращается к API.
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+import os
+import pickle
+from typing import TYPE_CHECKING, Callable, Optional
+
+from trad.executors import run_io
+
+if TYPE_CHECKING:
+    from tinkoff.invest import Future, MoneyValue, Quotation
+    from tinkoff.invest.async_services import AsyncServices
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = os.path.join('my_data_folder', 'instruments', 'futures.pkl')
+INDEX_TTL = datetime.timedelta(hours=12)
+
+
+class InstrumentIndex:
+    """
+    Индекс фьючерсов в памяти с сохранением на диск.
+    """
+
+    def __init__(self, path: str = INDEX_PATH, ttl: datetime.timedelta = INDEX_TTL) -> None:
+        """
+        :param path: Файл, в котором хранится список фьючерсов.
+        :param ttl: Время, через которое справочник обновляется с API.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.loaded_at: Optional[datetime.datetime] = None
+        self.by_ticker: dict[str, 'Future'] = {}
+        self.by_figi: dict[str, 'Future'] = {}
+        self.by_uid: dict[str, 'Future'] = {}
+        self.by_basic_asset: dict[str, list['Future']] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._load_task: Optional[asyncio.Future] = None
+        self._background: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.by_uid)
+
+    @property
+    def expired(self) -> bool:
+        if self.loaded_at is None:
+            return True
+        return datetime.datetime.now(datetime.timezone.utc) - self.loaded_at >= self.ttl
+
+    def build(self, futures: list['Future'], loaded_at: Optional[datetime.datetime] = None) -> None:
+        """
+        Перестраивает индекс по списку фьючерсов.
+        """
+        by_ticker, by_figi, by_uid, by_basic_asset = {}, {}, {}, {}
+        for future in futures:
+            by_ticker[future.ticker] = future
+            by_figi[future.figi] = future
+            by_uid[future.uid] = future
+            by_basic_asset.setdefault(future.basic_asset, []).append(future)
+        self.by_ticker, self.by_figi, self.by_uid, self.by_basic_asset = by_ticker, by_figi, by_uid, by_basic_asset
+        self.loaded_at = loaded_at or datetime.datetime.now(datetime.timezone.utc)
+
+    def put(self, future: 'Future') -> None:
+        """
+        Обновляет один инструмент свежими данными, например после запроса future_by.
+        """
+        previous = self.by_uid.get(future.uid)
+        if previous is not None and previous.basic_asset in self.by_basic_asset:
+            self.by_basic_asset[previous.basic_asset] = [item for item in self.by_basic_asset[previous.basic_asset]
+                                                         if item.uid != future.uid]
+        self.by_ticker[future.ticker] = future
+        self.by_figi[future.figi] = future
+        self.by_uid[future.uid] = future
+        self.by_basic_asset.setdefault(future.basic_asset, []).append(future)
+
+    def load(self) -> bool:
+        """
+        Загружает справочник с диска.
+        :return: True, если файл найден и прочитан.
+        """
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as file:
+                loaded_at, futures = pickle.load(file)
+        except Exception as e:
+            logger.error(f'Не удалось прочитать справочник фьючерсов {self.path}: {e}')
+            return False
+        self.build(futures, loaded_at)
+        logger.info(f'Справочник фьючерсов загружен с диска: {len(self)} инструментов от {loaded_at:%Y-%m-%d %H:%M}')
+        return True
+
+    async def load_async(self) -> bool:
+        """
+        Загружает справочник с диска в пуле ввода-вывода. Параллельные вызовы ждут одно и то же чтение.
+        """
+        if self._load_task is None or self._load_task.done():
+            self._load_task = asyncio.ensure_future(run_io(self.load))
+        return await asyncio.shield(self._load_task)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump((self.loaded_at, list(self.by_uid.values())), file)
+        os.replace(tmp_path, self.path)
+
+    async def refresh(self, client: 'AsyncServices') -> None:
+        """
+        Загружает список фьючерсов с API. Параллельные вызовы ждут одну и ту же загрузку.
+        """
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh(client))
+        await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self, client: 'AsyncServices') -> None:
+        response = await client.instruments.futures()
+        self.build(response.instruments)
+        await run_io(self.save)
+        logger.info(f'Справочник фьючерсов обновлён: {len(self)} инструментов')
+
+    async def ensure(self, client: 'AsyncServices') -> None:
+        """
+        Гарантирует, что справочник загружен. Пустой справочник загружается сразу,
+        устаревший – обновляется в фоне, а до этого используются прежние данные.
+        """
+        if not len(self):
+            await self.load_async()
+        if not len(self):
+            await self.refresh(client)
+        elif self.expired and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self._refresh(client))
+            self._refresh_task.add_done_callback(self._log_refresh_error)
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception():
+            logger.error(f'Ошибка фонового обновления справочника фьючерсов: {task.exception()}')
+
+    def start(self, client_getter: Callable[[], Optional['AsyncServices']]) -> asyncio.Task:
+        """
+        Запускает фоновое обновление справочника раз в ttl.
+        :param client_getter: Функция, возвращающая текущий клиент API (он меняется при переподключении).
+        """
+        if self._background is None or self._background.done():
+            self._background = asyncio.create_task(self._refresh_loop(client_getter))
+        return self._background
+
+    async def _refresh_loop(self, client_getter: Callable[[], Optional['AsyncServices']]) -> None:
+        while True:
+            try:
+                client = client_getter()
+                if client is not None:
+                    if not len(self):
+                        await self.load_async()
+                    if self.expired:
+                        await self.refresh(client)
+            except Exception as e:
+                logger.error(f'Ошибка обновления справочника фьючерсов: {e}')
+            await asyncio.sleep(min(self.ttl.total_seconds(), 3600))
+
+    async def stop(self) -> None:
+        if self._background is not None:
+            self._background.cancel()
+            try:
+                await self._background
+            except asyncio.CancelledError:
+                pass
+            self._background = None
+
+    async def find_by_ticker(self, client: 'AsyncServices', ticker: str) -> 'Future':
+        """
+        Фьючерс по тикеру. Если тикера нет в справочнике, справочник один раз обновляется с API
+        (или дожидается уже идущего обновления).
+        """
+        await self.ensure(client)
+        future = self.by_ticker.get(ticker)
+        if future is None:
+            # Тикер мог появиться после последнего обновления (новая серия контрактов).
+            await self.refresh(client)
+            future = self.by_ticker.get(ticker)
+        if future is None:
+            raise ValueError(f'Не найден фьючерс с тикером {ticker}')
+        return future
+
+    def get(self, instrument_id: str) -> Optional['Future']:
+        """
+        Фьючерс по uid, figi или тикеру.
+        """
+        return self.by_uid.get(instrument_id) or self.by_figi.get(instrument_id) or self.by_ticker.get(instrument_id)
+
+    def name(self, figi: str) -> Optional[str]:
+        future = self.by_figi.get(figi)
+        return future.name if future else None
+
+    def tick_size(self, instrument_id: str) -> Optional[tuple['Quotation', 'Quotation']]:
+        """
+        Минимальный шаг цены в пунктах и его стоимость в рублях.
+        """
+        future = self.get(instrument_id)
+        if future is None:
+            return None
+        return future.min_price_increment, future.min_price_increment_amount
+
+    def margin(self, instrument_id: str) -> Optional[tuple['MoneyValue', 'MoneyValue']]:
+        """
+        Гарантийное обеспечение на покупку и продажу из справочника.
+        """
+        future = self.get(instrument_id)
+        if future is None:
+            return None
+        return future.initial_margin_on_buy, future.initial_margin_on_sell
@@ -0,0 +1,140 @@
+"""
+Названия инструментов по figi для форматирования сообщений.
+Названия хранятся в памяти, неизвестные figi запрашиваются пачкой (по одному get_instrument_by на figi,
+параллельно), а одновременные запросы одного figi объединяются в один.
+Новые названия дописываются в конец файла jsonl одной записью, без перезаписи всего файла,
+поэтому параллельные обращения не портят файл. Файловые операции выполняются вне event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from trad.executors import run_io
+
+if TYPE_CHECKING:
+    from tinkoff.invest.async_services import AsyncServices
+    from trad.instrument_index import InstrumentIndex
+
+logger = logging.getLogger(__name__)
+
+NAMES_PATH = 'figi_to_name.jsonl'
+# Прежний формат: весь словарь в одном JSON, только читается.
+LEGACY_NAMES_PATH = 'figi_to_name.json'
+# Тип идентификатора FIGI в get_instrument_by.
+INSTRUMENT_ID_TYPE_FIGI = 1
+
+
+class InstrumentNames:
+    """
+    Кэш названий инструментов с дозаписью в файл.
+    """
+
+    def __init__(self, path: str = NAMES_PATH, legacy_path: Optional[str] = LEGACY_NAMES_PATH) -> None:
+        """
+        :param path: Файл jsonl, куда дописываются новые названия.
+        :param legacy_path: JSON прежнего формата, из которого названия только читаются.
+        """
+        self.path = path
+        self.legacy_path = legacy_path
+        self.names: dict[str, str] = {}
+        self._loaded = False
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def load(self) -> dict[str, str]:
+        """
+        Читает названия с диска. Повреждённые строки (например, недописанная последняя) пропускаются.
+        """
+        names = {}
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            try:
+                with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                    names.update(json.load(f))
+            except Exception as e:
+                logger.error(f'Не удалось прочитать {self.legacy_path}: {e}')
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    names[record['figi']] = record['name']
+        self.names.update(names)
+        self._loaded = True
+        return self.names
+
+    def get(self, figi: str) -> str:
+        """
+        Название из памяти без обращения к API. Если название неизвестно, возвращается сам figi.
+        Бот загружает названия при запуске в пуле ввода-вывода, чтение с диска здесь – только для вызовов вне бота.
+        """
+        if not self._loaded:
+            self.load()
+        return self.names.get(figi, figi)
+
+    def _append(self, names: dict[str, str]) -> None:
+        data = ''.join(json.dumps({'figi': figi, 'name': name}, ensure_ascii=False) + '\n'
+                       for figi, name in names.items()).encode('utf-8')
+        # Одна запись в файл, открытый на дозапись: строки разных пачек не перемешиваются.
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    async def _fetch(self, client: 'AsyncServices', figi: str) -> Optional[str]:
+        try:
+            response = await client.instruments.get_instrument_by(id_type=INSTRUMENT_ID_TYPE_FIGI, id=figi)
+        except Exception as e:
+            logger.error(f'Не удалось получить название инструмента {figi}: {e}')
+            return None
+        return response.instrument.name
+
+    async def resolve(self, client: 'AsyncServices', figis: Iterable[str],
+                      index: Optional['InstrumentIndex'] = None) -> dict[str, str]:
+        """
+        Названия для списка figi. Неизвестные ищутся в справочнике фьючерсов, затем запрашиваются с API.
+        :param client: Клиент API.
+        :param figis: Список figi.
+        :param index: Справочник фьючерсов, если он есть.
+        :return: Словарь figi -> название (для ненайденных – сам figi).
+        """
+        if not self._loaded:
+            await run_io(self.load)
+        figis = list(dict.fromkeys(figis))
+        found: dict[str, str] = {}
+        missing = [figi for figi in figis if figi not in self.names and figi not in self._inflight]
+        if index is not None:
+            for figi in missing:
+                if (name := index.name(figi)) is not None:
+                    found[figi] = name
+        missing = [figi for figi in missing if figi not in found]
+
+        loop = asyncio.get_running_loop()
+        own = {figi: loop.create_future() for figi in missing}
+        self._inflight.update(own)
+        try:
+            results = await asyncio.gather(*(self._fetch(client, figi) for figi in missing))
+            found.update({figi: name for figi, name in zip(missing, results) if name is not None})
+            if found:
+                self.names.update(found)
+                await run_io(self._append, found)
+        finally:
+            for figi, future in own.items():
+                self._inflight.pop(figi, None)
+                future.set_result(self.names.get(figi, figi))
+
+        waiting = [figi for figi in figis if figi not in self.names and figi in self._inflight]
+        if waiting:
+            await asyncio.gather(*(self._inflight[figi] for figi in waiting))
+        return {figi: self.names.get(figi, figi) for figi in figis}
+
+    async def name(self, client: 'AsyncServices', figi: str, index: Optional['InstrumentIndex'] = None) -> str:
+        return (await self.resolve(client, [figi], index))[figi]
+
+
+instrument_names = InstrumentNames()
@@ -0,0 +1,108 @@
+"""
+Кэш ГО и шага цены фьючерсов (ответ get_futures_margin) по uid инструмента.
+Параметры меняются в основном на клиринге, поэтому запись считается действительной до ближайшего клиринга
+после её получения. Запись также сбрасывается при смене статуса торгов инструмента.
+Кэш заполняется заранее для всех подписанных инструментов, так что между пробоем и выставлением заявки
+запрос к API не нужен.
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+from typing import TYPE_CHECKING, Iterable, Optional
+from zoneinfo import ZoneInfo
+
+if TYPE_CHECKING:
+    from tinkoff.invest import GetFuturesMarginResponse
+    from tinkoff.invest.async_services import AsyncServices
+
+logger = logging.getLogger(__name__)
+
+MOSCOW = ZoneInfo('Europe/Moscow')
+# Окончание дневного и вечернего клиринга срочного рынка по Москве.
+CLEARING_TIMES = (datetime.time(14, 5), datetime.time(19, 5))
+
+
+def last_clearing(now: datetime.datetime,
+                  clearing_times: tuple[datetime.time, ...] = CLEARING_TIMES) -> datetime.datetime:
+    """
+    Время последнего клиринга не позже now.
+    """
+    local = now.astimezone(MOSCOW)
+    for days in range(2):
+        day = local.date() - datetime.timedelta(days=days)
+        passed = [datetime.datetime.combine(day, moment, MOSCOW) for moment in clearing_times
+                  if datetime.datetime.combine(day, moment, MOSCOW) <= local]
+        if passed:
+            return max(passed)
+    return datetime.datetime.combine(local.date() - datetime.timedelta(days=1), max(clearing_times), MOSCOW)
+
+
+class MarginCache:
+    """
+    Параметры get_futures_margin по uid с инвалидацией на клиринге.
+    """
+
+    def __init__(self, clearing_times: tuple[datetime.time, ...] = CLEARING_TIMES) -> None:
+        self.clearing_times = clearing_times
+        self.entries: dict[str, tuple[datetime.datetime, 'GetFuturesMarginResponse']] = {}
+        self.hits = 0
+        self.misses = 0
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def cached(self, uid: str, now: Optional[datetime.datetime] = None) -> Optional['GetFuturesMarginResponse']:
+        """
+        Параметры из кэша, если после их получения не было клиринга.
+        """
+        entry = self.entries.get(uid)
+        if entry is None:
+            return None
+        fetched_at, response = entry
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        if fetched_at < last_clearing(now, self.clearing_times):
+            del self.entries[uid]
+            return None
+        return response
+
+    async def get(self, client: 'AsyncServices', uid: str) -> 'GetFuturesMarginResponse':
+        """
+        Параметры инструмента: из кэша или одним запросом к API (одновременные запросы объединяются).
+        """
+        if (response := self.cached(uid)) is not None:
+            self.hits += 1
+            return response
+        self.misses += 1
+        task = self._inflight.get(uid)
+        if task is None:
+            task = asyncio.create_task(self._fetch(client, uid))
+            self._inflight[uid] = task
+            task.add_done_callback(lambda _: self._inflight.pop(uid, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, client: 'AsyncServices', uid: str) -> 'GetFuturesMarginResponse':
+        fetched_at = datetime.datetime.now(datetime.timezone.utc)
+        response = await client.instruments.get_futures_margin(instrument_id=uid)
+        self.entries[uid] = (fetched_at, response)
+        return response
+
+    async def prefetch(self, client: 'AsyncServices', uids: Iterable[str]) -> int:
+        """
+        Заполняет кэш для инструментов, которых в нём нет.
+        :return: Количество загруженных инструментов.
+        """
+        missing = [uid for uid in dict.fromkeys(uids) if self.cached(uid) is None]
+        results = await asyncio.gather(*(self._fetch(client, uid) for uid in missing), return_exceptions=True)
+        for uid, result in zip(missing, results):
+            if isinstance(result, Exception):
+                logger.error(f'Не удалось загрузить ГО инструмента {uid}: {result}')
+        return sum(not isinstance(result, Exception) for result in results)
+
+    def invalidate(self, uid: Optional[str] = None) -> None:
+        """
+        Сбрасывает запись инструмента или весь кэш.
+        """
+        if uid is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(uid, None)
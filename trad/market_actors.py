@@ -0,0 +1,184 @@
+"""
+Обработка цен из стрима отдельным актором на каждый инструмент.
+У актора почтовый ящик на одно значение: пока обрабатывается цена, новые цены не копятся в очереди,
+а заменяют друг друга, и после обработки актор берёт только самую свежую.
+Медленная обработка одного инструмента (например, ожидание исполнения заявки) не задерживает остальные.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ActorMetrics:
+    """
+    Счётчики одного актора.
+    """
+
+    def __init__(self) -> None:
+        self.received = 0
+        self.processed = 0
+        self.conflated = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+
+    def observe(self, elapsed: float) -> None:
+        self.processed += 1
+        self.total_time += elapsed
+        self.last_time = elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.processed if self.processed else 0.0
+
+
+class InstrumentActor:
+    """
+    Последовательная обработка значений одного инструмента с почтовым ящиком на одно значение.
+    """
+
+    def __init__(self, key: str, handler: Callable[[Any], Awaitable[Any]]) -> None:
+        """
+        :param key: Ключ инструмента (figi).
+        :param handler: Корутина обработки значения.
+        """
+        self.key = key
+        self.handler = handler
+        self.metrics = ActorMetrics()
+        self._latest: Any = None
+        self._pending = False
+        # Значения догрузки после разрыва стрима: обрабатываются все по порядку и раньше свежего значения.
+        self._backlog: deque = deque()
+        self._busy = False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def busy(self) -> bool:
+        """
+        Идёт обработка значения.
+        """
+        return self._busy
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Количество значений, ожидающих обработки.
+        """
+        return int(self._pending) + len(self._backlog)
+
+    def offer(self, value: Any) -> None:
+        """
+        Кладёт значение в почтовый ящик. Необработанное предыдущее значение заменяется.
+        """
+        if self._pending:
+            self.metrics.conflated += 1
+        self._latest = value
+        self._pending = True
+        self.metrics.received += 1
+        self._wake()
+
+    def replay(self, values: list[Any]) -> None:
+        """
+        Ставит значения в очередь без схлопывания. Они обрабатываются по порядку до значения из почтового ящика.
+        """
+        self._backlog.extend(values)
+        self.metrics.received += len(values)
+        self._wake()
+
+    def _wake(self) -> None:
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f'actor-{self.key}')
+
+    async def _run(self) -> None:
+        while True:
+            if not self._backlog and not self._pending:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            if self._backlog:
+                value = self._backlog.popleft()
+            else:
+                value, self._latest, self._pending = self._latest, None, False
+            self._busy = True
+            started = time.perf_counter()
+            try:
+                await self.handler(value)
+            except Exception as e:
+                self.metrics.errors += 1
+                logger.exception(f'Ошибка обработки {self.key}: {e}')
+            finally:
+                self._busy = False
+                self.metrics.observe(time.perf_counter() - started)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class ActorDispatcher:
+    """
+    Маршрутизация значений по акторам инструментов. Актор создаётся при первом значении.
+    """
+
+    def __init__(self, handler: Callable[[Any], Awaitable[Any]]) -> None:
+        """
+        :param handler: Корутина обработки значения, общая для всех акторов.
+        """
+        self.handler = handler
+        self.actors: dict[str, InstrumentActor] = {}
+
+    def actor(self, key: str) -> InstrumentActor:
+        actor = self.actors.get(key)
+        if actor is None:
+            actor = InstrumentActor(key, self.handler)
+            self.actors[key] = actor
+        return actor
+
+    def dispatch(self, key: str, value: Any) -> InstrumentActor:
+        """
+        Передаёт значение актору инструмента.
+        :return: Актор, получивший значение.
+        """
+        actor = self.actor(key)
+        actor.offer(value)
+        return actor
+
+    def replay(self, key: str, values: list[Any]) -> InstrumentActor:
+        """
+        Передаёт актору инструмента последовательность значений, которые нужно обработать все.
+        """
+        actor = self.actor(key)
+        actor.replay(values)
+        return actor
+
+    def metrics(self) -> dict[str, dict[str, float]]:
+        """
+        Метрики всех акторов по ключу инструмента.
+        """
+        return {key: {'queue_depth': actor.queue_depth,
+                      'busy': int(actor.busy),
+                      'received': actor.metrics.received,
+                      'processed': actor.metrics.processed,
+                      'conflated': actor.metrics.conflated,
+                      'errors': actor.metrics.errors,
+                      'avg_time': actor.metrics.avg_time,
+                      'max_time': actor.metrics.max_time}
+                for key, actor in self.actors.items()}
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(actor.stop() for actor in self.actors.values()))
@@ -0,0 +1,231 @@
+"""
+Встроенные метрики бота: время выполнения горячих участков (перцентили по последним замерам),
+счётчики сообщений стримов по типам и показатели компонентов (акторы цен, стримы, каналы API, уведомления,
+кэш ГО, заявки, задержка цикла событий), которые собираются в момент запроса.
+Метрики отдаются в текстовом формате Prometheus по локальному HTTP (METRICS_PORT, 0 – выключено)
+и сводкой для команды /metrics в Telegram.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import functools
+import inspect
+import logging
+import os
+import re
+import time
+from collections import deque
+from typing import Any, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))
+QUANTILES = (0.5, 0.99)
+
+
+class TimingStats:
+    """
+    Время выполнения одного участка: общее количество и сумма, перцентили – по последним history замерам.
+    """
+
+    def __init__(self, history: int = 2048) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: deque[float] = deque(maxlen=history)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def metric_name(*parts: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', '_'.join(part for part in parts if part))
+
+
+def label_value(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, complex)
+
+
+class Metrics:
+    """
+    Реестр метрик процесса.
+    """
+
+    def __init__(self, prefix: str = 'gas', history: int = 2048) -> None:
+        """
+        :param prefix: Префикс имён метрик в формате Prometheus.
+        :param history: Сколько последних замеров времени хранить для перцентилей.
+        """
+        self.prefix = prefix
+        self.history = history
+        self.timers: dict[str, TimingStats] = {}
+        self.counters: dict[str, dict[str, int]] = {}
+        self.sources: dict[str, Callable[[], dict[str, Any]]] = {}
+
+    def observe(self, name: str, seconds: float) -> None:
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = TimingStats(self.history)
+        timer.observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def timed(self, name: Optional[str] = None):
+        """
+        Декоратор замера времени функции или корутины (по умолчанию метрика называется по имени функции).
+        """
+
+        def decorator(func):
+            timer_name = name or func.__name__
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.time(timer_name):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(timer_name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def inc(self, name: str, label: str = '', value: int = 1) -> None:
+        counter = self.counters.setdefault(name, {})
+        counter[label] = counter.get(label, 0) + value
+
+    def add_source(self, name: str, collect: Callable[[], dict[str, Any]]) -> None:
+        """
+        Подключает показатели компонента. collect вызывается при каждом запросе метрик и возвращает
+        словарь чисел или словарь словарей чисел по ключу (инструменту, стриму, каналу).
+        """
+        self.sources[name] = collect
+
+    def collect_sources(self) -> dict[str, dict[str, Any]]:
+        collected = {}
+        for name, collect in self.sources.items():
+            try:
+                collected[name] = collect() or {}
+            except Exception as e:
+                logger.error(f'Не удалось собрать метрики {name}: {e}')
+        return collected
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus.
+        """
+        lines = []
+        for name, timer in sorted(self.timers.items()):
+            metric = metric_name(self.prefix, name, 'seconds')
+            lines.append(f'# TYPE {metric} summary')
+            for q in QUANTILES:
+                lines.append(f'{metric}{{quantile="{q}"}} {timer.percentile(q):.9f}')
+            lines.append(f'{metric}_sum {timer.total:.9f}')
+            lines.append(f'{metric}_count {timer.count}')
+        for name, counter in sorted(self.counters.items()):
+            metric = metric_name(self.prefix, name, 'total')
+            lines.append(f'# TYPE {metric} counter')
+            for label, value in sorted(counter.items()):
+                lines.append(f'{metric}{{type="{label_value(label)}"}} {value}')
+        for source, values in self.collect_sources().items():
+            for key, value in values.items():
+                if isinstance(value, dict):
+                    for field, item in value.items():
+                        if is_number(item):
+                            lines.append(f'{metric_name(self.prefix, source, field)}'
+                                         f'{{name="{label_value(key)}"}} {float(item):g}')
+                elif is_number(value):
+                    lines.append(f'{metric_name(self.prefix, source, key)} {float(value):g}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """
+        Краткая сводка для Telegram: перцентили времени в миллисекундах, счётчики и показатели компонентов.
+        """
+        lines = ['<b>Время, мс (p50 / p99 / max, вызовов)</b>']
+        for name, timer in sorted(self.timers.items()):
+            lines.append(f'{name}: {timer.percentile(0.5) * 1000:.2f} / {timer.percentile(0.99) * 1000:.2f} / '
+                         f'{timer.max * 1000:.2f}, {timer.count}')
+        for name, counter in sorted(self.counters.items()):
+            lines.append(f'\n<b>{name}</b>: '
+                         + ', '.join(f'{label} {value}' for label, value in sorted(counter.items())))
+        for source, values in self.collect_sources().items():
+            lines.append(f'\n<b>{source}</b>')
+            for key, value in values.items():
+                if isinstance(value, dict):
+                    lines.append(f'{key}: ' + ', '.join(f'{field} {item:.3g}' for field, item in value.items()
+                                                        if is_number(item)))
+                elif is_number(value):
+                    lines.append(f'{key}: {value:.3g}')
+        return '\n'.join(lines)
+
+
+class MetricsServer:
+    """
+    Локальный HTTP сервер метрик: GET /metrics отдаёт Metrics.render().
+    """
+
+    def __init__(self, registry: 'Metrics', host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> Optional[asyncio.AbstractServer]:
+        if not self.port:
+            return None
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f'Метрики доступны на http://{self.host}:{self.port}/metrics')
+        return self._server
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except Exception as e:
+            logger.error(f'Ошибка запроса метрик: {e}')
+        finally:
+            writer.close()
+
+
+metrics = Metrics()
@@ -0,0 +1,305 @@
+"""
+Управление открытыми заявками всех инструментов одним циклом.
+У каждой заявки явный автомат состояний (NEW -> PARTIAL -> FILLED / CANCELLED / REJECTED / EXPIRED).
+Состояния всех заявок сверяются одним запросом get_orders по счёту: раз в reconcile_interval
+или сразу после события по заявке из стрима сделок. Таймауты заявок и проверки цены для переставления
+заявки ведёт колесо таймеров, поэтому на заявку не приходится отдельной корутины с опросом API.
+"""
+from __future__ import annotations
+
+import asyncio
+import enum
+import logging
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+
+from tinkoff.invest import OrderExecutionReportStatus, OrderState, PostOrderResponse
+
+from trad.timer_wheel import TimerWheel
+
+if TYPE_CHECKING:
+    from trad.connect_tinkoff import ConnectTinkoff
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 'timeout'
+PRICE_CHECK = 'price'
+
+
+class OrderStatus(enum.Enum):
+    NEW = 'new'
+    PARTIAL = 'partial'
+    FILLED = 'filled'
+    CANCELLED = 'cancelled'
+    REJECTED = 'rejected'
+    # Заявка снята ботом, потому что не исполнилась за отведённое время.
+    EXPIRED = 'expired'
+
+
+FINAL = frozenset({OrderStatus.FILLED, OrderStatus.CANCELLED, OrderStatus.REJECTED, OrderStatus.EXPIRED})
+TRANSITIONS: dict[OrderStatus, frozenset[OrderStatus]] = {
+    OrderStatus.NEW: frozenset(OrderStatus),
+    OrderStatus.PARTIAL: frozenset({OrderStatus.PARTIAL, OrderStatus.FILLED, OrderStatus.CANCELLED,
+                                    OrderStatus.EXPIRED}),
+}
+REPORT_STATUS = {
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW: OrderStatus.NEW,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL: OrderStatus.PARTIAL,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL: OrderStatus.FILLED,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED: OrderStatus.CANCELLED,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED: OrderStatus.REJECTED,
+}
+
+
+class ManagedOrder:
+    """
+    Заявка под управлением OrderManager.
+    При переставлении заявки биржевой id меняется, а прежние состояния сохраняются в history.
+    """
+
+    def __init__(self, order_id: str, state: OrderState | PostOrderResponse, deadline: float,
+                 price_check_interval: Optional[float] = None,
+                 reprice: Optional[Callable[['ManagedOrder'], Awaitable[Optional[PostOrderResponse]]]] = None) -> None:
+        """
+        :param order_id: Биржевой id заявки.
+        :param state: Ответ на выставление заявки.
+        :param deadline: Момент (по time.monotonic), после которого заявка снимается.
+        :param price_check_interval: Как часто проверять, не ушла ли цена от заявки.
+        :param reprice: Корутина переставления заявки. Возвращает ответ на новую заявку или None, если переставлять не нужно.
+        """
+        self.order_id = order_id
+        self.state = state
+        self.status = OrderStatus.NEW
+        self.deadline = deadline
+        self.price_check_interval = price_check_interval
+        self.reprice = reprice
+        self.history: list[OrderState] = []
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def final(self) -> bool:
+        return self.status in FINAL
+
+    @property
+    def lots_executed(self) -> int:
+        return getattr(self.state, 'lots_executed', 0) or 0
+
+    def transition(self, status: OrderStatus) -> bool:
+        """
+        Переводит заявку в новое состояние, если переход допустим.
+        """
+        if self.final or status not in TRANSITIONS[self.status]:
+            if status != self.status:
+                logger.warning(f'Недопустимый переход заявки {self.order_id}: {self.status.name} -> {status.name}')
+            return False
+        self.status = status
+        return True
+
+
+class OrderManager:
+    """
+    Единый цикл обслуживания открытых заявок счёта.
+    """
+
+    def __init__(self, connect: 'ConnectTinkoff', account_id: Optional[str] = None,
+                 tick: float = 1.0, reconcile_interval: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        :param connect: Подключение к API.
+        :param account_id: Счёт, заявки которого сверяются.
+        :param tick: Шаг цикла и точность таймеров в секундах.
+        :param reconcile_interval: Интервал плановой сверки get_orders в секундах.
+        """
+        self.connect = connect
+        self.account_id = account_id
+        self.tick = tick
+        self.reconcile_interval = reconcile_interval
+        self.clock = clock
+        self.wheel = TimerWheel(tick, clock=clock)
+        self.orders: dict[str, ManagedOrder] = {}
+        self.reconcile_calls = 0
+        self._dirty: set[str] = set()
+        self._last_reconcile = clock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def on_order_event(self, order_id: str) -> None:
+        """
+        Событие по заявке из стрима: заявка сверится на ближайшем шаге цикла.
+        """
+        if order_id in self.orders:
+            self._dirty.add(order_id)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def submit(self, order_id: str, state: OrderState | PostOrderResponse, timeout: float,
+                     price_check_interval: Optional[float] = None,
+                     reprice: Optional[Callable[[ManagedOrder], Awaitable[Optional[PostOrderResponse]]]] = None
+                     ) -> ManagedOrder:
+        """
+        Передаёт выставленную заявку под управление.
+        :param order_id: Биржевой id заявки.
+        :param state: Ответ на выставление заявки.
+        :param timeout: Через сколько секунд снять неисполненную заявку.
+        :param price_check_interval: Интервал проверки цены для переставления заявки.
+        :param reprice: Корутина переставления заявки.
+        :return: Заявка, её итог – в ManagedOrder.done.
+        """
+        self.connect.order_tracker.listener = self.on_order_event
+        order = ManagedOrder(order_id, state, self.clock() + timeout, price_check_interval, reprice)
+        self.orders[order_id] = order
+        status = REPORT_STATUS.get(state.execution_report_status)
+        if status in FINAL:
+            # Заявка исполнилась или отклонена сразу при выставлении, цикл не нужен.
+            await self._apply(order, await self._order_state(order.order_id))
+            if order.final:
+                return order
+        self._schedule(order)
+        self.start()
+        self._wakeup.set()
+        return order
+
+    def _schedule(self, order: ManagedOrder) -> None:
+        self.wheel.schedule((order.order_id, TIMEOUT), max(0.0, order.deadline - self.clock()))
+        if order.reprice is not None and order.price_check_interval:
+            self.wheel.schedule((order.order_id, PRICE_CHECK), order.price_check_interval)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name='order-manager')
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self.orders:
+                    await asyncio.wait_for(self._wakeup.wait(), self.tick)
+                else:
+                    await self._wakeup.wait()
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.step()
+            except Exception as e:
+                logger.exception(f'Ошибка цикла управления заявками: {e}')
+
+    async def step(self) -> None:
+        """
+        Один шаг цикла: сработавшие таймеры, затем сверка состояний, если она нужна.
+        """
+        for order_id, kind in self.wheel.advance():
+            order = self.orders.get(order_id)
+            if order is None:
+                continue
+            if kind == TIMEOUT:
+                await self._expire(order)
+            elif kind == PRICE_CHECK:
+                await self._check_price(order)
+        if self.orders and (self._dirty or self.clock() - self._last_reconcile >= self.reconcile_interval):
+            await self.reconcile()
+
+    async def reconcile(self) -> None:
+        """
+        Сверяет все открытые заявки одним запросом get_orders. Заявки, которых нет среди активных,
+        завершились – их итоговое состояние запрашивается отдельно.
+        """
+        self.reconcile_calls += 1
+        self._last_reconcile = self.clock()
+        self._dirty.clear()
+        response = await self.connect.client.orders.get_orders(account_id=self.account_id)
+        active = {state.order_id: state for state in response.orders}
+        for order in list(self.orders.values()):
+            state = active.get(order.order_id)
+            if state is None:
+                state = await self._order_state(order.order_id)
+            await self._apply(order, state)
+
+    async def refresh(self, order: ManagedOrder) -> ManagedOrder:
+        """
+        Запрашивает актуальное состояние заявки и применяет его (например, перед переставлением,
+        чтобы не опираться на устаревший снимок с частичным исполнением).
+        """
+        await self._apply(order, await self._order_state(order.order_id))
+        return order
+
+    async def _order_state(self, order_id: str) -> OrderState:
+        state: OrderState = await self.connect.client.orders.get_order_state(account_id=self.account_id,
+                                                                             order_id=order_id)
+        self.connect.order_tracker.on_order_state(state, notify=False)
+        return state
+
+    async def _apply(self, order: ManagedOrder, state: OrderState) -> None:
+        order.state = state
+        status = REPORT_STATUS.get(state.execution_report_status)
+        if status is None or not order.transition(status):
+            return
+        if order.final:
+            self._finish(order)
+
+    async def _check_price(self, order: ManagedOrder) -> None:
+        try:
+            new_order = await order.reprice(order)
+        except Exception as e:
+            logger.error(f'Не удалось переставить заявку {order.order_id}: {e}')
+            new_order = None
+        if order.final:
+            return
+        if new_order is not None:
+            if isinstance(order.state, OrderState):
+                order.history.append(order.state)
+            self._rekey(order, new_order.order_id)
+            order.state = new_order
+            self._schedule(order)
+        else:
+            self.wheel.schedule((order.order_id, PRICE_CHECK), order.price_check_interval)
+
+    def _rekey(self, order: ManagedOrder, order_id: str) -> None:
+        self.wheel.cancel((order.order_id, TIMEOUT))
+        self.wheel.cancel((order.order_id, PRICE_CHECK))
+        self.orders.pop(order.order_id, None)
+        self._dirty.discard(order.order_id)
+        self.connect.order_tracker.discard(order.order_id)
+        order.order_id = order_id
+        self.orders[order_id] = order
+
+    async def _expire(self, order: ManagedOrder) -> None:
+        """
+        Снимает заявку, не исполненную за отведённое время.
+        """
+        logger.info(f'Заявка {order.order_id} не выполнена вовремя, снимаем')
+        try:
+            await self.connect.client.orders.cancel_order(account_id=self.account_id, order_id=order.order_id)
+        except Exception as e:
+            # Обычно отмена не проходит, потому что заявка уже исполнилась, итог покажет её состояние.
+            logger.error(f'При отмене заявки {order.order_id} произошла ошибка {e}')
+        try:
+            order.state = await self._order_state(order.order_id)
+        except Exception as e:
+            logger.error(f'Не удалось получить состояние заявки {order.order_id}: {e}')
+        if REPORT_STATUS.get(getattr(order.state, 'execution_report_status', None)) == OrderStatus.FILLED:
+            order.transition(OrderStatus.FILLED)
+        else:
+            order.transition(OrderStatus.EXPIRED)
+        self._finish(order)
+
+    def _finish(self, order: ManagedOrder) -> None:
+        self.wheel.cancel((order.order_id, TIMEOUT))
+        self.wheel.cancel((order.order_id, PRICE_CHECK))
+        self.orders.pop(order.order_id, None)
+        self._dirty.discard(order.order_id)
+        self.connect.order_tracker.discard(order.order_id)
+        logger.info(f'Заявка {order.order_id} завершена: {order.status.name}, '
+                    f'исполнено лотов {order.lots_executed}')
+        if not order.done.done():
+            order.done.set_result(order)
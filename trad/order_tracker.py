@@ -0,0 +1,134 @@
+"""
+Отслеживание исполнения заявок по событиям стрима сделок (trades_stream).
+О каждом событии по зарегистрированной заявке сразу узнаёт слушатель (OrderManager сверяет её на ближайшем шаге),
+а запрос состояния заявки через API остаётся медленной сверкой на случай пропущенных событий.
+"""
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from tinkoff.invest import OrderTrades, OrderState, OrderExecutionReportStatus
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = (
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED,
+    OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED,
+)
+
+
+class TrackedOrder:
+    """
+    Состояние одной заявки: исполненные сделки и последнее известное состояние из API.
+    """
+
+    def __init__(self, order_id: str, quantity: Optional[int] = None) -> None:
+        """
+        :param order_id: Биржевой id заявки.
+        :param quantity: Количество инструмента в заявке (в тех же единицах, что и quantity сделок стрима).
+        """
+        self.order_id = order_id
+        self.quantity = quantity
+        self.executed = 0
+        self.trade_ids: set[str] = set()
+        self.state: Optional[OrderState] = None
+
+    @property
+    def filled(self) -> bool:
+        if self.state is not None:
+            return self.state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL
+        return bool(self.quantity) and self.executed >= self.quantity
+
+    @property
+    def done(self) -> bool:
+        if self.state is not None and self.state.execution_report_status in FINAL_STATUSES:
+            return True
+        return self.filled
+
+
+class OrderTracker:
+    """
+    Реестр отслеживаемых заявок по order_id.
+    Исполнения могут прийти раньше, чем ответ на post_order, поэтому они сохраняются
+    и для ещё не зарегистрированных заявок (не больше max_unknown штук).
+    """
+
+    def __init__(self, max_unknown: int = 1000) -> None:
+        self.max_unknown = max_unknown
+        self._orders: OrderedDict[str, TrackedOrder] = OrderedDict()
+        self._registered: set[str] = set()
+        # Вызывается с order_id при каждом событии по заявке (например, OrderManager помечает заявку для сверки).
+        self.listener: Optional[Callable[[str], None]] = None
+
+    def _get_or_create(self, order_id: str) -> TrackedOrder:
+        order = self._orders.get(order_id)
+        if order is None:
+            order = TrackedOrder(order_id)
+            self._orders[order_id] = order
+            self._trim()
+        return order
+
+    def _trim(self) -> None:
+        unknown = len(self._orders) - len(self._registered)
+        if unknown <= self.max_unknown:
+            return
+        for order_id in list(self._orders):
+            if order_id not in self._registered:
+                del self._orders[order_id]
+                unknown -= 1
+                if unknown <= self.max_unknown:
+                    break
+
+    def register(self, order_id: str, quantity: Optional[int] = None) -> TrackedOrder:
+        """
+        Начинает отслеживание заявки. Уже пришедшие по ней исполнения сохраняются.
+        """
+        order = self._get_or_create(order_id)
+        order.quantity = quantity
+        self._registered.add(order_id)
+        if order.executed:
+            self._notify(order)
+        return order
+
+    def discard(self, order_id: str) -> None:
+        self._registered.discard(order_id)
+        self._orders.pop(order_id, None)
+
+    def get(self, order_id: str) -> Optional[TrackedOrder]:
+        return self._orders.get(order_id)
+
+    def on_order_trades(self, order_trades: OrderTrades) -> None:
+        """
+        Обрабатывает исполнение из trades_stream.
+        """
+        order = self._get_or_create(order_trades.order_id)
+        for trade in order_trades.trades:
+            if trade.trade_id in order.trade_ids:
+                continue
+            order.trade_ids.add(trade.trade_id)
+            order.executed += trade.quantity
+        logger.debug(f'Исполнение по заявке {order.order_id}: {order.executed}/{order.quantity}')
+        self._notify(order)
+
+    def on_order_state(self, order_state: OrderState, notify: bool = True) -> None:
+        """
+        Сохраняет состояние заявки.
+        :param order_state: Состояние заявки из стрима или из API.
+        :param notify: Сообщить слушателю о смене статуса. При сверке, которую делает сам слушатель, не нужно.
+        """
+        order = self._orders.get(order_state.order_id)
+        if order is None:
+            return
+        changed = (order.state is None
+                   or order.state.execution_report_status != order_state.execution_report_status
+                   or order.state.lots_executed != order_state.lots_executed)
+        order.state = order_state
+        if notify and changed:
+            self._notify(order)
+
+    def _notify(self, order: TrackedOrder) -> None:
+        if self.listener is not None and order.order_id in self._registered:
+            self.listener(order.order_id)
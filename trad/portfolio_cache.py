@@ -0,0 +1,165 @@
+"""
+Кэш состояния портфеля: общая стоимость, позиции по figi и заблокированные средства.
+Заполняется одним запросом при запуске, дальше обновляется событиями portfolio_stream и positions_stream,
+поэтому расчёт размера заявки и отчёты читают его без запросов к API.
+Каждое значение хранит время обновления, по нему видно, насколько данные свежие.
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from tinkoff.invest.utils import money_to_decimal, quotation_to_decimal
+
+if TYPE_CHECKING:
+    from tinkoff.invest import PortfolioPosition, PortfolioResponse, PositionData, PositionsFutures, PositionsResponse
+    from tinkoff.invest.async_services import AsyncServices
+
+logger = logging.getLogger(__name__)
+
+RUB = 'rub'
+
+
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+@dataclass
+class PositionState:
+    """
+    Позиция по инструменту: количество из портфеля, заблокированные заявками и свободные лоты из стрима позиций.
+    """
+    figi: str
+    quantity: Decimal = Decimal(0)
+    blocked: int = 0
+    balance: int = 0
+    position: Optional['PortfolioPosition'] = None
+    updated_at: Optional[datetime.datetime] = None
+
+
+class PortfolioCache:
+    """
+    Состояние портфеля одного счёта по событиям стримов.
+    """
+
+    def __init__(self, clock: Callable[[], datetime.datetime] = utc_now) -> None:
+        self.clock = clock
+        self.portfolio: Optional['PortfolioResponse'] = None
+        self.total_amount: Optional[Decimal] = None
+        self.total_updated_at: Optional[datetime.datetime] = None
+        self.blocked_margin: Decimal = Decimal(0)
+        self.available_money: Decimal = Decimal(0)
+        self.money_updated_at: Optional[datetime.datetime] = None
+        self.positions: dict[str, PositionState] = {}
+
+    def _position(self, figi: str) -> PositionState:
+        state = self.positions.get(figi)
+        if state is None:
+            state = self.positions[figi] = PositionState(figi)
+        return state
+
+    def apply_portfolio(self, portfolio: 'PortfolioResponse') -> None:
+        """
+        Применяет полный снимок портфеля (get_portfolio или событие portfolio_stream).
+        Инструменты, которых нет в снимке, считаются закрытыми.
+        """
+        now = self.clock()
+        self.portfolio = portfolio
+        self.total_amount = money_to_decimal(portfolio.total_amount_portfolio)
+        self.total_updated_at = now
+        present = set()
+        for position in portfolio.positions:
+            state = self._position(position.figi)
+            state.quantity = quotation_to_decimal(position.quantity)
+            state.position = position
+            state.updated_at = now
+            present.add(position.figi)
+        for figi, state in self.positions.items():
+            if figi not in present and state.position is not None:
+                state.quantity = Decimal(0)
+                state.position = None
+                state.updated_at = now
+
+    def apply_positions(self, data: 'PositionData') -> None:
+        """
+        Применяет изменение позиций из positions_stream: заблокированные и свободные лоты фьючерсов
+        и рублёвые средства (доступные и заблокированные под ГО и заявки).
+        """
+        now = self.clock()
+        self._apply_futures(data.futures, now)
+        for money in data.money:
+            if money.blocked_value.currency == RUB:
+                self.blocked_margin = money_to_decimal(money.blocked_value)
+                self.available_money = money_to_decimal(money.available_value)
+                self.money_updated_at = now
+
+    def apply_positions_response(self, response: 'PositionsResponse') -> None:
+        """
+        Применяет полный ответ get_positions.
+        """
+        now = self.clock()
+        self._apply_futures(response.futures, now)
+        self.available_money = sum((money_to_decimal(money) for money in response.money if money.currency == RUB),
+                                   Decimal(0))
+        self.blocked_margin = sum((money_to_decimal(money) for money in response.blocked if money.currency == RUB),
+                                  Decimal(0))
+        self.money_updated_at = now
+
+    def _apply_futures(self, futures: list['PositionsFutures'], now: datetime.datetime) -> None:
+        for future in futures:
+            state = self._position(future.figi)
+            state.blocked = future.blocked
+            state.balance = future.balance
+            state.updated_at = now
+
+    def on_stream(self, response: Any) -> None:
+        """
+        Обновляет кэш по сообщению portfolio_stream или positions_stream, пинги и подписки пропускаются.
+        """
+        if portfolio := getattr(response, 'portfolio', None):
+            self.apply_portfolio(portfolio)
+        if position := getattr(response, 'position', None):
+            self.apply_positions(position)
+
+    async def refresh(self, client: 'AsyncServices', account_id: str) -> None:
+        """
+        Загружает портфель и позиции запросами к API. Нужен один раз при запуске, дальше кэш ведут стримы.
+        """
+        portfolio, positions = await asyncio.gather(client.operations.get_portfolio(account_id=account_id),
+                                                    client.operations.get_positions(account_id=account_id))
+        self.apply_portfolio(portfolio)
+        self.apply_positions_response(positions)
+
+    def quantity(self, figi: str) -> Decimal:
+        state = self.positions.get(figi)
+        return state.quantity if state is not None else Decimal(0)
+
+    def blocked(self, figi: str) -> int:
+        state = self.positions.get(figi)
+        return state.blocked if state is not None else 0
+
+    def position(self, figi: str) -> Optional['PortfolioPosition']:
+        state = self.positions.get(figi)
+        return state.position if state is not None else None
+
+    def age(self, updated_at: Optional[datetime.datetime] = None) -> Optional[float]:
+        """
+        Возраст данных в секундах (по умолчанию – общей стоимости портфеля), None – данных ещё нет.
+        """
+        updated_at = updated_at or self.total_updated_at
+        if updated_at is None:
+            return None
+        return (self.clock() - updated_at).total_seconds()
+
+    def metrics(self) -> dict[str, float]:
+        age = self.age()
+        money_age = self.age(self.money_updated_at) if self.money_updated_at else None
+        return {'total_amount': float(self.total_amount or 0),
+                'blocked_margin': float(self.blocked_margin),
+                'positions': sum(1 for state in self.positions.values() if state.quantity),
+                'age': age if age is not None else -1.0,
+                'money_age': money_age if money_age is not None else -1.0}
@@ -0,0 +1,102 @@
+"""
+Логирование сообщений стрима рыночных данных без затрат на горячем пути.
+Сообщение превращается в строку только когда запись принята логгером и обработчиком (ленивое форматирование),
+а частые типы сообщений (последние цены, стаканы) логируются с прореживанием: каждое N-е сообщение типа.
+Настройка через переменные окружения:
+STREAM_LOG_LEVEL – уровень логгера trad.stream (по умолчанию INFO),
+STREAM_LOG_SAMPLING – прореживание по типам, например 'last_price=100,orderbook=100,candle=1'.
+"""
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any, Callable, Optional
+
+import utils as ut
+
+stream_logger = logging.getLogger('trad.stream')
+stream_logger.setLevel(os.getenv('STREAM_LOG_LEVEL', 'INFO').upper())
+
+# Поля MarketDataResponse в порядке проверки типа сообщения.
+MESSAGE_TYPES = (
+    'last_price', 'candle', 'orderbook', 'trade', 'trading_status', 'ping',
+    'subscribe_candles_response', 'subscribe_order_book_response', 'subscribe_trades_response',
+    'subscribe_info_response', 'subscribe_last_price_response',
+)
+DEFAULT_SAMPLING = {'last_price': 100, 'orderbook': 100, 'trade': 100, 'ping': 10}
+
+
+def parse_sampling(value: Optional[str]) -> dict[str, int]:
+    """
+    Разбирает строку вида 'last_price=100,candle=1'.
+    """
+    rates = dict(DEFAULT_SAMPLING)
+    if not value:
+        return rates
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        name, rate = item.split('=', 1)
+        rates[name.strip()] = max(1, int(rate))
+    return rates
+
+
+def message_type(msg: Any) -> str:
+    for name in MESSAGE_TYPES:
+        if getattr(msg, name, None):
+            return name
+    return 'other'
+
+
+class LazyMessage:
+    """
+    Откладывает форматирование до момента, когда обработчик лога действительно пишет запись.
+    Строка считается один раз, даже если запись пишут несколько обработчиков.
+    """
+    __slots__ = ('msg', 'render', '_text')
+
+    def __init__(self, msg: Any, render: Callable[[Any], str] = ut.market_data_response_to_string) -> None:
+        self.msg = msg
+        self.render = render
+        self._text: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = self.render(self.msg)
+        return self._text
+
+
+class StreamLogSampler:
+    """
+    Прореживание сообщений по типам: из каждых N сообщений типа логируется первое.
+    """
+
+    def __init__(self, rates: Optional[dict[str, int]] = None) -> None:
+        """
+        :param rates: Шаг прореживания по типам сообщений, 1 – логировать каждое.
+        """
+        self.rates = rates if rates is not None else parse_sampling(os.getenv('STREAM_LOG_SAMPLING'))
+        self.counters: dict[str, int] = {}
+
+    def accept(self, kind: str) -> bool:
+        rate = self.rates.get(kind, 1)
+        count = self.counters.get(kind, 0)
+        self.counters[kind] = count + 1
+        return count % rate == 0
+
+
+sampler = StreamLogSampler()
+
+
+def log_stream_message(msg: Any, level: int = logging.INFO, logger: logging.Logger = stream_logger,
+                       stream_sampler: Optional[StreamLogSampler] = None) -> bool:
+    """
+    Логирует сообщение стрима, если уровень включён и сообщение прошло прореживание.
+    :return: True, если запись передана логгеру.
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    if not (stream_sampler or sampler).accept(message_type(msg)):
+        return False
+    logger.log(level, '%s', LazyMessage(msg))
+    return True
@@ -0,0 +1,145 @@
+"""
+Общий надзор за стримами gRPC: переподключение с экспоненциальной задержкой и случайным разбросом,
+хук после переподключения и метрики по каждому стриму (время работы, число переподключений,
+количество и частота сообщений, возраст последнего сообщения).
+Стрим задаётся фабрикой, которая открывает его заново на каждой попытке, и приёмником сообщений.
+"""
+from __future__ import annotations
+
+import asyncio
+import inspect
+import logging
+import random
+import time
+from typing import Any, AsyncIterable, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Backoff:
+    """
+    Экспоненциальная задержка с полным случайным разбросом: случайное значение от 0 до min(cap, base * factor ** n).
+    """
+
+    def __init__(self, base: float = 1.0, factor: float = 2.0, cap: float = 60.0,
+                 rng: Callable[[float, float], float] = random.uniform) -> None:
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.rng = rng
+
+    def delay(self, attempt: int) -> float:
+        return self.rng(0, min(self.cap, self.base * self.factor ** attempt))
+
+
+class StreamStats:
+    """
+    Метрики одного стрима.
+    """
+
+    def __init__(self, name: str, clock: Callable[[], float] = time.monotonic) -> None:
+        self.name = name
+        self.clock = clock
+        self.connected = False
+        self.connected_at: Optional[float] = None
+        self.reconnects = 0
+        self.messages = 0
+        self.session_messages = 0
+        self.last_message_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def on_connect(self) -> None:
+        self.connected = True
+        self.connected_at = self.clock()
+        self.session_messages = 0
+
+    def on_message(self) -> None:
+        self.messages += 1
+        self.session_messages += 1
+        self.last_message_at = self.clock()
+
+    def on_disconnect(self, error: Optional[BaseException]) -> None:
+        self.connected = False
+        self.reconnects += 1
+        self.last_error = repr(error) if error else 'стрим завершился'
+
+    @property
+    def uptime(self) -> float:
+        """
+        Сколько секунд стрим работает без переподключения.
+        """
+        if not self.connected or self.connected_at is None:
+            return 0.0
+        return self.clock() - self.connected_at
+
+    @property
+    def rate(self) -> float:
+        """
+        Сообщений в секунду с момента последнего подключения.
+        """
+        uptime = self.uptime
+        return self.session_messages / uptime if uptime > 0 else 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        now = self.clock()
+        return {'connected': int(self.connected),
+                'uptime': self.uptime,
+                'reconnects': self.reconnects,
+                'messages': self.messages,
+                'rate': self.rate,
+                'last_message_age': now - self.last_message_at if self.last_message_at is not None else None,
+                'last_error': self.last_error}
+
+
+class StreamSupervisor:
+    """
+    Запускает стримы и поддерживает их открытыми.
+    """
+
+    def __init__(self, backoff: Optional[Backoff] = None) -> None:
+        self.backoff = backoff or Backoff()
+        self.stats: dict[str, StreamStats] = {}
+
+    async def run(self, name: str,
+                  factory: Callable[[], AsyncIterable | Awaitable[AsyncIterable]],
+                  sink: Callable[[Any], Any],
+                  on_reconnect: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+        """
+        Читает стрим и передаёт сообщения в sink. При ошибке или завершении стрим открывается заново.
+        :param name: Имя стрима для логов и метрик.
+        :param factory: Функция, открывающая стрим (может быть корутиной).
+        :param sink: Приёмник сообщения (функция или корутина).
+        :param on_reconnect: Корутина, вызываемая после переподключения до чтения сообщений.
+        """
+        stats = self.stats.setdefault(name, StreamStats(name))
+        attempt = 0
+        while True:
+            error: Optional[BaseException] = None
+            try:
+                stream = factory()
+                if inspect.isawaitable(stream):
+                    stream = await stream
+                stats.on_connect()
+                if stats.reconnects:
+                    logger.info(f'Стрим {name} переподключён (переподключений: {stats.reconnects})')
+                    if on_reconnect is not None:
+                        await on_reconnect()
+                async for msg in stream:
+                    stats.on_message()
+                    attempt = 0
+                    result = sink(msg)
+                    if inspect.isawaitable(result):
+                        await result
+            except asyncio.CancelledError:
+                stats.connected = False
+                raise
+            except Exception as e:
+                error = e
+            stats.on_disconnect(error)
+            delay = self.backoff.delay(attempt)
+            attempt += 1
+            logger.error(f'Стрим {name} прерван: {stats.last_error}. Переподключение через {delay:.1f} сек.')
+            await asyncio.sleep(delay)
+
+    def metrics(self) -> dict[str, dict[str, Any]]:
+        return {name: stats.to_dict() for name, stats in self.stats.items()}
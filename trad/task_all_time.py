@@ -1,87 +1,126 @@
 from __future__ import annotations
 
 import asyncio
+import datetime
+import functools
+import inspect
 import logging
 import os
-import shelve
 from decimal import Decimal
 from typing import Optional
 from typing import TYPE_CHECKING
 
 from aiogram import Bot
 from tinkoff.invest import MarketDataResponse, PortfolioStreamResponse, PositionsStreamResponse, TradesStreamResponse, \
-    OrderState, OrderDirection, OrderType, OrderExecutionReportStatus, GetFuturesMarginResponse, \
-    PostOrderResponse, LastPrice, Quotation, PriceType, ReplaceOrderRequest
+    OrderState, OrderDirection, OrderType, GetFuturesMarginResponse, \
+    PostOrderResponse, LastPrice, Quotation, PriceType, ReplaceOrderRequest, Candle, Future, HistoricCandle, \
+    CandleInterval
 from tinkoff.invest.utils import quotation_to_decimal, money_to_decimal, decimal_to_quotation
 
 import utils as ut
 
+from bot.notifier import Notifier
 from data_create.historic_future import HistoricInstrument
 from trad.connect_tinkoff import ConnectTinkoff
+from trad.context_registry import registry
+from trad.executors import lag_monitor, run_cpu, run_io
+from trad.instrument_names import instrument_names
+from trad.market_actors import ActorDispatcher
+from trad.metrics import metrics
+from trad.order_manager import ManagedOrder, OrderStatus
+from trad.stream_logging import log_stream_message, message_type
 
 if TYPE_CHECKING:
     from strategy.docnhian import StrategyContext
 
 CHAT_ID = os.getenv('CHAT_ID')
 ACCOUNT_ID = os.getenv('ACCOUNT_ID')
+# Запас до начала разрыва стрима при догрузке минутных свечей.
+CATCH_UP_MARGIN = datetime.timedelta(minutes=1)
+# Сколько инструментов одновременно загружают свечи при обновлении данных (ограничение по лимитам API).
+UPDATE_DATA_CONCURRENCY = int(os.getenv('UPDATE_DATA_CONCURRENCY', 4))
+# Возраст стоимости портфеля в секундах, после которого расчёт размера заявки сопровождается предупреждением.
+PORTFOLIO_STALE_SEC = float(os.getenv('PORTFOLIO_STALE_SEC', 600))
 
 dict_status_instrument = {}
-global_info_dict = {}
 logger = logging.getLogger(__name__)
 
 
 async def start_bot(connect: ConnectTinkoff, bot: Bot):
     await connect.connection()
     await bot.send_message(chat_id=CHAT_ID, text='Подключение установлено')
-    with shelve.open('data_strategy_state/dict_strategy_state') as db:
-        db: dict[str, 'StrategyContext']
-        instruments_id = [value.history_instrument.instrument_info.uid for value in db.values()]
-        figis = [value.history_instrument.instrument_info.figi for value in db.values()]
+    await run_io(registry.load)
+    await run_io(instrument_names.load)
+    registry.start()
+    instruments_id = [value.history_instrument.instrument_info.uid for value in registry.values()]
+    figis = [value.history_instrument.instrument_info.figi for value in registry.values()]
 
     await update_data(connect, bot)
-    portfolio = await connect.get_portfolio_by_id(ACCOUNT_ID)
-    list_corutin = [connect.figi_to_name(figi) for figi in figis]
-    await asyncio.gather(*list_corutin)
-    global_info_dict['portfolio_size'] = money_to_decimal(portfolio.total_amount_portfolio)
+    await connect.portfolio_cache.refresh(connect.client, ACCOUNT_ID)
+    await connect.figi_names(figis)
+    await connect.margin_cache.prefetch(connect.client, instruments_id)
     await connect.add_subscribe_last_price(instruments_id)
     await connect.add_subscribe_status_instrument(instruments_id)
+    await connect.add_subscribe_candle(instruments_id, '1m')
 
 
-update_tasks: dict[str, asyncio.Task] = {}
 dict_last_price: dict[str, Quotation] = {}
+# Акторы обработки последних цен по figi, создаются в processing_stream.
+price_actors: ActorDispatcher | None = None
+
+
+def register_metrics(connect: ConnectTinkoff, bot: Bot) -> None:
+    """
+    Подключает к метрикам показатели компонентов, которые считаются в момент запроса.
+    :param connect: Класс для работы с Tinkoff API.
+    :param bot: Телеграм бот или очередь уведомлений.
+    """
+    metrics.add_source('actors', lambda: price_actors.metrics() if price_actors is not None else {})
+    metrics.add_source('streams', connect.supervisor.metrics)
+    metrics.add_source('channels', lambda: connect.pool.metrics() if connect.pool is not None else {})
+    metrics.add_source('margin_cache', lambda: {'hits': connect.margin_cache.hits,
+                                                'misses': connect.margin_cache.misses})
+    metrics.add_source('order_manager', lambda: {'reconcile_calls': connect.order_manager.reconcile_calls,
+                                                 'open_orders': len(connect.order_manager.orders)})
+    metrics.add_source('loop_lag', lag_monitor.metrics)
+    metrics.add_source('portfolio', connect.portfolio_cache.metrics)
+    if isinstance(bot, Notifier):
+        metrics.add_source('notifier', lambda: {'sent': bot.sent, 'dropped': bot.dropped,
+                                                'pending': bot.pending})
 
 
 async def processing_stream(connect: ConnectTinkoff, bot: Bot) -> None:
     """
     Обработка потока данных котировок.
+    Последние цены передаются акторам инструментов, свечи и статусы обрабатываются сразу.
     :param connect: Класс для работы с Tinkoff API.
     :param bot: Телеграм бот.
     :return:
     """
+    global price_actors
     if connect.market_data_stream:
+        price_actors = ActorDispatcher(lambda price: update_strategy_by_price(price, connect, bot))
+        connect.on_market_data_reconnect = lambda since: catch_up_prices(connect, since)
         while True:
             try:
                 msg: MarketDataResponse = await connect.queue.get()
-                logger.info(f'{ut.market_data_response_to_string(msg)}')
+                log_stream_message(msg)
+                metrics.inc('stream_messages', message_type(msg))
                 if last_price := msg.last_price:  # если есть последняя цена
-                    instrument_figi = last_price.figi
-                    current_task = update_tasks.get(instrument_figi)
-                    if current_task and not current_task.done():  # если задача обновления статуса уже запущена.
-                        logger.debug(f'{instrument_figi} задача уже запущена')
+                    actor = price_actors.dispatch(last_price.figi, last_price)
+                    if actor.busy:
                         # Кладем последний цену в словарь обновления,
                         # для возможности управления выставлением ордера в зависимости от новой цены инструмента.
-                        dict_last_price[instrument_figi] = last_price.price
-                        logger.debug(f'{dict_last_price} словарь обновлен')
-                    else:  # если задача еще не запущена
-                        # Запускаем задачу обновления
-                        task = asyncio.create_task(update_strategy_by_price(last_price, connect, bot))
-                        update_tasks[instrument_figi] = task  # Добавляем задачу в словарь
-                        # Создаем callback, который удаляет задачу из словаря при завершении задачи.
-                        task.add_done_callback(lambda t, key=instrument_figi: update_tasks.pop(key))
+                        dict_last_price[last_price.figi] = last_price.price
+
+                if candle := msg.candle:
+                    update_indicators_by_candle(candle)
 
                 if msg.trading_status:
                     msg_str = ut.market_data_response_to_string(msg) + '\n'
                     dict_status_instrument[msg.trading_status.instrument_uid] = msg.trading_status.trading_status
+                    # После смены статуса торгов (клиринг, приостановка) ГО и шаг цены могли измениться.
+                    connect.margin_cache.invalidate(msg.trading_status.instrument_uid)
                     await bot.send_message(chat_id=CHAT_ID, text=msg_str)
 
                 if msg.subscribe_info_response or msg.subscribe_last_price_response:
@@ -91,6 +130,71 @@ async def processing_stream(connect: ConnectTinkoff, bot: Bot) -> None:
                 logger.exception(f'В функции обработки стрима произошла ошибка: {e}')
 
 
+def gap_prices(candles: list[HistoricCandle], last_price: LastPrice) -> list[LastPrice]:
+    """
+    Цены, которые нужно прогнать через стратегию после разрыва стрима:
+    максимум и минимум свечей разрыва в порядке их появления и затем последняя цена.
+    """
+    prices = []
+    if candles:
+        high = max(candles, key=lambda candle: quotation_to_decimal(candle.high))
+        low = min(candles, key=lambda candle: quotation_to_decimal(candle.low))
+        extremes = sorted([(high.time, high.high), (low.time, low.low)], key=lambda item: item[0])
+        prices = [LastPrice(figi=last_price.figi, price=price, time=moment, instrument_uid=last_price.instrument_uid)
+                  for moment, price in extremes]
+    return prices + [last_price]
+
+
+async def catch_up_prices(connect: ConnectTinkoff, since: datetime.datetime) -> int:
+    """
+    Догружает цены за время разрыва стрима рыночных данных: последние цены и минутные свечи разрыва
+    по всем подписанным инструментам. Экстремумы разрыва передаются акторам инструментов раньше живых цен,
+    чтобы не пропустить пробой или стоп, случившийся во время переподключения.
+    :param since: Время последнего сообщения перед разрывом.
+    :return: Количество инструментов, по которым выполнена догрузка.
+    """
+    uids = list(connect.instruments_stream)
+    if not uids or price_actors is None:
+        return 0
+    now = datetime.datetime.now(datetime.timezone.utc)
+    response = await connect.client.market_data.get_last_prices(instrument_id=uids)
+
+    async def candles_for(last_price: LastPrice) -> list[HistoricCandle]:
+        result = await connect.client.market_data.get_candles(instrument_id=last_price.instrument_uid,
+                                                              from_=since - CATCH_UP_MARGIN,
+                                                              to=now,
+                                                              interval=CandleInterval.CANDLE_INTERVAL_1_MIN)
+        return result.candles
+
+    last_prices = [last_price for last_price in response.last_prices if last_price.figi in registry]
+    results = await asyncio.gather(*(candles_for(last_price) for last_price in last_prices), return_exceptions=True)
+    for last_price, candles in zip(last_prices, results):
+        if isinstance(candles, BaseException):
+            logger.error(f'Не удалось загрузить свечи разрыва {last_price.figi}: {candles}')
+            candles = []
+        price_actors.replay(last_price.figi, gap_prices(candles, last_price))
+    logger.info(f'Догрузка цен после разрыва с {since:%H:%M:%S}: {len(last_prices)} инструментов')
+    return len(last_prices)
+
+
+def update_indicators_by_candle(candle: Candle) -> None:
+    """
+    Обновляет индикаторы стратегии по свече из стрима.
+    При закрытии бара уровни пробоя и ATR пересчитываются без загрузки истории.
+    """
+    strategy_context = registry.get(candle.figi)
+    if strategy_context is None:
+        return
+    if strategy_context.on_candle(candle.time,
+                                  float(quotation_to_decimal(candle.high)),
+                                  float(quotation_to_decimal(candle.low)),
+                                  float(quotation_to_decimal(candle.close))):
+        registry.mark_dirty(candle.figi)
+        logger.info(f'{strategy_context.history_instrument.instrument_info.name} обновлены уровни: '
+                    f'long {strategy_context.breakout_level_long}, short {strategy_context.breakout_level_short}, '
+                    f'atr {strategy_context.history_instrument.atr}')
+
+
 async def update_strategy_by_price(last_price: LastPrice, connect: ConnectTinkoff, bot: Bot):
     strategy_context = get_context_by_figi(last_price.figi)
     if strategy_context:
@@ -102,21 +206,20 @@ async def update_strategy_by_price(last_price: LastPrice, connect: ConnectTinkof
             await bot.send_message(chat_id=CHAT_ID, text=result)
 
 
+@metrics.timed('registry_set')
 def save_context_by_figi(figi: str, strategy_context: 'StrategyContext'):
-    with shelve.open('data_strategy_state/dict_strategy_state') as db:
-        db[figi] = strategy_context
+    registry.set(figi, strategy_context)
 
 
+@metrics.timed('registry_get')
 def get_context_by_figi(figi: str) -> Optional['StrategyContext']:
-    try:
-        with shelve.open('data_strategy_state/dict_strategy_state') as db:
-            strategy_context: 'StrategyContext' = db[figi]
-        return strategy_context
-    except KeyError:
+    strategy_context = registry.get(figi)
+    if strategy_context is None:
         logger.error(f'Не удалось найти стратегию по figi: {figi}')
-        return
+    return strategy_context
 
 
+@metrics.timed()
 async def processing_last_price(last_price: LastPrice,
                                 context: 'StrategyContext',
                                 connect: ConnectTinkoff
@@ -139,32 +242,71 @@ async def processing_last_price(last_price: LastPrice,
 async def processing_stream_portfolio(connect: ConnectTinkoff, bot: Bot):
     while True:
         response: PortfolioStreamResponse | PositionsStreamResponse = await connect.queue_portfolio.get()
+        connect.portfolio_cache.on_stream(response)
+        metrics.inc('stream_messages', 'portfolio' if isinstance(response, PortfolioStreamResponse) else 'positions')
         if isinstance(response, PortfolioStreamResponse):
-            text, portfolio_amount = ut.psr_to_string(response)
+            text, _ = ut.psr_to_string(response)
             if not response.ping:
                 await bot.send_message(chat_id=CHAT_ID, text=text)
-            if portfolio_amount:
-                global_info_dict['portfolio_size'] = portfolio_amount
         if isinstance(response, PositionsStreamResponse):
             text = ut.position_to_string(response)
             if not response.ping:
                 await bot.send_message(CHAT_ID, text)
 
 
-async def update_data(connect: ConnectTinkoff, bot: Bot):
-    with shelve.open('data_strategy_state/dict_strategy_state') as db:
-        db: dict[str, 'StrategyContext']
-        text = ''
-        for figi, context_strategy in db.items():
-            historic, info = await connect.get_candles_from_uid(
-                uid=context_strategy.history_instrument.instrument_info.uid,
-                interval='1d'
-            )
-            new_historic = HistoricInstrument(instrument=info, list_candles=historic)
-            path = ut.create_folder_and_save_historic_instruments(new_historic)
-            context_strategy.update_data(new_historic)
-            db[figi] = context_strategy
-            text += f'Данные для <b>{new_historic.instrument_info.name}</b> обновлены и сохранены в {path}\n\n'
+def build_historic_instrument(info: Future, candles: list[HistoricCandle]) -> HistoricInstrument:
+    return HistoricInstrument.from_candles(info, candles)
+
+
+async def refresh_instrument(connect: ConnectTinkoff, uid: str, semaphore: asyncio.Semaphore) -> HistoricInstrument:
+    """
+    Загружает свечи инструмента и строит по ним индикаторы в пуле процессов.
+    :param uid: uid инструмента.
+    :param semaphore: Ограничение числа одновременных загрузок.
+    """
+    async with semaphore:
+        historic, info = await connect.get_candles_from_uid(uid=uid, interval='1d')
+    return await run_cpu(build_historic_instrument, info, historic)
+
+
+async def refresh_margins(connect: ConnectTinkoff, bot: Bot) -> None:
+    """
+    Перезагружает ГО и шаг цены всех инструментов после клиринга, чтобы выставление заявки не ждало API.
+    """
+    uids = [context.history_instrument.instrument_info.uid for context in registry.values()]
+    count = await connect.margin_cache.prefetch(connect.client, uids)
+    logger.info(f'ГО обновлено для {count} из {len(uids)} инструментов')
+
+
+async def update_data(connect: ConnectTinkoff, bot: Bot, concurrency: int | None = None):
+    """
+    Обновляет исторические данные и индикаторы всех инструментов.
+    Свечи загружаются параллельно, а результаты применяются к контекстам одной пачкой в конце.
+    :param concurrency: Максимальное число одновременных загрузок свечей.
+    """
+    semaphore = asyncio.Semaphore(concurrency or UPDATE_DATA_CONCURRENCY)
+    contexts = list(registry.items())
+    results = await asyncio.gather(
+        *(refresh_instrument(connect, context.history_instrument.instrument_info.uid, semaphore)
+          for _, context in contexts),
+        return_exceptions=True
+    )
+
+    text = ''
+    for (figi, context_strategy), new_historic in zip(contexts, results):
+        if isinstance(new_historic, BaseException):
+            logger.error(f'Не удалось обновить данные {context_strategy.history_instrument.instrument_info.name}: '
+                         f'{new_historic}')
+            text += (f'Не удалось обновить данные для '
+                     f'<b>{context_strategy.history_instrument.instrument_info.name}</b>: {new_historic}\n\n')
+            continue
+        if figi not in registry:
+            continue
+        # Свечи уже сохранены в хранилище при загрузке (sync_candles).
+        path = connect.candle_store.path(new_historic.instrument_info.uid, '1d')
+        context_strategy.update_data(new_historic)
+        registry.mark_dirty(figi)
+        text += f'Данные для <b>{new_historic.instrument_info.name}</b> обновлены и сохранены в {path}\n\n'
 
     if text:
         await bot.send_message(chat_id=CHAT_ID, text=text)
@@ -174,10 +316,10 @@ async def update_data(connect: ConnectTinkoff, bot: Bot):
 
 async def conclusion_in_day(connect: ConnectTinkoff, bot: Bot):
     if connect.client:
-        with_draw, portfolio = await asyncio.gather(
-            connect.client.operations.get_withdraw_limits(account_id=ACCOUNT_ID),
-            connect.client.operations.get_portfolio(account_id=ACCOUNT_ID)
-        )
+        if connect.portfolio_cache.portfolio is None:
+            await connect.portfolio_cache.refresh(connect.client, ACCOUNT_ID)
+        portfolio = connect.portfolio_cache.portfolio
+        with_draw = await connect.client.operations.get_withdraw_limits(account_id=ACCOUNT_ID)
         string = '<b>Данные по позициям</b>\n'
         if positions := portfolio.positions:
             for pos in positions:
@@ -191,7 +333,8 @@ async def conclusion_in_day(connect: ConnectTinkoff, bot: Bot):
 
         string += (f'<b>Общая информация по портфелю</b>\n'
                    f'Доходность портфеля: <b>{quotation_to_decimal(portfolio.expected_yield):.2f}%</b>\n'
-                   f'Общая стоимость портфеля: <b>{money_to_decimal(portfolio.total_amount_portfolio):.2f}</b>\n')
+                   f'Общая стоимость портфеля: <b>{money_to_decimal(portfolio.total_amount_portfolio):.2f}</b>\n'
+                   f'Данные портфеля обновлены {connect.portfolio_cache.age():.0f} сек. назад\n')
 
         text = ''
         text += (f'Массив валютных позиций портфеля:'
@@ -205,27 +348,24 @@ async def conclusion_in_day(connect: ConnectTinkoff, bot: Bot):
         await bot.send_message(chat_id=CHAT_ID, text=text)
 
 
-dict_queue: dict[str, asyncio.Queue] = {}
-
-
 async def processing_trades_stream(connect: ConnectTinkoff, bot: Bot):
     """
     Обрабатывает стрим ордеров.
+    Исполнения передаются в трекер заявок, чтобы ожидающие их корутины просыпались сразу.
     :param connect: Класс соединения с api Tinkoff
     :param bot: Телеграмм бот
     :return:
     """
     while True:
         trades_stream_response: TradesStreamResponse = await connect.queue_order.get()
+        metrics.inc('stream_messages', 'order_trades' if trades_stream_response.order_trades else 'ping')
         if order_trades := trades_stream_response.order_trades:
-            if order_trades.figi not in dict_queue:
-                logger.debug(f'Создана очередь для {order_trades.figi}')
-                dict_queue[order_trades.figi] = asyncio.Queue()
-            dict_queue[order_trades.figi].put_nowait(order_trades)
+            connect.order_tracker.on_order_trades(order_trades)
             await bot.send_message(chat_id=CHAT_ID, text=ut.tsr_to_string(trades_stream_response))
 
 
-def compare_price(new_price: Quotation, order_state: OrderState, atr: Decimal, context: 'StrategyContext') -> bool:
+def compare_price(new_price: Quotation, order_state: OrderState | PostOrderResponse, atr: Decimal,
+                  context: 'StrategyContext') -> bool:
     min_increment_amount = quotation_to_decimal(
         context.history_instrument.instrument_info.min_price_increment_amount)
     min_increment = quotation_to_decimal(context.history_instrument.instrument_info.min_price_increment)
@@ -244,6 +384,68 @@ def compare_price(new_price: Quotation, order_state: OrderState, atr: Decimal, c
         return new_price <= (last_price - (atr / Decimal(2)))
 
 
+def track_order(connect: ConnectTinkoff, context: 'StrategyContext', order_id: str, lots: int) -> None:
+    """
+    Регистрирует заявку в трекере исполнений стрима сделок.
+    """
+    connect.order_tracker.register(order_id, lots * (context.history_instrument.instrument_info.lot or 1))
+
+
+async def reprice_order(connect: ConnectTinkoff, context: 'StrategyContext', order: ManagedOrder,
+                        price: Decimal, min_price_increment: Decimal) -> Optional[PostOrderResponse]:
+    """
+    Переставляет заявку, если цена рынка ушла от неё. Вызывается OrderManager по таймеру проверки цены.
+    :return: Ответ на переставленную заявку или None, если переставлять не нужно.
+    """
+    figi = context.history_instrument.instrument_info.figi
+    if figi not in dict_last_price or not compare_price(new_price=dict_last_price[figi],
+                                                        order_state=order.state,
+                                                        atr=context.history_instrument.atr,
+                                                        context=context):
+        return None
+    # Снимок заявки мог устареть (частичное исполнение ещё не сверено), объём новой заявки считается по свежему.
+    await connect.order_manager.refresh(order)
+    if order.final:
+        return None
+    state = order.state
+    new_order = await replace_order(connect, context, order.order_id, state, price, min_price_increment)
+    track_order(connect, context, new_order.order_id, state.lots_requested - state.lots_executed)
+    return new_order
+
+
+async def manage_order(connect: ConnectTinkoff, context: 'StrategyContext', result: PostOrderResponse, lots: int,
+                       price: Decimal, min_price_increment: Decimal, timeout: float,
+                       retry_interval: float) -> ManagedOrder:
+    """
+    Передаёт выставленную заявку в OrderManager и ждёт её итога.
+    :param timeout: Через сколько секунд снять неисполненную заявку.
+    :param retry_interval: Интервал проверки цены рынка для переставления заявки.
+    """
+    track_order(connect, context, result.order_id, lots)
+    order = await connect.order_manager.submit(
+        result.order_id, result, timeout=timeout, price_check_interval=retry_interval,
+        reprice=lambda managed: reprice_order(connect, context, managed, price, min_price_increment)
+    )
+    return await order.done
+
+
+def hold_unary_channel(func):
+    """
+    Держит аренду унарного канала connect, пока выполняется функция работы с заявкой.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        connect: ConnectTinkoff = signature.bind(*args, **kwargs).arguments['connect']
+        async with connect.lease():
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+@metrics.timed('place_order_with_status_check')
+@hold_unary_channel
 async def place_order_with_status_check(connect: ConnectTinkoff,
                                         context: 'StrategyContext',
                                         price: Decimal,
@@ -253,20 +455,22 @@ async def place_order_with_status_check(connect: ConnectTinkoff,
                                         ) -> Optional[list[OrderState]]:
     """
     Выставляет ордер и ждёт его подтверждения.
+    Заявка передаётся в OrderManager: её состояние сверяется общим циклом по событиям стрима сделок
+    и пакетным get_orders, таймаут и проверку цены ведёт колесо таймеров.
     :param connect: объект подключения (например, ConnectTinkoff)
     :param context: объект StrategyContext для текущего инструмента.
     :param price: Цена, по которой выставляется ордер.
     :param long: Направление ордера (True - лонг, False - шорт).
-    :param count: Кол-во попыток подтверждения ордера.
-    :param retry_interval: Интервал между повторными попытками (в секундах)
+    :param count: Кол-во интервалов ожидания подтверждения ордера.
+    :param retry_interval: Интервал проверки цены рынка (в секундах)
     :return: статус ордера или ошибка, если ордер отменён/не принят.
     """
     order_id = ut.generate_order_id()
-    if 'portfolio_size' in global_info_dict:
-        portfolio_size = global_info_dict['portfolio_size']
-    else:
-        portfolio_size = await connect.get_portfolio_by_id(ACCOUNT_ID)
-        portfolio_size = money_to_decimal(portfolio_size.total_amount_portfolio)
+    portfolio_size = connect.portfolio_cache.total_amount
+    if portfolio_size is None:
+        raise Exception('Стоимость портфеля ещё не получена, заявка не выставлена')
+    if (age := connect.portfolio_cache.age()) > PORTFOLIO_STALE_SEC:
+        logger.warning(f'Стоимость портфеля обновлялась {age:.0f} сек. назад, размер заявки может быть неточным')
 
     price_rub_point, price_in_rub, min_price_increment = await get_rub_price(connect, context, price)
     # Гарантирует что, цена будет кратна минимальному шагу.
@@ -288,102 +492,24 @@ async def place_order_with_status_check(connect: ConnectTinkoff,
                 f' на {order_params["quantity"]} лотов по цене {decimal_to_quotation(Decimal(price))}')
     # logger.info(f"params: {'\n'.join(f'{k}: {v}' for k, v in order_params.items())}")
     result: PostOrderResponse = await connect.post_order(**order_params)
-    order_response_id = result.order_id
     logger.info(f'Получен ответ по выставленному поручению'
                 f' {context.history_instrument.instrument_info.name} {result.execution_report_status}')
 
-    await asyncio.sleep(10)
-    list_order_state = []
-    order_state = None
-    for i in range(count):
-        try:
-            logger.info(f'Ждем подтверждения ордера {count}({i}) раз с интервалом {retry_interval} сек.')
-            order_state: OrderState = await connect.client.orders.get_order_state(order_id=order_response_id,
-                                                                                  account_id=ACCOUNT_ID)
-            # Обработка успешно выполненного ордера
-            if order_state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL:
-                logger.info(f'Заявка выполнена {order_state}')
-                list_order_state.append(order_state)
-                return list_order_state
-            # Обработка нового ордера, без выполненных лотов
-            elif order_state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW:
-                print(dict_last_price)
-                if context.history_instrument.instrument_info.figi in dict_last_price:
-                    if compare_price(new_price=dict_last_price[context.history_instrument.instrument_info.figi],
-                                     order_state=order_state,
-                                     atr=context.history_instrument.atr,
-                                     context=context):
-                        new_order = await replace_order(connect, context,
-                                                        order_response_id, order_state,
-                                                        price, min_price_increment)
-                        order_response_id = new_order.order_id
-                        list_order_state.append(order_state)
-                        continue
-                logger.info(f'Заявка ожидает выполнения {order_state}, повторяем попытку через {retry_interval} сек.')
-                await asyncio.sleep(retry_interval)
-                continue
-            # Обработка частично выполненного ордера
-            elif (order_state.execution_report_status ==
-                  OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL):
-                if context.history_instrument.instrument_info.figi in dict_last_price:
-                    if compare_price(new_price=dict_last_price[context.history_instrument.instrument_info.figi],
-                                     order_state=order_state,
-                                     atr=context.history_instrument.atr,
-                                     context=context):
-                        new_order = await replace_order(connect, context,
-                                                        order_response_id, order_state,
-                                                        price, min_price_increment)
-                        order_response_id = new_order.order_id
-                        list_order_state.append(order_state)
-                        continue
-                logger.info(f'Заявка частично выполнена {order_state}, повторяем попытку через {retry_interval} сек.')
-                logger.info(f'Выполнено лотов {order_state.lots_executed} / {order_state.lots_requested}')
-                await asyncio.sleep(retry_interval)
-                continue
-            # Обработка отмененного ордера.
-            elif order_state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED:
-                logger.info(f'Заявка отменена {order_state.execution_report_status.name}')
-                if order_state.lots_executed > 0:
-                    logger.info(f'Выполнено лотов {order_state.lots_executed} / {order_state.lots_requested}')
-                    list_order_state.append(order_state)
-                    return list_order_state
-                else:
-                    logger.info(f'Заявка отменена {order_state.execution_report_status.name}')
-                    logger.info(f'Выполнено 0 лотов')
-                    raise Exception(f'Заявка не выполнена {order_state.execution_report_status.name}')
-            # Обработка отклоненного ордера.
-            elif order_state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED:
-                logger.info(f'Заявка отклонена {order_state.execution_report_status.name}')
-                raise Exception(f'Заявка отклонена {order_state.execution_report_status.name}')
-
-        # Обработка ошибок во время выставления ордера.
-        except Exception as e:
-            if order_state:
-                if order_state.lots_executed > 0:
-                    logger.info(f'Выполнено лотов {order_state.lots_executed} / {order_state.lots_requested}')
-                    logger.error(f'При ожидании заявки произошла ошибка {e}')
-                    list_order_state.append(order_state)
-                    return list_order_state
-                else:
-                    raise Exception(f'Заявка не выполнена {e}')
-    # Обработка ситуации когда бот не дождался выполнения заявки.
-    else:
-        logger.info(f'Заявка не выполнена за {count * retry_interval} сек.')
-        try:
-            time_cancel = await connect.client.orders.cancel_order(account_id=ACCOUNT_ID, order_id=order_response_id)
-            logger.info(f'Заявка на {context.history_instrument.instrument_info.name} '
-                        f'{order_state.lots_executed} / {order_state.lots_requested} '
-                        f'лотов отменена в {time_cancel}')
-        except Exception as e:
-            logger.error(f'При отмене заявки произошла ошибка {e}')
-        if order_state.lots_executed > 0:
-            logger.info(f'Выполнено лотов {order_state.lots_executed} / {order_state.lots_requested}')
-            list_order_state.append(order_state)
-            return list_order_state
-        else:
-            raise Exception(f'Заявка не выполнена за {count * retry_interval} сек.')
-
-
+    order = await manage_order(connect, context, result, order_params['quantity'], price, min_price_increment,
+                               timeout=count * retry_interval, retry_interval=retry_interval)
+    if order.status == OrderStatus.FILLED:
+        logger.info(f'Заявка выполнена {order.state}')
+        return order.history + [order.state]
+    if order.lots_executed > 0:
+        logger.info(f'Выполнено лотов {order.lots_executed} / {order.state.lots_requested}')
+        return order.history + [order.state]
+    if order.status == OrderStatus.EXPIRED:
+        raise Exception(f'Заявка не выполнена за {count * retry_interval} сек.')
+    raise Exception(f'Заявка не выполнена {order.status.name}')
+
+
+@metrics.timed('order_for_close_position')
+@hold_unary_channel
 async def order_for_close_position(context: 'StrategyContext', connect: ConnectTinkoff,
                                    price: Decimal, count: int = 300,
                                    retry_interval=20) -> Optional[list[OrderState]]:
@@ -411,95 +537,17 @@ async def order_for_close_position(context: 'StrategyContext', connect: ConnectT
     result = await connect.post_order(**order_params)
     logger.info(f'Получен ответ по выставленному поручению'
                 f' {context.history_instrument.instrument_info.name} {result.execution_report_status}')
-    order_response_id = result.order_id
-    list_order_state = []
-    order_state = None
-    await asyncio.sleep(retry_interval)
-    for i in range(count):
-        logger.info(f'Ждем подтверждения ордера для закрытия позиции {count}({i}) '
-                    f'раз с интервалом {retry_interval} сек.')
-        try:
-            order_state = await connect.client.orders.get_order_state(order_id=order_response_id,
-                                                                      account_id=ACCOUNT_ID)
-            if order_state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL:
-                logger.info(f'Позиция {context.history_instrument.instrument_info.name} закрыта')
-                list_order_state.append(order_state)
-                return list_order_state
-
-            elif order_state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED:
-                logger.info(f'Закрытие позиции: Заявка отклонена {order_state.execution_report_status.name}')
-                raise Exception(f'Закрытие позиции: Заявка отклонена {order_state.execution_report_status.name}')
-
-            elif order_state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED:
-                logger.info(f'Закрытие позиции: Заявка отменена {order_state.execution_report_status.name}')
-                if order_state.lots_executed > 0:
-                    list_order_state.append(order_state)
-                    logger.info(f'Закрытие позиции: Позиция {context.history_instrument.instrument_info.name} закрыта'
-                                f'не полностью {order_state.lots_executed} / {order_state.lots_requested} лотов')
-                    list_order_state.append(False)
-                    return list_order_state
-                else:
-                    raise Exception(f'Закрытие позиции: Заявка отменена {order_state.execution_report_status.name}')
-
-            elif order_state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW:
-                if context.history_instrument.instrument_info.figi in dict_last_price:
-                    if compare_price(new_price=dict_last_price[context.history_instrument.instrument_info.figi],
-                                     order_state=order_state,
-                                     atr=context.history_instrument.atr,
-                                     context=context):
-                        new_order = await replace_order(connect=connect, context=context,
-                                                        order_response_id=order_response_id,
-                                                        order_state=order_state, price=price,
-                                                        min_price_increment=min_price_increment)
-                        order_response_id = new_order.order_id
-                        list_order_state.append(order_state)
-                        await asyncio.sleep(retry_interval)
-                        continue
-                logger.info(f'Закрытие позиции: Заявка ожидает выполнения {order_state.execution_report_status.name}')
-                await asyncio.sleep(retry_interval)
-                continue
-
-            elif (order_state.execution_report_status ==
-                  OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL):
-                if context.history_instrument.instrument_info.figi in dict_last_price:
-                    if compare_price(new_price=dict_last_price[context.history_instrument.instrument_info.figi],
-                                     order_state=order_state,
-                                     atr=context.history_instrument.atr,
-                                     context=context):
-                        new_order = await replace_order(connect=connect, context=context,
-                                                        order_response_id=order_response_id,
-                                                        order_state=order_state, price=price,
-                                                        min_price_increment=min_price_increment)
-                        order_response_id = new_order.order_id
-                        list_order_state.append(order_state)
-                        await asyncio.sleep(retry_interval)
-                        continue
-                logger.info(f'Закрытие позиции: Заявка частично выполнена {order_state.execution_report_status.name}')
-                await asyncio.sleep(retry_interval)
-                continue
-
-        except Exception as e:
-            if order_state:
-                if order_state.lots_executed > 0:
-                    list_order_state.append(order_state)
-                    list_order_state.append(False)
-                    logger.error(f'Закрытие позиции: При выполнении заявки произошла ошибка {e}')
-                    return list_order_state
-                else:
-                    raise Exception(f'Закрытие позиции: Заявка не выполнена {e}')
-
-    else:
-        logger.info(f'Закрытие позиции: Заявка не выполнена за {count * retry_interval} сек.')
-        try:
-            time_cancel = await connect.client.orders.cancel_order(account_id=ACCOUNT_ID, order_id=order_response_id)
-            logger.info(f'Закрытие позиции: Заявка на {context.history_instrument.instrument_info.name} '
-                        f'{order_state.lots_executed} / {order_state.lots_requested} '
-                        f'лотов отменена в {time_cancel}')
-            list_order_state.append(order_state)
-            list_order_state.append(False)
-            return list_order_state
-        except Exception as e:
-            raise Exception(f'При отмене заявки произошла ошибка {e}')
+    order = await manage_order(connect, context, result, order_params['quantity'], price, min_price_increment,
+                               timeout=count * retry_interval, retry_interval=retry_interval)
+    if order.status == OrderStatus.FILLED:
+        logger.info(f'Позиция {context.history_instrument.instrument_info.name} закрыта')
+        return order.history + [order.state]
+    if order.lots_executed > 0 or order.status == OrderStatus.EXPIRED:
+        logger.info(f'Закрытие позиции: Позиция {context.history_instrument.instrument_info.name} '
+                    f'закрыта не полностью {order.lots_executed} / {order.state.lots_requested} лотов '
+                    f'({order.status.name})')
+        return order.history + [order.state, False]
+    raise Exception(f'Закрытие позиции: Заявка не выполнена {order.status.name}')
 
 
 async def replace_order(connect: 'ConnectTinkoff', context: 'StrategyContext',
@@ -526,9 +574,10 @@ async def replace_order(connect: 'ConnectTinkoff', context: 'StrategyContext',
     return new_order
 
 
+@metrics.timed()
 async def get_rub_price(connect, context, price) -> tuple[Decimal, Decimal, Decimal]:
-    margin_response: GetFuturesMarginResponse = await connect.client.instruments.get_futures_margin(
-        instrument_id=context.history_instrument.instrument_info.uid
+    margin_response: GetFuturesMarginResponse = await connect.margin_cache.get(
+        connect.client, context.history_instrument.instrument_info.uid
     )
     min_price_increment = margin_response.min_price_increment
     min_price_increment_amount = margin_response.min_price_increment_amount
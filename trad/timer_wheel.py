@@ -0,0 +1,75 @@
+"""
+Хешированное колесо таймеров: таймауты множества заявок обслуживаются одним циклом,
+без отдельной спящей корутины на каждый таймер. Постановка и снятие таймера – O(1),
+продвижение колеса – O(число слотов за прошедшее время + сработавшие таймеры).
+"""
+from __future__ import annotations
+
+import math
+import time
+from typing import Callable, Hashable, Optional
+
+
+class TimerWheel:
+    """
+    Колесо из slots слотов по tick секунд. Таймер длиннее одного оборота хранит число оставшихся оборотов.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512, clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        :param tick: Длительность одного слота в секундах (точность таймеров).
+        :param slots: Количество слотов в колесе.
+        :param clock: Источник времени.
+        """
+        self.tick = tick
+        self.clock = clock
+        self.slots: list[dict[Hashable, int]] = [{} for _ in range(slots)]
+        self.position = 0
+        self.last = clock()
+        self._where: dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where
+
+    def schedule(self, key: Hashable, delay: float) -> None:
+        """
+        Ставит таймер key через delay секунд от текущего момента clock(), даже если колесо давно не продвигали.
+        Таймер с тем же ключом переставляется.
+        """
+        self.cancel(key)
+        now = self.clock()
+        if not self._where:
+            # Пустое колесо простаивало: пропущенные слоты догонять незачем.
+            self.last = now
+        ticks = max(1, math.ceil((now - self.last + delay) / self.tick))
+        slot = (self.position + ticks) % len(self.slots)
+        self.slots[slot][key] = (ticks - 1) // len(self.slots)
+        self._where[key] = slot
+
+    def cancel(self, key: Hashable) -> None:
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self.slots[slot].pop(key, None)
+
+    def advance(self, now: Optional[float] = None) -> list[Hashable]:
+        """
+        Продвигает колесо до момента now.
+        :return: Ключи сработавших таймеров в порядке срабатывания.
+        """
+        now = self.clock() if now is None else now
+        fired = []
+        while self.last + self.tick <= now:
+            self.last += self.tick
+            self.position = (self.position + 1) % len(self.slots)
+            bucket = self.slots[self.position]
+            for key, rounds in list(bucket.items()):
+                if rounds:
+                    bucket[key] = rounds - 1
+                else:
+                    del bucket[key]
+                    del self._where[key]
+                    fired.append(key)
+        return fired
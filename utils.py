@@ -9,14 +9,13 @@ import math
 import os
 import uuid
 from decimal import Decimal
-from functools import lru_cache
 from zoneinfo import ZoneInfo
 
 from tinkoff.invest import MarketDataResponse, PortfolioStreamResponse, PositionsStreamResponse, \
     TradesStreamResponse, OrderDirection
 from tinkoff.invest.utils import quotation_to_decimal, money_to_decimal
 
-from data_create.historic_future import HistoricInstrument
+from trad.instrument_names import instrument_names
 
 logger = logging.getLogger(__name__)
 
@@ -109,26 +108,6 @@ def market_data_response_to_string(msg: MarketDataResponse) -> str:
     return string
 
 
-def create_folder_and_save_historic_instruments(historic_instruments: HistoricInstrument):
-    """
-    Создаёт папку с историческими данными и сохраняет в нее данныe.
-    :param historic_instruments: Данные для сохранения.
-    """
-    if not os.path.exists('my_data_folder'):
-        os.mkdir('my_data_folder')
-    src = os.path.join('my_data_folder', historic_instruments.instrument_info.name)
-    if not os.path.exists(src):
-        os.mkdir(src)
-    path = os.path.join('my_data_folder', historic_instruments.instrument_info.name,
-                        historic_instruments.instrument_info.figi)
-    historic_instruments.create_donchian_canal(20, 10)
-    historic_instruments.save_to_csv(
-        path=path,
-        index=False
-    )
-    return path
-
-
 def new_save_subs(dict_subs):
     with open('subscribe.json', 'r') as file:
         subs = json.load(file)
@@ -214,11 +193,11 @@ def position_to_string(position: PositionsStreamResponse) -> str:
     return string
 
 
-@lru_cache
 def figi_to_name(figi: str) -> str:
-    with open('figi_to_name.json', 'r') as f:
-        name_dict: dict[str, str] = json.load(f)
-    return name_dict[figi]
+    """
+    Название инструмента из кэша в памяти, без файловых операций. Для неизвестного figi возвращается сам figi.
+    """
+    return instrument_names.get(figi)
 
 
 def calculation_quantity(price_rub_one_point: Decimal, portfolio: Decimal, atr: Decimal) -> int: